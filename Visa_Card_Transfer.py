@@ -1,8 +1,8 @@
-import psycopg2
+import pg_pool
+import row_convert
+import tracing
 from isheet_controller import sheet_update
-from decimal import Decimal
 from dotenv import load_dotenv
-import datetime
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 # Load environment variables from .env file
@@ -23,7 +23,7 @@ queries = {
         card_txn_log ctl
     where
         --status = 'SUCCESS'
-        create_date::date = CURRENT_DATE
+        create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
     group by
         hour,
         bank_name,
@@ -39,7 +39,7 @@ queries = {
     FROM
         card_txn_log
     WHERE 
-        create_date::date >= NOW() - INTERVAL '30 days'
+        create_date >= CURRENT_DATE - interval '29 days'
         AND create_date <= NOW() - INTERVAL '5 minutes'
     GROUP BY
         bank_name
@@ -56,7 +56,7 @@ queries = {
         bank_totals bt
         ON ctl.bank_name = bt.bank_name
     WHERE 
-        create_date::date >= NOW() - INTERVAL '30 days'
+        create_date >= CURRENT_DATE - interval '29 days'
         AND create_date <= NOW() - INTERVAL '5 minutes'
     GROUP BY
         date, ctl.bank_name, ctl.status, bt.total_amount_per_bank
@@ -76,7 +76,7 @@ queries = {
         FROM
             card_txn_log
         WHERE
-            DATE(create_date) = CURRENT_DATE;
+            create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day';
     """,
 
     "visa_dispute_count_amount": """
@@ -191,7 +191,7 @@ queries = {
     WHERE 
         ctl.status = 'REVERSE'
         AND rl.request ILIKE '%VisaFundTransferDto%'
-        AND ctl.create_date::date = CURRENT_DATE
+        AND ctl.create_date >= CURRENT_DATE AND ctl.create_date < CURRENT_DATE + interval '1 day'
     ORDER BY 
         hour DESC;
     """
@@ -199,18 +199,7 @@ queries = {
 # Function to fetch data from the database
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
@@ -221,13 +210,10 @@ def process_query(service_name, query, db_params, dbname, headers, sheet_name):
     data = [headers]
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
+        with tracing.span("transform", rows=len(result)):
+            for converted_row in row_convert.convert_rows(result, result.description):
+                if len(converted_row) == len(headers):
+                    data.append(converted_row)
 
         sheet_update(data, sheet_name)
         print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
@@ -275,7 +261,7 @@ def VISA_Transfers():
     with ThreadPoolExecutor(max_workers=5) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params,
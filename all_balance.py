@@ -1,8 +1,8 @@
-import psycopg2
+import pg_pool
+import row_convert
+import tracing
 from isheet_controller import sheet_update
-from decimal import Decimal
 from dotenv import load_dotenv
-import datetime
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -106,21 +106,15 @@ queries = {
         AND request ILIKE '%http://api.shl.com.bd:8282/recharge %';
     """
 }
+# Query results are reused for this many seconds (see query_cache). The
+# latest vendor balance changes with every top-up, so this stays below the
+# job's interval in main_controller, and each refresh reads it again
+BALANCE_QUERY_TTL = float(os.getenv("BALANCE_QUERY_TTL", 60))
+
 # Function to fetch data from the database
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname, ttl=BALANCE_QUERY_TTL)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
@@ -131,13 +125,10 @@ def process_query(service_name, query, db_params, dbname, headers, sheet_name):
     data = [headers]
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
+        with tracing.span("transform", rows=len(result)):
+            for converted_row in row_convert.convert_rows(result, result.description):
+                if len(converted_row) == len(headers):
+                    data.append(converted_row)
 
         sheet_update(data, sheet_name)
         print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
@@ -172,7 +163,7 @@ def all_balance():
     with ThreadPoolExecutor(max_workers=5) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params,
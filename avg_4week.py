@@ -1,343 +1,200 @@
-import psycopg2
+import pg_pool
+import row_convert
+import tracing
 from isheet_controller import sheet_update
-from decimal import Decimal
 from dotenv import load_dotenv
 import datetime
 import os
+import local_store
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Queries
-queries = {
+# Closed hours are kept in a local store and only hours not recorded yet are
+# queried. Hours closed less than BASELINE_RECHECK_HOURS ago are queried again
+# on every run, so late status changes still make it into the baseline.
+BASELINE_STORE = "baseline_store.sqlite3"
+BASELINE_WINDOW = datetime.timedelta(weeks=4)
+BASELINE_RECHECK_HOURS = int(os.getenv("BASELINE_RECHECK_HOURS", 3))
+
+BASELINE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS baseline_hours (
+    service TEXT NOT NULL,
+    hour_start TEXT NOT NULL,
+    avg_count INTEGER NOT NULL,
+    today_count INTEGER NOT NULL,
+    PRIMARY KEY (service, hour_start)
+);
+"""
+
+# Hourly failure counts per service for the hours in [start, end), as
+# (day, hour, count for the 4-week average, count for today's line)
+baseline_queries = {
     "threshold_sqr": """
-            WITH avg_thresholds AS (
-        SELECT 
-            hour,
-            'last 4week not success avg' as txn,
-            ROUND(AVG(transaction_count), 2) as txn_count
-        FROM (
-            SELECT
-                to_char(rl.create_date, 'HH24') as hour,
-                COUNT(*) as transaction_count
-            FROM 
-                tallypay_issuer.public.request_log rl
-            WHERE 
-                rl.create_date >= NOW() - interval '4 weeks'
-                AND rl.request_id IS NOT NULL
-                AND rl.request NOT ILIKE '%hex%'
-                AND rl.response NOT ILIKE '%{%NPSB transfer credit%}%'
-                AND rl.create_date <= NOW() - interval '5 minutes'
-            GROUP BY 
-                to_char(rl.create_date, 'HH24'), to_char(rl.create_date, 'IW'), to_char(rl.create_date, 'YYYY-MM-DD')
-        ) as weekly_data
-        GROUP BY 
-            hour
-    ),
-    current_day_data AS (
-        SELECT 
+        SELECT
+            to_char(rl.create_date, 'YYYY-MM-DD') as day,
             to_char(rl.create_date, 'HH24') as hour,
-            'today not success' as txn,
-            COUNT(*) as txn_count
-        FROM 
+            COUNT(*) as avg_count,
+            COUNT(*) as today_count
+        FROM
             tallypay_issuer.public.request_log rl
-        WHERE 
-            rl.create_date::date = CURRENT_DATE
+        WHERE
+            rl.create_date >= %(start)s
+            AND rl.create_date < %(end)s
             AND rl.create_date <= NOW() - interval '5 minutes'
             AND rl.request_id IS NOT NULL
-            AND rl.request NOT ILIKE '%hex%'
-            AND rl.response NOT ILIKE '%{%NPSB transfer credit%}%'
-        GROUP BY 
-            hour
-    )
-    -- Combining the two datasets
-    SELECT * FROM (
-        SELECT * FROM avg_thresholds
-        UNION ALL
-        SELECT * FROM current_day_data
-    ) as combined_data
-    ORDER BY hour, txn;
+            AND rl.request NOT ILIKE '%%hex%%'
+            AND rl.response NOT ILIKE '%%{%%NPSB transfer credit%%}%%'
+        GROUP BY
+            day, hour;
     """,
 
     "threshold_recharge": """
-        WITH avg_thresholds AS (
-        SELECT 
-            hour,  -- No alias needed here yet
-            'last 4week not success avg' as txn,
-            ROUND(AVG(transaction_count), 2) as txn_count
-        FROM (
-            SELECT
-                to_char(tui.create_date, 'HH24') as hour,  -- Alias 'tui' used here
-                COUNT(*) as transaction_count
-            FROM 
-                topup_service.public.top_up_info tui  -- Alias 'tui' defined for the table
-            WHERE 
-                tui.create_date >= NOW() - interval '4 weeks'
-                AND tui.status != 'SUCCESS'
-                AND tui.create_date <= NOW() - interval '5 minutes'
-            GROUP BY 
-                to_char(tui.create_date, 'HH24'), to_char(tui.create_date, 'IW'), to_char(tui.create_date, 'YYYY-MM-DD')
-        ) as weekly_data
-        GROUP BY 
-            hour
-    ),
-    current_day_data AS (
-        SELECT 
-            to_char(tui.create_date, 'HH24') as hour,  -- Alias 'tui' used here
-            'today not success' as txn,
-            COUNT(*) as txn_count
-        FROM 
-            topup_service.public.top_up_info tui  -- Alias 'tui' defined here for the table
-        WHERE 
-            tui.create_date::date = CURRENT_DATE
-            AND tui.status NOT IN ('SUCCESS', 'CHECKOUT')
+        SELECT
+            to_char(tui.create_date, 'YYYY-MM-DD') as day,
+            to_char(tui.create_date, 'HH24') as hour,
+            COUNT(*) as avg_count,
+            -- Today's line also leaves out CHECKOUT
+            SUM(CASE WHEN tui.status != 'CHECKOUT' THEN 1 ELSE 0 END) as today_count
+        FROM
+            topup_service.public.top_up_info tui
+        WHERE
+            tui.create_date >= %(start)s
+            AND tui.create_date < %(end)s
             AND tui.create_date <= NOW() - interval '5 minutes'
-        GROUP BY 
-            hour
-    )
-    -- Combining the two datasets
-    SELECT * FROM (
-        SELECT * FROM avg_thresholds
-        UNION ALL
-        SELECT * FROM current_day_data
-    ) as combined_data
-    ORDER BY hour, txn;
+            AND tui.status != 'SUCCESS'
+        GROUP BY
+            day, hour;
     """,
 
     "threshold_nagad_AM_q": """
-           WITH avg_thresholds AS (
-        SELECT 
-            hour,
-            'last 4week not success avg' as txn,
-            ROUND(AVG(transaction_count), 2) as txn_count
-        FROM (
-            SELECT
-                to_char(create_date, 'HH24') as hour,
-                COUNT(*) as transaction_count
-            FROM 
-                public.nagad_txn  -- replace 'public' with the correct schema if needed
-            WHERE 
-                create_date >= NOW() - interval '4 weeks'
-                AND nagad_status = 'Failed'
-                AND create_date <= NOW() - interval '5 minutes'
-            GROUP BY 
-                to_char(create_date, 'HH24'), to_char(create_date, 'IW'), to_char(create_date, 'YYYY-MM-DD')
-        ) as weekly_data
-        GROUP BY 
-            hour
-    ),
-    current_day_data AS (
-        SELECT 
+        SELECT
+            to_char(create_date, 'YYYY-MM-DD') as day,
             to_char(create_date, 'HH24') as hour,
-            'today not success' as txn,
-            COUNT(*) as txn_count
-        FROM 
-            public.nagad_txn  -- replace 'public' with the correct schema if needed
-        WHERE 
-            create_date::date = CURRENT_DATE
-            AND nagad_status = 'Failed'
+            COUNT(*) as avg_count,
+            COUNT(*) as today_count
+        FROM
+            public.nagad_txn
+        WHERE
+            create_date >= %(start)s
+            AND create_date < %(end)s
             AND create_date <= NOW() - interval '5 minutes'
-        GROUP BY 
-            hour
-    )
-    -- Combining the two datasets
-    SELECT * FROM (
-        SELECT * FROM avg_thresholds
-        UNION ALL
-        SELECT * FROM current_day_data
-    ) as combined_data
-    ORDER BY hour, txn;
+            AND nagad_status = 'Failed'
+        GROUP BY
+            day, hour;
     """,
 
     "threshold_nagad_mo": """
-                WITH avg_thresholds AS (
-        SELECT 
-            hour,
-            'last 4week not success avg' as txn,
-            ROUND(AVG(transaction_count), 2) as txn_count
-        FROM (
-            SELECT
-                to_char(create_date, 'HH24') as hour,
-                COUNT(*) as transaction_count
-            FROM 
-                public.transaction_info  -- replace 'public' with the correct schema if needed
-            WHERE 
-                create_date >= NOW() - interval '4 weeks'
-                AND financial_institute = 'NAGAD'
-                AND status NOT IN ('SUCCESS')
-                AND create_date <= NOW() - interval '5 minutes'
-            GROUP BY 
-                to_char(create_date, 'HH24'), to_char(create_date, 'IW'), to_char(create_date, 'YYYY-MM-DD')
-        ) as weekly_data
-        GROUP BY 
-            hour
-    ),
-    current_day_data AS (
-        SELECT 
+        SELECT
+            to_char(create_date, 'YYYY-MM-DD') as day,
             to_char(create_date, 'HH24') as hour,
-            'today not success' as txn,
-            COUNT(*) as txn_count
-        FROM 
-            public.transaction_info  -- replace 'public' with the correct schema if needed
-        WHERE 
-            create_date::date = CURRENT_DATE
+            COUNT(*) as avg_count,
+            COUNT(*) as today_count
+        FROM
+            public.transaction_info
+        WHERE
+            create_date >= %(start)s
+            AND create_date < %(end)s
+            AND create_date <= NOW() - interval '5 minutes'
             AND financial_institute = 'NAGAD'
             AND status NOT IN ('SUCCESS')
-            AND create_date <= NOW() - interval '5 minutes'
-        GROUP BY 
-            hour
-    )
-    -- Combine both average and current day data
-    SELECT * FROM (
-        SELECT * FROM avg_thresholds
-        UNION ALL
-        SELECT * FROM current_day_data
-    ) as combined_data
-    ORDER BY hour, txn;
+        GROUP BY
+            day, hour;
     """,
 
     "threshold_rocket_am": """
-            WITH avg_thresholds AS (
-        SELECT 
-            hour,
-            'last 4week not success avg' as txn,
-            ROUND(AVG(transaction_count), 2) as txn_count
-        FROM (
-            SELECT
-                to_char(create_date, 'HH24') as hour,
-                COUNT(*) as transaction_count
-            FROM 
-                public.dbbl_transaction -- replace 'public' with the correct schema if needed
-            WHERE 
-                create_date >= NOW() - interval '4 weeks'
-                AND status NOT IN ('SUCCESS')
-                AND create_date <= NOW() - interval '5 minutes'
-            GROUP BY 
-                to_char(create_date, 'HH24'), to_char(create_date, 'IW'), to_char(create_date, 'YYYY-MM-DD')
-        ) as weekly_data
-        GROUP BY 
-            hour
-    ),
-    current_day_data AS (
-        SELECT 
+        SELECT
+            to_char(create_date, 'YYYY-MM-DD') as day,
             to_char(create_date, 'HH24') as hour,
-            'today not success' as txn,
-            COUNT(*) as txn_count
-        FROM 
-            public.dbbl_transaction  -- replace 'public' with the correct schema if needed
-        WHERE 
-            create_date::date = CURRENT_DATE
-            AND status NOT IN ('SUCCESS')
+            COUNT(*) as avg_count,
+            COUNT(*) as today_count
+        FROM
+            public.dbbl_transaction
+        WHERE
+            create_date >= %(start)s
+            AND create_date < %(end)s
             AND create_date <= NOW() - interval '5 minutes'
-        GROUP BY 
-            hour
-    )
-    -- Combining the two datasets
-    SELECT * FROM (
-        SELECT * FROM avg_thresholds
-        UNION ALL
-        SELECT * FROM current_day_data
-    ) as combined_data
-    ORDER BY hour, txn;
+            AND status NOT IN ('SUCCESS')
+        GROUP BY
+            day, hour;
     """,
 
-
     "threshold_rocket_mo": """
-            WITH avg_thresholds AS (
-        SELECT 
-            hour,
-            'last 4week not success avg' as txn,
-            ROUND(AVG(transaction_count), 2) as txn_count
-        FROM (
-            SELECT
-                to_char(create_date, 'HH24') as hour,
-                COUNT(*) as transaction_count
-            FROM 
-                public.transaction_info  -- replace 'public' with the correct schema if needed
-            WHERE 
-                create_date >= NOW() - interval '4 weeks'
-                AND financial_institute = 'ROCKET'
-                AND status NOT IN ('SUCCESS')
-                AND create_date <= NOW() - interval '5 minutes'
-            GROUP BY 
-                to_char(create_date, 'HH24'), to_char(create_date, 'IW'), to_char(create_date, 'YYYY-MM-DD')
-        ) as weekly_data
-        GROUP BY 
-            hour
-    ),
-    current_day_data AS (
-        SELECT 
+        SELECT
+            to_char(create_date, 'YYYY-MM-DD') as day,
             to_char(create_date, 'HH24') as hour,
-            'today not success' as txn,
-            COUNT(*) as txn_count
-        FROM 
-            public.transaction_info  -- replace 'public' with the correct schema if needed
-        WHERE 
-            create_date::date = CURRENT_DATE
+            COUNT(*) as avg_count,
+            COUNT(*) as today_count
+        FROM
+            public.transaction_info
+        WHERE
+            create_date >= %(start)s
+            AND create_date < %(end)s
+            AND create_date <= NOW() - interval '5 minutes'
             AND financial_institute = 'ROCKET'
             AND status NOT IN ('SUCCESS')
-            AND create_date <= NOW() - interval '5 minutes'
-        GROUP BY 
-            hour
-    )
-    -- Combine both average and current day data
-    SELECT * FROM (
-        SELECT * FROM avg_thresholds
-        UNION ALL
-        SELECT * FROM current_day_data
-    ) as combined_data
-    ORDER BY hour, txn;
+        GROUP BY
+            day, hour;
     """,
 
     "threshold_cbl": """
-            WITH avg_thresholds AS (
-        SELECT 
-            hour,
-            'last 4week not success avg' as txn,
-            ROUND(AVG(transaction_count), 2) as txn_count
-        FROM (
-            SELECT
-                to_char(issue_time + interval '6 hours', 'HH24') as hour,
-                COUNT(*) as transaction_count
-            FROM 
-                backend_db.public.bank_txn_request btr
-            WHERE 
-                (issue_time + interval '6 hours') >= NOW() - interval '4 weeks'
-                AND btr.channel = 'CBL'
-                AND btr.status != 'SUCCESS'
-                AND (issue_time + interval '6 hours') <= NOW() - interval '5 minutes'
-            GROUP BY 
-                to_char(issue_time + interval '6 hours', 'HH24'), to_char(issue_time + interval '6 hours', 'IW'), to_char(issue_time + interval '6 hours', 'YYYY-MM-DD')
-        ) as weekly_data
-        GROUP BY 
-            hour
-    ),
-    current_day_data AS (
-        SELECT 
+        SELECT
+            to_char(issue_time + interval '6 hours', 'YYYY-MM-DD') as day,
             to_char(issue_time + interval '6 hours', 'HH24') as hour,
-            'today not success' as txn,
-            COUNT(*) as txn_count
-        FROM 
+            COUNT(*) as avg_count,
+            COUNT(*) as today_count
+        FROM
             backend_db.public.bank_txn_request btr
-        WHERE 
-            (issue_time + interval '6 hours')::date = CURRENT_DATE
+        WHERE
+            issue_time >= %(start)s - interval '6 hours'
+            AND issue_time < %(end)s - interval '6 hours'
+            AND issue_time <= NOW() - interval '5 minutes' - interval '6 hours'
             AND btr.channel = 'CBL'
             AND btr.status != 'SUCCESS'
-            AND (issue_time + interval '6 hours') <= NOW() - interval '5 minutes'
-        GROUP BY 
-            hour
-    )
-    -- Combine both average and current day data
-    SELECT * FROM (
-        SELECT * FROM avg_thresholds
-        UNION ALL
-        SELECT * FROM current_day_data
-    ) as combined_data
-    ORDER BY hour, txn;
+        GROUP BY
+            day, hour;
     """,
 
+    "visa_threshold": """
+        SELECT
+            to_char(create_date, 'YYYY-MM-DD') as day,
+            to_char(create_date, 'HH24') as hour,
+            COUNT(*) as avg_count,
+            COUNT(*) as today_count
+        FROM
+            card_txn_log
+        WHERE
+            create_date >= %(start)s
+            AND create_date < %(end)s
+            AND create_date <= NOW() - interval '5 minutes'
+            AND status NOT IN ('SUCCESS')
+        GROUP BY
+            day, hour;
+    """,
+
+    "npsb_threshold": """
+        SELECT
+            to_char(create_date, 'YYYY-MM-DD') as day,
+            to_char(create_date, 'HH24') as hour,
+            COUNT(*) as avg_count,
+            COUNT(*) as today_count
+        FROM
+            bank_transaction_info
+        WHERE
+            create_date >= %(start)s
+            AND create_date < %(end)s
+            AND create_date <= NOW() - interval '5 minutes'
+            AND channel IN ('NPSB', 'MTB')
+            AND status NOT IN ('SUCCESS')
+        GROUP BY
+            day, hour;
+    """
+}
 
+# Queries run live on every cycle. BEFTN statuses keep changing for days, so
+# its hours are not stored; it compares the day 3 days back instead of today.
+queries = {
     "beftn_threshold": """
         WITH avg_thresholds AS (
             SELECT 
@@ -351,10 +208,10 @@ queries = {
                 FROM 
                     backend_db.public.bank_txn_request btr
                 WHERE 
-                    (issue_time + interval '6 hours') >= NOW() - interval '4 weeks'
+                    issue_time >= NOW() - interval '4 weeks' - interval '6 hours'
                     AND btr.channel = 'BEFTN'
                     AND btr.status NOT IN ('SUCCESS', 'REQUESTED')
-                    AND (issue_time + interval '6 hours')::date <= CURRENT_DATE - interval '3 days'
+                    AND issue_time < CURRENT_DATE - interval '2 days' - interval '6 hours'
                 GROUP BY 
                     to_char(issue_time + interval '6 hours', 'HH24'), to_char(issue_time + interval '6 hours', 'IW'), to_char(issue_time + interval '6 hours', 'YYYY-MM-DD')
             ) as weekly_data
@@ -369,7 +226,7 @@ queries = {
             FROM 
                 backend_db.public.bank_txn_request btr
             WHERE 
-                (issue_time + interval '6 hours')::date = CURRENT_DATE - interval '3 days'
+                issue_time >= CURRENT_DATE - interval '3 days' - interval '6 hours' AND issue_time < CURRENT_DATE - interval '2 days' - interval '6 hours'
                 AND btr.channel = 'BEFTN'
                 AND btr.status NOT IN ('SUCCESS', 'REQUESTED')
             GROUP BY 
@@ -381,114 +238,13 @@ queries = {
             SELECT * FROM current_day_data
         ) as combined_data
         ORDER BY hour, txn;
-    """,
-
-    "visa_threshold": """
-        WITH avg_thresholds AS (
-            SELECT 
-                hour,
-                'last 4week not success avg' as txn,
-                ROUND(AVG(transaction_count), 2) as txn_count
-            FROM (
-                SELECT
-                    to_char(create_date, 'HH24') as hour,
-                    COUNT(*) as transaction_count
-                FROM 
-                    card_txn_log
-                WHERE 
-                    create_date >= NOW() - interval '4 weeks'
-                    AND status NOT IN ('SUCCESS')
-                    AND create_date <= NOW() - interval '5 minutes'
-                GROUP BY 
-                    to_char(create_date, 'HH24'), to_char(create_date, 'IW'), to_char(create_date, 'YYYY-MM-DD')
-            ) as weekly_data
-            GROUP BY 
-                hour
-        ),
-        current_day_data AS (
-            SELECT 
-                to_char(create_date, 'HH24') as hour,
-                'today not success' as txn,
-                COUNT(*) as txn_count
-            FROM 
-                card_txn_log
-            WHERE 
-                create_date::date = CURRENT_DATE
-                AND status NOT IN ('SUCCESS')
-                AND create_date <= NOW() - interval '5 minutes'
-            GROUP BY 
-                hour
-        )
-        SELECT * FROM (
-            SELECT * FROM avg_thresholds
-            UNION ALL
-            SELECT * FROM current_day_data
-        ) as combined_data
-        ORDER BY hour, txn;
-    """,
-
-    "npsb_threshold": """
-        WITH avg_thresholds AS (
-            SELECT 
-                hour,
-                'last 4week not success avg' as txn,
-                ROUND(AVG(transaction_count), 2) as txn_count
-            FROM (
-                SELECT
-                    to_char(create_date, 'HH24') as hour,
-                    COUNT(*) as transaction_count
-                FROM 
-                    bank_transaction_info
-                WHERE 
-                    create_date >= NOW() - interval '4 weeks'
-                    AND channel IN ('NPSB', 'MTB')
-                    AND status NOT IN ('SUCCESS')
-                    AND create_date <= NOW() - interval '5 minutes'
-                GROUP BY 
-                    to_char(create_date, 'HH24'), to_char(create_date, 'IW'), to_char(create_date, 'YYYY-MM-DD')
-            ) as weekly_data
-            GROUP BY 
-                hour
-        ),
-        current_day_data AS (
-            SELECT 
-                to_char(create_date, 'HH24') as hour,
-                'today not success' as txn,
-                COUNT(*) as txn_count
-            FROM 
-                bank_transaction_info
-            WHERE 
-                create_date::date = CURRENT_DATE
-                AND channel IN ('NPSB', 'MTB')
-                AND status NOT IN ('SUCCESS')
-                AND create_date <= NOW() - interval '5 minutes'
-            GROUP BY 
-                hour
-        )
-        SELECT * FROM (
-            SELECT * FROM avg_thresholds
-            UNION ALL
-            SELECT * FROM current_day_data
-        ) as combined_data
-        ORDER BY hour, txn;
     """
 }
 
 # Function to fetch data from the database
-def fetch_data(query, db_params, dbname):
+def fetch_data(query, db_params, dbname, params=None):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname, params)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
@@ -499,19 +255,111 @@ def process_query(service_name, query, db_params, dbname, headers, sheet_name):
     data = [headers]
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
+        with tracing.span("transform", rows=len(result)):
+            for converted_row in row_convert.convert_rows(result, result.description):
+                if len(converted_row) == len(headers):
+                    data.append(converted_row)
 
         sheet_update(data, sheet_name)
         print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
     else:
         print(f"No data returned for {service_name}")
 
+# Function to load a service's stored hourly counts from window_start on
+def load_baseline(service_name, window_start):
+    with local_store.connect(BASELINE_STORE, BASELINE_SCHEMA) as conn:
+        rows = conn.execute(
+            "SELECT hour_start, avg_count, today_count FROM baseline_hours "
+            "WHERE service = ? AND hour_start >= ?",
+            (service_name, window_start.strftime('%Y-%m-%d %H:%M'))
+        ).fetchall()
+    return {
+        datetime.datetime.strptime(hour_start, '%Y-%m-%d %H:%M'): (avg_count, today_count)
+        for hour_start, avg_count, today_count in rows
+    }
+
+# Function to record closed hours and drop the ones outside the window
+def save_baseline(service_name, counts, window_start):
+    with local_store.connect(BASELINE_STORE, BASELINE_SCHEMA) as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO baseline_hours (service, hour_start, avg_count, today_count) "
+            "VALUES (?, ?, ?, ?)",
+            [(service_name, hour.strftime('%Y-%m-%d %H:%M'), avg_count, today_count)
+             for hour, (avg_count, today_count) in counts.items()]
+        )
+        conn.execute(
+            "DELETE FROM baseline_hours WHERE service = ? AND hour_start < ?",
+            (service_name, window_start.strftime('%Y-%m-%d %H:%M'))
+        )
+
+# Function to group hour starts into contiguous [start, end) ranges
+def hour_ranges(hours):
+    ranges = []
+    for hour in sorted(hours):
+        if ranges and ranges[-1][1] == hour:
+            ranges[-1][1] = hour + datetime.timedelta(hours=1)
+        else:
+            ranges.append([hour, hour + datetime.timedelta(hours=1)])
+    return ranges
+
+# Function to build a service's threshold rows from the baseline store,
+# querying only the hours it does not have yet plus the current partial hour
+def baseline_rows(service_name, query, db_params, dbname):
+    # Hours are bucketed in the database's session time zone
+    result = fetch_data("SELECT date_trunc('hour', LOCALTIMESTAMP)", db_params, dbname)
+    if not result:
+        return None
+    one_hour = datetime.timedelta(hours=1)
+    current_hour = result[0][0]
+    window_start = current_hour - BASELINE_WINDOW + one_hour
+    recheck_from = current_hour - datetime.timedelta(hours=BASELINE_RECHECK_HOURS)
+
+    counts = load_baseline(service_name, window_start)
+    to_fetch = [current_hour]
+    hour = window_start
+    while hour < current_hour:
+        if hour not in counts or hour >= recheck_from:
+            to_fetch.append(hour)
+        hour += one_hour
+
+    fetched = {}
+    for start, end in hour_ranges(to_fetch):
+        result = fetch_data(query, db_params, dbname, {"start": start, "end": end})
+        if result is None:
+            return None
+        hour = start
+        while hour < end:
+            fetched[hour] = (0, 0)
+            hour += one_hour
+        for day, hh, avg_count, today_count in result:
+            fetched[datetime.datetime.strptime(f"{day} {hh}", '%Y-%m-%d %H')] = (int(avg_count), int(today_count))
+
+    save_baseline(service_name, {hour: c for hour, c in fetched.items() if hour < current_hour}, window_start)
+    counts.update(fetched)
+
+    with tracing.span("transform", rows=len(counts)):
+        # The average only counts days that had failures in that hour
+        per_hour = {}
+        for hour, (avg_count, _) in counts.items():
+            if avg_count > 0:
+                per_hour.setdefault(hour.hour, []).append(avg_count)
+
+        rows = [[f"{hh:02d}", 'last 4week not success avg', round(sum(values) / len(values), 2)]
+                for hh, values in per_hour.items()]
+        rows += [[f"{hour.hour:02d}", 'today not success', today_count]
+                 for hour, (_, today_count) in counts.items()
+                 if hour.date() == current_hour.date() and today_count > 0]
+    return sorted(rows, key=lambda row: (row[0], row[1]))
+
+# Function to update a service's threshold sheet from the baseline store
+def process_baseline(service_name, query, db_params, dbname, headers, sheet_name):
+    rows = baseline_rows(service_name, query, db_params, dbname)
+    if rows:
+        sheet_update([headers] + rows, sheet_name)
+        print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
+    else:
+        print(f"No data returned for {service_name}")
+
 def threshold_avg():
     db_params = {
         "user": os.getenv("TP_PG_USR"),
@@ -562,7 +410,7 @@ def threshold_avg():
     with ThreadPoolExecutor(max_workers=5) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params,
@@ -572,6 +420,16 @@ def threshold_avg():
             ): service_name
             for service_name, query in queries.items()
         }
+        for service_name, query in baseline_queries.items():
+            future_to_service[executor.submit(
+                tracing.bind(process_baseline, query_key=service_name),
+                service_name,
+                query,
+                db_params,
+                db_mapping[service_name],
+                headers_mapping[service_name],
+                sheet_mapping[service_name]
+            )] = service_name
 
         for future in as_completed(future_to_service):
             service_name = future_to_service[future]
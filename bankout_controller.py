@@ -1,8 +1,8 @@
-import psycopg2
+import pg_pool
+import row_convert
+import tracing
 from isheet_controller import sheet_update
-from decimal import Decimal
 from dotenv import load_dotenv
-import datetime
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -22,7 +22,7 @@ queries={
                     on btr.id =  btl.np_txn_request_id 
                     where
                         1 = 1
-                        and (btr.issue_time + interval '6 hours')::date >= current_date 
+                        and btr.issue_time >= CURRENT_DATE - interval '6 hours' 
                         and btr.txn_request_type = 'CASH_OUT'
                         and btr.bank_swift_code = 'CIBLBDDH'
                     group by
@@ -46,7 +46,7 @@ queries={
                         on btr.id =  btl.np_txn_request_id 
                         where
                             1 = 1
-                            and (btr.issue_time + interval '6 hours')::date >= current_date - interval '30 days'
+                            and btr.issue_time >= CURRENT_DATE - interval '30 days' - interval '6 hours'
                             and btr.txn_request_type = 'CASH_OUT'
                             and btr.bank_swift_code = 'CIBLBDDH'
                         group by
@@ -74,7 +74,7 @@ queries={
                         btr.id = btl.np_txn_request_id
                     where
                         1 = 1
-                        and (btr.issue_time + interval '6 hours')::date = current_date - interval '3 days'
+                        and btr.issue_time >= CURRENT_DATE - interval '3 days' - interval '6 hours' AND btr.issue_time < CURRENT_DATE - interval '2 days' - interval '6 hours'
                         and btr.txn_request_type = 'CASH_OUT'
                         and btr.bank_swift_code <> 'CIBLBDDH'
                         and btr.channel = 'BEFTN'
@@ -104,8 +104,8 @@ queries={
                         btr.id = btl.np_txn_request_id
                     where
                         1 = 1
-                        and (btr.issue_time + interval '6 hours')::date >= current_date - interval '30 days'
-                        and (btr.issue_time + interval '6 hours')::date <= current_date - interval '3 days'
+                        and btr.issue_time >= CURRENT_DATE - interval '30 days' - interval '6 hours'
+                        and btr.issue_time < CURRENT_DATE - interval '2 days' - interval '6 hours'
                         and btr.txn_request_type = 'CASH_OUT'
                         and btr.bank_swift_code <> 'CIBLBDDH'
                         and btr.channel = 'BEFTN'
@@ -131,7 +131,7 @@ queries={
                             backend_db.public.bank_txn_request btr
                         where
                             1 = 1
-                            and (btr.issue_time + interval '6 hours')::date = current_date - interval '3 days'
+                            and btr.issue_time >= CURRENT_DATE - interval '3 days' - interval '6 hours' AND btr.issue_time < CURRENT_DATE - interval '2 days' - interval '6 hours'
                             and btr.txn_request_type = 'CASH_OUT'
                             and btr.channel = 'BEFTN'
                         group by
@@ -152,8 +152,8 @@ queries={
                         backend_db.public.bank_txn_request btr
                     where
                         1 = 1
-                       and (btr.issue_time + interval '6 hours')::date >= current_date - interval '30 days'
-                        and (btr.issue_time + interval '6 hours')::date <= current_date - interval '3 days'
+                       and btr.issue_time >= CURRENT_DATE - interval '30 days' - interval '6 hours'
+                        and btr.issue_time < CURRENT_DATE - interval '2 days' - interval '6 hours'
                         and btr.txn_request_type = 'CASH_OUT'
                         and btr.channel = 'BEFTN'
                     group by
@@ -167,18 +167,7 @@ queries={
 # Function to fetch data from the database
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
@@ -189,13 +178,10 @@ def process_query(service_name, query, db_params, dbname, headers, sheet_name):
     data = [headers]
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
+        with tracing.span("transform", rows=len(result)):
+            for converted_row in row_convert.convert_rows(result, result.description):
+                if len(converted_row) == len(headers):
+                    data.append(converted_row)
 
         sheet_update(data, sheet_name)
         print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
@@ -239,7 +225,7 @@ def bank_money_out():
     with ThreadPoolExecutor(max_workers=5) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params,
@@ -0,0 +1,209 @@
+import datetime
+import hashlib
+import json
+import os
+from decimal import Decimal
+
+from dotenv import load_dotenv
+
+import local_store
+import pg_pool
+import row_convert
+import tracing
+
+load_dotenv()
+
+# Cohorts grouped by hour or day only query the buckets that can still
+# change. Today's hourly cohorts query the open hour and the hours closed less
+# than HOUR_CACHE_RECHECK_MINUTES ago; the month cohorts query today and the
+# days closed less than DAY_CACHE_RECHECK_HOURS ago, so late status changes
+# are still picked up. Older buckets are served from a local store, so the
+# queried range stays about the same size however long the cohort is.
+BUCKET_CACHE_STORE = "bucket_cache.sqlite3"
+HOUR_CACHE_RECHECK_MINUTES = float(os.getenv("HOUR_CACHE_RECHECK_MINUTES", 60))
+DAY_CACHE_RECHECK_HOURS = float(os.getenv("DAY_CACHE_RECHECK_HOURS", 2))
+# Lag of the cohorts that leave out transactions younger than 5 minutes
+SETTLEMENT_LAG = datetime.timedelta(minutes=5)
+
+# A cache key's buckets are only used while its query_hash (of the query
+# text, database and bucketing) stays the same, so an edited query starts
+# over. Rows are stored as JSON, with values JSON has no type for tagged by
+# encode_value so they come back as the same type
+BUCKET_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket_state (
+    cache_key TEXT PRIMARY KEY,
+    query_hash TEXT NOT NULL,
+    final_before TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bucket_rows (
+    cache_key TEXT NOT NULL,
+    bucket_start TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    row TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bucket_rows_key ON bucket_rows (cache_key, bucket_start);
+"""
+
+BUCKET_FORMAT = '%Y-%m-%d %H:%M'
+
+
+# Function to encode a value JSON cannot hold as {"$type": text}
+def encode_value(value):
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {"$time": value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {"$timedelta": value.total_seconds()}
+    raise TypeError(f"cannot cache a value of type {type(value).__name__}")
+
+
+VALUE_DECODERS = {
+    "$decimal": Decimal,
+    "$datetime": datetime.datetime.fromisoformat,
+    "$date": datetime.date.fromisoformat,
+    "$time": datetime.time.fromisoformat,
+    "$timedelta": lambda seconds: datetime.timedelta(seconds=seconds)
+}
+
+
+# Function to turn a tagged value back into its type
+def decode_value(value):
+    if len(value) == 1:
+        (tag, text), = value.items()
+        if tag in VALUE_DECODERS:
+            return VALUE_DECODERS[tag](text)
+    return value
+
+
+def encode_row(row):
+    return json.dumps(list(row), default=encode_value, separators=(",", ":"))
+
+
+def decode_row(text):
+    return json.loads(text, object_hook=decode_value)
+
+
+# Function to hash what a cache key's rows depend on besides the time range
+def query_hash(query, db_params, dbname, lead):
+    content = json.dumps([query, db_params.get('host'), str(db_params.get('port', '5432')), dbname,
+                          lead.total_seconds()])
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Function to round a timestamp down to its hour
+def floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+# Function to round a timestamp down to its day
+def floor_day(value):
+    return datetime.datetime.combine(value.date(), datetime.time())
+
+
+def _fetch_buckets(cache_key, query, db_params, dbname, end, period_start, final_before, bucket_of,
+                   lead=datetime.timedelta(0), descending=False):
+    """
+    Queries the buckets of [period_start, end) that are not cached yet,
+    stores the ones before final_before and returns them merged with the
+    cached ones. bucket_of(row) gives the start of a row's bucket in
+    BUCKET_FORMAT. lead widens the queried range back, for queries that look
+    at the bucket before the first one; the rows it adds are dropped.
+    """
+    current_hash = query_hash(query, db_params, dbname, lead)
+    with local_store.connect(BUCKET_CACHE_STORE, BUCKET_CACHE_SCHEMA) as conn:
+        state = conn.execute("SELECT query_hash, final_before FROM bucket_state WHERE cache_key = ?",
+                             (cache_key,)).fetchone()
+    if state and state[0] == current_hash:
+        cached_before = datetime.datetime.strptime(state[1], BUCKET_FORMAT)
+    else:
+        # Nothing cached yet, or cached by another version of the query
+        cached_before = period_start
+    start = max(period_start, min(cached_before, final_before))
+
+    result = pg_pool.fetch_all(query, db_params, dbname, {"start": start - lead, "end": end})
+    with tracing.span("transform", rows=len(result)):
+        fresh = row_convert.convert_rows(result, result.description)
+    first, start, final_before = (value.strftime(BUCKET_FORMAT) for value in (period_start, start, final_before))
+    if lead:
+        fresh = [row for row in fresh if bucket_of(row) >= start]
+
+    try:
+        stored = [(cache_key, bucket_of(row), position, encode_row(row))
+                  for position, row in enumerate(fresh)
+                  if bucket_of(row) < final_before]
+    except TypeError as e:
+        # Served uncached; the next run queries the whole period again
+        print(f"Not caching {cache_key}: {e}")
+        stored = None
+
+    with local_store.connect(BUCKET_CACHE_STORE, BUCKET_CACHE_SCHEMA) as conn:
+        cached = [decode_row(row) for (row,) in conn.execute(
+            "SELECT row FROM bucket_rows WHERE cache_key = ? AND bucket_start >= ? AND bucket_start < ? "
+            "ORDER BY bucket_start, position",
+            (cache_key, first, start)
+        )]
+        if stored is None:
+            conn.execute("DELETE FROM bucket_rows WHERE cache_key = ?", (cache_key,))
+            conn.execute("DELETE FROM bucket_state WHERE cache_key = ?", (cache_key,))
+        else:
+            conn.execute(
+                "DELETE FROM bucket_rows WHERE cache_key = ? AND (bucket_start >= ? OR bucket_start < ?)",
+                (cache_key, start, first)
+            )
+            conn.executemany(
+                "INSERT INTO bucket_rows (cache_key, bucket_start, position, row) VALUES (?, ?, ?, ?)", stored
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO bucket_state (cache_key, query_hash, final_before) VALUES (?, ?, ?)",
+                (cache_key, current_hash, final_before)
+            )
+
+    # Cached buckets all come before the queried ones; the sort is stable (in
+    # either direction), so each bucket keeps the order its query gave it
+    return sorted(cached + fresh, key=lambda row: row[0], reverse=descending)
+
+
+def fetch_today(cache_key, query, db_params, dbname, lag=datetime.timedelta(0)):
+    """
+    Returns today's rows of an hourly cohort query, with dates and numerics
+    converted as in row_convert, ordered by hour.
+
+    query must group by the hour as its first column (to_char(..., 'HH24'))
+    and filter its rows to [%(start)s, %(end)s); literal % signs are written
+    as %%. end is the database's clock minus lag.
+    """
+    now = pg_pool.fetch_one("SELECT LOCALTIMESTAMP", db_params, dbname)[0]
+    end = now - lag
+    day_start = floor_day(now)
+    # Hours before final_before are not queried again on later runs
+    final_before = max(day_start, floor_hour(end - datetime.timedelta(minutes=HOUR_CACHE_RECHECK_MINUTES)))
+    day = now.date().isoformat()
+    return _fetch_buckets(cache_key, query, db_params, dbname, end, day_start, final_before,
+                          lambda row: f"{day} {row[0]}:00")
+
+
+def fetch_days(cache_key, query, db_params, dbname, days=30, lag=datetime.timedelta(0),
+               lead_days=0, descending=False):
+    """
+    Returns the rows of a daily cohort query over today and the days-1 days
+    before it, converted as in fetch_today and ordered by day (newest first
+    when descending).
+
+    query must group by the day as its first column (to_char(...,
+    'YYYY-MM-DD')) and filter its rows to [%(start)s, %(end)s). A query that
+    compares each day with the one before it (LAG) sets lead_days=1, so the
+    first queried day still sees its predecessor.
+    """
+    now = pg_pool.fetch_one("SELECT LOCALTIMESTAMP", db_params, dbname)[0]
+    end = now - lag
+    period_start = floor_day(now) - datetime.timedelta(days=days - 1)
+    # Days before final_before are not queried again on later runs
+    final_before = max(period_start, floor_day(end - datetime.timedelta(hours=DAY_CACHE_RECHECK_HOURS)))
+    return _fetch_buckets(cache_key, query, db_params, dbname, end, period_start, final_before,
+                          lambda row: f"{row[0]} 00:00", lead=datetime.timedelta(days=lead_days),
+                          descending=descending)
@@ -1,8 +1,8 @@
-import psycopg2
+import pg_pool
+import row_convert
+import tracing
 from isheet_controller import sheet_update3
-from decimal import Decimal
 from dotenv import load_dotenv
-import datetime
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -81,18 +81,7 @@ order by 1 desc;
 # Function to fetch data from the database
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
@@ -103,13 +92,10 @@ def process_query(service_name, query, db_params, dbname, headers, sheet_name):
     data = [headers]
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
+        with tracing.span("transform", rows=len(result)):
+            for converted_row in row_convert.convert_rows(result, result.description):
+                if len(converted_row) == len(headers):
+                    data.append(converted_row)
 
         sheet_update3(data, sheet_name)
         print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
@@ -147,7 +133,7 @@ def card_add_money():
     with ThreadPoolExecutor(max_workers=5) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params,
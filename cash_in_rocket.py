@@ -1,7 +1,7 @@
-import os
 from dotenv import load_dotenv
 
 import psycopg2
+import pg_pool
 from isheet_controller import sheet_update
 import traceback
 
@@ -23,7 +23,7 @@ def gen_q(q):
                 from
                     nobopay_payment_gw.public.dbbl_transaction dt
                 where
-                    create_date::date = 'now()'
+                    create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
                     and create_date <= now() - interval '5 minutes'
                 group by
                     1,
@@ -48,7 +48,7 @@ def gen_q(q):
                         nobopay_payment_gw.public.dbbl_transaction dt
                     where
                         1 = 1
-                        and create_date::date >= now() - interval '30 days'
+                        and create_date >= CURRENT_DATE - interval '29 days'
                         and create_date <= now() - interval '20 minutes'
                     group by
                         1,
@@ -67,35 +67,11 @@ def gen_q(q):
 
 
 def pg_conn(query):
-    conn = None
-    cur = None
-
     try:
-        # establishing the connection
-        conn = psycopg2.connect(
-            # ---Please change the credentials---
-            database='nobopay_payment_gw',
-            user=os.environ.get("TP_PG_USR"),
-            password=os.environ.get("TP_PG_PWD"),
-            host=os.environ.get("TP_HOST"),
-            port='5432'
-        )
-
-        # ##print('Connection established')
-        cur = conn.cursor()
-        # ##print('Executing query')
-        cur.execute(query)
-        # ##print('Retreiving queryset')
-        queryset = cur.fetchall()
+        queryset = pg_pool.fetch_all(query, pg_pool.env_db_params(), 'nobopay_payment_gw')
     except psycopg2.Error as error:
         queryset = f"Error connecting to Postgres database: {error}"
-    finally:
-        if cur is not None:
-            cur.close()
-        if conn is not None:
-            conn.close()
 
-    # ##print(queryset)
     return queryset
 
 
@@ -0,0 +1,63 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import tracing
+
+load_dotenv()
+
+# Charts are drawn on their own Agg figure, outside pyplot, and saved to
+# memory: jobs drawing at the same time share no figure, file or backend
+# state. A figure is cleared as soon as its PNG is saved. The last
+# CHART_CACHE_SIZE charts are kept by a hash of their name and data, so a
+# chart whose data did not change is not drawn again.
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", 32))
+CHART_DPI = 100
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# Function to hash a chart's name and data; data must be JSON-like, other
+# values (dates, numpy numbers) are hashed by their text
+def chart_key(name, data, **options):
+    content = json.dumps([name, data, options], default=str, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def render(name, data, draw, figsize=(9, 6)):
+    """
+    Returns the PNG bytes of a chart: draw(figure, data) draws data on a new
+    figure of figsize inches. The result is cached by name, data and figsize,
+    so draw must depend on nothing else.
+    """
+    key = chart_key(name, data, figsize=figsize)
+    with _cache_lock:
+        png = _cache.get(key)
+        if png is not None:
+            _cache.move_to_end(key)
+            return png
+
+    with tracing.span("chart", chart=name):
+        figure = Figure(figsize=figsize, dpi=CHART_DPI)
+        FigureCanvasAgg(figure)
+        try:
+            draw(figure, data)
+            buffer = io.BytesIO()
+            figure.savefig(buffer, format="png")
+        finally:
+            figure.clear()
+    png = buffer.getvalue()
+
+    with _cache_lock:
+        _cache[key] = png
+        while len(_cache) > CHART_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return png
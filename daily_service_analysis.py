@@ -1,4 +1,4 @@
-import psycopg2
+import pg_pool
 from isheet_controller import sheet_update
 from decimal import Decimal
 from dotenv import load_dotenv
@@ -29,7 +29,7 @@ queries = {
         1 = 1
         and btr.channel = 'CBL'
         and btr.status = 'SUCCESS'
-        and (btr.issue_time + interval '6 hours')BETWEEN (CURRENT_DATE - INTERVAL '1 day') AND (CURRENT_DATE - INTERVAL '1 second');
+        and btr.issue_time >= CURRENT_DATE - interval '1 day' - interval '6 hours' AND btr.issue_time < CURRENT_DATE - interval '6 hours';
     """,
 
     "BEFTN": """
@@ -41,7 +41,7 @@ queries = {
     where
         1 = 1
         and btr.channel = 'BEFTN'
-        and (btr.issue_time + INTERVAL '6 hours')::date BETWEEN (CURRENT_DATE - INTERVAL '3 days') AND (CURRENT_DATE - INTERVAL '1 day');
+        and btr.issue_time >= CURRENT_DATE - interval '3 days' - interval '6 hours' AND btr.issue_time < CURRENT_DATE - interval '6 hours';
     """,
 
     "Nagad Money in": """
@@ -125,22 +125,13 @@ queries = {
     """
 }
 
+# The totals cover yesterday and only change at midnight, so results are
+# reused for this many seconds (see query_cache)
+DAILY_ANALYSIS_TTL = float(os.getenv("DAILY_ANALYSIS_TTL", 600))
+
 def fetch_data(query, db_params, dbname):
     try:
-        # Connect using only the required parameters including dbname
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-            #port=db_params['port']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_one(query, db_params, dbname, ttl=DAILY_ANALYSIS_TTL)
     except Exception as e:
         #print(f"Error fetching data: {e}")
         return None
@@ -1,14 +1,124 @@
 from __future__ import print_function
+import os
 import os.path
+import datetime
+import hashlib
+import pickle
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+import httplib2
+import google_auth_httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from rate_limiter import TokenBucket
+import local_store
+import tracing
+import metrics
+import snapshot_store
 
 # Define the scopes
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 
+# Spreadsheets the dashboard writes to
+SPREADSHEET_ID = "1fkSAe0FNvO01xV-giOdEU3RQFCNNNml4qJ7pKC8ySe8"
+SPREADSHEET_ID_2 = "1-oIObLpWJ3qUDRx2-tDgYVM-OUJBdtbxnbEOVILTWfU"
+SPREADSHEET_ID_3 = "10OJCcwvgFA3VDJ4xmzEJ9a1jIWgOTNhnparpxLKvdGo"
+# Short names of the spreadsheets in metric labels; other spreadsheets are
+# labelled with their id
+SPREADSHEET_ALIASES = {SPREADSHEET_ID: "sheet1", SPREADSHEET_ID_2: "sheet2", SPREADSHEET_ID_3: "sheet3"}
+
+# Tabs are written to columns A:Z
+SHEET_COLUMNS = 26
+
+# Diff-based writes fall back to a full rewrite of the tab when more than this
+# share of rows changed, when the changes span more than DIFF_MAX_RANGES
+# separate row ranges, or when the last full rewrite is older than
+# DIFF_FULL_REWRITE_AFTER seconds (to repair any edits made by hand)
+DIFF_MAX_CHANGED_RATIO = float(os.getenv("SHEETS_DIFF_MAX_CHANGED_RATIO", 0.5))
+DIFF_MAX_RANGES = int(os.getenv("SHEETS_DIFF_MAX_RANGES", 20))
+DIFF_FULL_REWRITE_AFTER = float(os.getenv("SHEETS_DIFF_FULL_REWRITE_AFTER", 3600))
+
+# Row hashes of what was last written to each tab are kept in a local store,
+# so runs started by cron diff against the previous run's write. They are
+# dropped when the tab's sheetId or grid size no longer matches what was
+# written, since the tab was then recreated or resized by someone else
+WRITE_STATE_STORE = "sheet_write_state.sqlite3"
+WRITE_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tab_writes (
+    spreadsheet_id TEXT NOT NULL,
+    tab TEXT NOT NULL,
+    sheet_id INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    column_count INTEGER NOT NULL,
+    full_write_at REAL NOT NULL,
+    row_hashes BLOB NOT NULL,
+    PRIMARY KEY (spreadsheet_id, tab)
+);
+"""
+ROW_HASH_SIZE = 16
+
+# In buffered mode a spreadsheet's queued writes are flushed once this many
+# tabs are pending or the oldest of them has waited this many seconds
+BUFFER_MAX_TABS = int(os.getenv("SHEETS_BUFFER_MAX_TABS", 20))
+BUFFER_MAX_AGE = float(os.getenv("SHEETS_BUFFER_MAX_AGE", 30))
+
+# Streamed tab writes are sent in batchUpdates of this many rows; larger
+# grids go through a hidden staging tab named after the tab plus this suffix
+STREAM_CHUNK_ROWS = int(os.getenv("SHEETS_STREAM_CHUNK_ROWS", 5000))
+STAGING_SUFFIX = "__staging"
+
+# Requests per minute allowed by the project's Sheets API quotas
+READ_QUOTA_PER_MIN = int(os.getenv("SHEETS_READ_QUOTA_PER_MIN", 60))
+WRITE_QUOTA_PER_MIN = int(os.getenv("SHEETS_WRITE_QUOTA_PER_MIN", 60))
+# Retries of a request that failed with 429 or 5xx, with exponential backoff
+# and jitter, and how long a request may keep retrying in total. A 5xx may
+# come after the request was applied, so requests that cannot be applied
+# twice are only retried on 429
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+UNAPPLIED_STATUSES = (429,)
+MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", 6))
+RETRY_BASE_DELAY = float(os.getenv("SHEETS_RETRY_BASE_DELAY", 1))
+RETRY_MAX_DELAY = float(os.getenv("SHEETS_RETRY_MAX_DELAY", 64))
+RETRY_BUDGET_SECONDS = float(os.getenv("SHEETS_RETRY_BUDGET_SECONDS", 300))
+
+# Refresh the access token proactively once it has less than this left
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Process-wide credentials and Sheets client, created on first use
+_creds = None
+_creds_lock = threading.Lock()
+_service = None
+_service_lock = threading.Lock()
+# httplib2 is not thread-safe, so each thread sends requests on its own Http
+_thread_local = threading.local()
+# spreadsheet id -> {tab title: {"sheetId", "rowCount", "columnCount"}}
+_sheet_props = {}
+_sheet_props_lock = threading.Lock()
+# (spreadsheet id, tab title) -> what was last written there, for diffing;
+# filled from WRITE_STATE_STORE on first use
+_last_written = {}
+_last_written_lock = threading.Lock()
+# (spreadsheet id, tab title) -> when the tab was last confirmed up to
+# date, for staleness
+_fresh_at = {}
+# Shared limiters keeping the whole process under the per-minute quotas
+_read_limiter = TokenBucket(READ_QUOTA_PER_MIN)
+_write_limiter = TokenBucket(WRITE_QUOTA_PER_MIN)
+# Buffered mode: spreadsheet id -> {tab title: latest data}, flushed in one
+# batchUpdate; a per-spreadsheet flush lock keeps flushes in order
+_buffering = False
+_pending = {}
+_flush_timers = {}
+_pending_lock = threading.Lock()
+_flush_locks = {}
+
 # Function to generate credentials
 def gen_cred():
     creds = None
@@ -27,75 +137,617 @@ def gen_cred():
             token.write(creds.to_json())
     return creds
 
-# Function to clear data in the specified spreadsheet and range
-def clear_sheet(creds, spreadsheet_id, range_name):
+# Function to return the in-memory credentials, refreshed shortly before expiry
+def get_creds():
+    global _creds
+    with _creds_lock:
+        if _creds is None:
+            _creds = gen_cred()
+        elif _creds.refresh_token and (
+                not _creds.valid or
+                (_creds.expiry is not None and
+                 _creds.expiry - datetime.datetime.utcnow() < TOKEN_REFRESH_MARGIN)):
+            _creds.refresh(Request())
+            with open('token.json', 'w') as token:
+                token.write(_creds.to_json())
+        return _creds
+
+# Function to return the Sheets client, built once per process
+def get_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = build('sheets', 'v4', credentials=get_creds(), cache_discovery=False)
+        return _service
+
+# Function to execute a Sheets API request on this thread's own connection,
+# within the quota limits and retrying throttled or failed attempts
+def execute_request(request, write=False, idempotent=True):
+    creds = get_creds()
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+        _thread_local.http = http
+
+    limiter = _write_limiter if write else _read_limiter
+    deadline = time.monotonic() + RETRY_BUDGET_SECONDS
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            return request.execute(http=http)
+        except HttpError as error:
+            status = getattr(error.resp, 'status', None)
+            if status not in (RETRY_STATUSES if idempotent else UNAPPLIED_STATUSES) or attempt >= MAX_RETRIES:
+                raise
+            delay = retry_delay(error, attempt)
+            if time.monotonic() + delay > deadline:
+                raise
+            attempt += 1
+            metrics.SHEETS_RETRIES.inc(status=status)
+            print(f"Sheets API returned {status}, retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+# Function to pick the wait before a retry: the server's Retry-After if it
+# sent one, otherwise exponential backoff with full jitter
+def retry_delay(error, attempt):
+    headers = getattr(error.resp, 'get', None)
+    retry_after = headers('retry-after') if headers else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+# Function to report how long requests waited on the quota limiters
+def limiter_stats():
+    return {'read': _read_limiter.stats(), 'write': _write_limiter.stats()}
+
+metrics.SHEETS_LIMITER_WAIT.set_callback(
+    lambda: {(kind,): stats['wait_seconds'] for kind, stats in limiter_stats().items()}
+)
+metrics.TAB_STALENESS.set_callback(
+    lambda: {(spreadsheet_alias(spreadsheet_id), tab): time.time() - fresh_at
+             for (spreadsheet_id, tab), fresh_at in list(_fresh_at.items())}
+)
+
+# Function to name a spreadsheet in metric labels
+def spreadsheet_alias(spreadsheet_id):
+    return SPREADSHEET_ALIASES.get(spreadsheet_id, spreadsheet_id)
+
+# Function to record a tab as up to date in the metrics after a write (or a
+# skipped one when rows_sent is None)
+def mark_fresh(spreadsheet_id, sheet_name, row_count=None, rows_sent=None):
+    _fresh_at[(spreadsheet_id, sheet_name)] = time.time()
+    if rows_sent is None:
+        return
+    alias = spreadsheet_alias(spreadsheet_id)
+    metrics.TAB_ROWS.set(row_count, spreadsheet=alias, tab=sheet_name)
+    metrics.ROWS_WRITTEN.inc(rows_sent, spreadsheet=alias, tab=sheet_name)
+
+def get_sheet_properties(spreadsheet_id, refresh=False):
+    with _sheet_props_lock:
+        if not refresh and spreadsheet_id in _sheet_props:
+            return _sheet_props[spreadsheet_id]
+
+    request = get_service().spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        fields='sheets.properties(sheetId,title,gridProperties(rowCount,columnCount))'
+    )
+    with tracing.span("sheet-metadata"):
+        response = execute_request(request)
+    props = {}
+    for sheet in response.get('sheets', []):
+        properties = sheet['properties']
+        grid = properties.get('gridProperties', {})
+        props[properties['title']] = {
+            'sheetId': properties['sheetId'],
+            'rowCount': grid.get('rowCount', 0),
+            'columnCount': grid.get('columnCount', 0)
+        }
+
+    with _sheet_props_lock:
+        _sheet_props[spreadsheet_id] = props
+    return props
+
+# Function to drop cached tab properties after a failed write
+def forget_sheet_properties(spreadsheet_id):
+    with _sheet_props_lock:
+        _sheet_props.pop(spreadsheet_id, None)
+
+# Function to convert a Python value into a CellData entry, mirroring RAW input
+def to_cell(value):
+    if value is None:
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+# Function to build the request that extends a tab's grid to fit the data;
+# updateCells cannot write outside the grid. The new size is absolute, so a
+# retried request does not grow the grid twice
+def grow_grid_requests(props, row_count, column_count):
+    if row_count <= props['rowCount'] and column_count <= props['columnCount']:
+        return []
+    props['rowCount'] = max(row_count, props['rowCount'])
+    props['columnCount'] = max(column_count, props['columnCount'])
+    return [{'updateSheetProperties': {
+        'properties': {
+            'sheetId': props['sheetId'],
+            'gridProperties': {'rowCount': props['rowCount'], 'columnCount': props['columnCount']}
+        },
+        'fields': 'gridProperties.rowCount,gridProperties.columnCount'
+    }}]
+
+# Function to build an updateCells request for rows [start_row, end_row) of
+# columns A:Z; cells of the range not covered by rows are cleared, and an
+# end_row of None leaves the range open-ended downwards
+def update_cells_request(props, rows, start_row, end_row=None):
+    grid_range = {
+        'sheetId': props['sheetId'],
+        'startRowIndex': start_row,
+        'startColumnIndex': 0,
+        'endColumnIndex': max(min(SHEET_COLUMNS, props['columnCount']),
+                              max((len(row) for row in rows), default=0))
+    }
+    if end_row is not None:
+        grid_range['endRowIndex'] = end_row
+    return {'updateCells': {
+        'range': grid_range,
+        'rows': [{'values': [to_cell(value) for value in row]} for row in rows],
+        'fields': 'userEnteredValue'
+    }}
+
+# Function to build the requests that replace columns A:Z with new_data in a
+# single step; old rows below the data are cleared
+def replace_tab_requests(props, new_data):
+    column_count = max((len(row) for row in new_data), default=0)
+    requests = grow_grid_requests(props, len(new_data), column_count)
+    requests.append(update_cells_request(props, new_data, 0))
+    return requests
+
+# Function to hash every row of a grid, so later writes can be diffed
+def hash_rows(new_data):
+    return [hashlib.blake2b(repr(tuple(row)).encode(), digest_size=ROW_HASH_SIZE).digest()
+            for row in new_data]
+
+# Function to group changed row indexes into contiguous [start, end) ranges
+def changed_ranges(old_hashes, new_hashes):
+    ranges = []
+    for index, row_hash in enumerate(new_hashes):
+        if index < len(old_hashes) and old_hashes[index] == row_hash:
+            continue
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] = index + 1
+        else:
+            ranges.append([index, index + 1])
+    return ranges
+
+# Function to build the requests for one tab, sending only the changed rows
+# when the previous contents are known; returns None when nothing changed
+def tab_write_requests(spreadsheet_id, sheet_name, props, new_data, row_hashes):
+    previous = previous_write(spreadsheet_id, sheet_name, props)
+    if previous is None or time.time() - previous['full_write_at'] > DIFF_FULL_REWRITE_AFTER:
+        return replace_tab_requests(props, new_data), True
+
+    old_hashes = previous['row_hashes']
+    if old_hashes == row_hashes:
+        return None, False
+
+    ranges = changed_ranges(old_hashes, row_hashes)
+    changed_rows = sum(end - start for start, end in ranges)
+    if changed_rows > DIFF_MAX_CHANGED_RATIO * max(len(new_data), 1) or len(ranges) > DIFF_MAX_RANGES:
+        return replace_tab_requests(props, new_data), True
+
+    column_count = max((len(row) for row in new_data), default=0)
+    requests = grow_grid_requests(props, len(new_data), column_count)
+    for start, end in ranges:
+        requests.append(update_cells_request(props, new_data[start:end], start, end))
+    if len(new_data) < len(old_hashes):
+        # The tab got shorter; clear the rows that are no longer part of it
+        requests.append(update_cells_request(props, [], len(new_data)))
+    return requests, False
+
+# Function to return what was last written to a tab, or None when it is
+# unknown or the tab changed shape since (see WRITE_STATE_STORE)
+def previous_write(spreadsheet_id, sheet_name, props):
+    key = (spreadsheet_id, sheet_name)
+    with _last_written_lock:
+        previous = _last_written.get(key)
+    if previous is None:
+        try:
+            with local_store.connect(WRITE_STATE_STORE, WRITE_STATE_SCHEMA) as conn:
+                row = conn.execute(
+                    "SELECT sheet_id, row_count, column_count, full_write_at, row_hashes "
+                    "FROM tab_writes WHERE spreadsheet_id = ? AND tab = ?",
+                    key
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading the last write of {sheet_name}: {e}")
+            row = None
+        if row is None:
+            return None
+        sheet_id, row_count, column_count, full_write_at, hashes = row
+        previous = {
+            'sheetId': sheet_id,
+            'grid': (row_count, column_count),
+            'full_write_at': full_write_at,
+            'row_hashes': [hashes[i:i + ROW_HASH_SIZE] for i in range(0, len(hashes), ROW_HASH_SIZE)]
+        }
+        with _last_written_lock:
+            _last_written.setdefault(key, previous)
+
+    if previous['sheetId'] != props['sheetId'] or previous['grid'] != (props['rowCount'], props['columnCount']):
+        forget_write(spreadsheet_id, sheet_name)
+        return None
+    return previous
+
+# Function to remember what a tab holds after a successful write; props are
+# the tab's properties after the write
+def remember_write(spreadsheet_id, sheet_name, props, row_hashes, full_write):
+    key = (spreadsheet_id, sheet_name)
+    with _last_written_lock:
+        full_write_at = time.time() if full_write or key not in _last_written else _last_written[key]['full_write_at']
+        _last_written[key] = {
+            'sheetId': props['sheetId'],
+            'grid': (props['rowCount'], props['columnCount']),
+            'full_write_at': full_write_at,
+            'row_hashes': row_hashes
+        }
     try:
-        service = build('sheets', 'v4', credentials=creds)
-        clear_request = service.spreadsheets().values().clear(
-            spreadsheetId=spreadsheet_id, range=range_name
-        )
-        clear_request.execute()
-        print(f"Data in range {range_name} cleared.")
-    except HttpError as error:
-        print(f"An error occurred: {error}")
+        with local_store.connect(WRITE_STATE_STORE, WRITE_STATE_SCHEMA) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tab_writes (spreadsheet_id, tab, sheet_id, row_count, column_count, "
+                "full_write_at, row_hashes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (spreadsheet_id, sheet_name, props['sheetId'], props['rowCount'], props['columnCount'],
+                 full_write_at, b"".join(row_hashes))
+            )
+    except sqlite3.Error as e:
+        print(f"Error storing the last write of {sheet_name}: {e}")
+
+# Function to forget what a tab holds, so the next write rewrites it fully
+def forget_write(spreadsheet_id, sheet_name):
+    with _last_written_lock:
+        _last_written.pop((spreadsheet_id, sheet_name), None)
+    try:
+        with local_store.connect(WRITE_STATE_STORE, WRITE_STATE_SCHEMA) as conn:
+            conn.execute("DELETE FROM tab_writes WHERE spreadsheet_id = ? AND tab = ?",
+                         (spreadsheet_id, sheet_name))
+    except sqlite3.Error as e:
+        print(f"Error forgetting the last write of {sheet_name}: {e}")
 
-# Function to paste new data into the specified spreadsheet and range
-def paste_data(creds, spreadsheet_id, range_name, value_input_option, new_data):
+# Function to update several tabs of one spreadsheet with a single
+# batchUpdate call; readers never see a cleared tab, and tabs written before
+# only get their changed rows sent
+def replace_tabs(spreadsheet_id, tab_data):
+    written = {}
     try:
-        service = build('sheets', 'v4', credentials=creds)
-        body = {'values': new_data}
-        update_request = service.spreadsheets().values().update(
-            spreadsheetId=spreadsheet_id, range=range_name,
-            valueInputOption=value_input_option, body=body
-        )
-        update_request.execute()
-        print(f"New data pasted to range {range_name}.")
+        props = get_sheet_properties(spreadsheet_id)
+        if any(sheet_name not in props for sheet_name in tab_data):
+            props = get_sheet_properties(spreadsheet_id, refresh=True)
+
+        requests = []
+        for sheet_name, new_data in tab_data.items():
+            if sheet_name not in props:
+                print(f"An error occurred: tab {sheet_name} not found in spreadsheet {spreadsheet_id}")
+                continue
+            row_hashes = hash_rows(new_data)
+            tab_requests, full_write = tab_write_requests(
+                spreadsheet_id, sheet_name, props[sheet_name], new_data, row_hashes
+            )
+            if tab_requests is None:
+                mark_fresh(spreadsheet_id, sheet_name)
+                print(f"Data in {sheet_name} unchanged.")
+                continue
+            requests.extend(tab_requests)
+            rows_sent = sum(len(r['updateCells']['rows']) for r in tab_requests if 'updateCells' in r)
+            written[sheet_name] = (row_hashes, full_write, rows_sent)
+
+        if requests:
+            request = get_service().spreadsheets().batchUpdate(
+                spreadsheetId=spreadsheet_id, body={'requests': requests}
+            )
+            with tracing.span("sheet-write", tabs=list(written),
+                              rows=sum(len(tab_data[name]) for name in written)):
+                execute_request(request, write=True)
+            for sheet_name, (row_hashes, full_write, rows_sent) in written.items():
+                remember_write(spreadsheet_id, sheet_name, props[sheet_name], row_hashes, full_write)
+                mark_fresh(spreadsheet_id, sheet_name, len(row_hashes), rows_sent)
+            print(f"Data replaced in {', '.join(written)}.")
+            for sheet_name in written:
+                snapshot_store.record(spreadsheet_id, sheet_name, tab_data[sheet_name])
     except HttpError as error:
-        print(f"An error occurred: {error}")
+        forget_sheet_properties(spreadsheet_id)
+        if getattr(error.resp, 'status', None) == 400 and len(written) > 1:
+            # A batchUpdate is applied all or nothing, so one bad tab (renamed,
+            # deleted, grid too large) rejected the whole batch and the tabs
+            # still hold what was last written. Write them one by one so only
+            # the bad tab is lost
+            print(f"Batched write of {', '.join(written)} was rejected, writing the tabs one by one: {error}")
+            for sheet_name in written:
+                replace_tabs(spreadsheet_id, {sheet_name: tab_data[sheet_name]})
+            return
+        for sheet_name in written:
+            forget_write(spreadsheet_id, sheet_name)
+        print(f"An error occurred writing {', '.join(written) or spreadsheet_id}: {error}")
+    except Exception:
+        # Transport errors (timeouts, SSL, token refresh) would otherwise
+        # end a timer flush's thread and lose its already dequeued tabs
+        # without a trace
+        forget_sheet_properties(spreadsheet_id)
+        for sheet_name in written:
+            forget_write(spreadsheet_id, sheet_name)
+        print(f"An error occurred writing {', '.join(written or tab_data)} "
+              f"to {spreadsheet_id}: {traceback.format_exc()}")
 
-# Function to update the first spreadsheet
-def sheet_update(new_data, sheet_name):
-    spreadsheet_id = "1fkSAe0FNvO01xV-giOdEU3RQFCNNNml4qJ7pKC8ySe8"
-    range_name = f"{sheet_name}!A1:Z99999999"
-    value_input_option = "RAW"
+# Function to switch on buffered mode, where sheet updates are queued and
+# sent per spreadsheet as one batched write
+def start_buffering():
+    global _buffering
+    with _pending_lock:
+        _buffering = True
 
-    creds = gen_cred()
+# Function to flush every queued write and go back to writing immediately
+def stop_buffering():
+    global _buffering
+    with _pending_lock:
+        _buffering = False
+    flush_writes()
 
-    # Clear existing data
-    clear_sheet(creds, spreadsheet_id, range_name)
+# Function to send the queued writes of one spreadsheet (or of all of them)
+def flush_writes(spreadsheet_id=None):
+    with _pending_lock:
+        spreadsheet_ids = [spreadsheet_id] if spreadsheet_id else list(_pending)
+        flush_locks = [_flush_locks.setdefault(sid, threading.Lock()) for sid in spreadsheet_ids]
 
-    # Paste new data
-    paste_data(creds, spreadsheet_id, range_name, value_input_option, new_data)
+    for sid, flush_lock in zip(spreadsheet_ids, flush_locks):
+        with flush_lock:
+            with _pending_lock:
+                tab_data = _pending.pop(sid, None)
+                timer = _flush_timers.pop(sid, None)
+            if timer is not None:
+                timer.cancel()
+            if tab_data:
+                replace_tabs(sid, tab_data)
 
-# Function to update the second spreadsheet
-def sheet_update2(new_data, sheet_name):
-    spreadsheet_id_2 = "1-oIObLpWJ3qUDRx2-tDgYVM-OUJBdtbxnbEOVILTWfU"
-    range_name = f"{sheet_name}!A1:Z999999"
-    value_input_option = "RAW"
+# Function to write a tab now, or queue it when buffered mode is on; a
+# queued tab is replaced by any later write to the same tab
+def write_tab(spreadsheet_id, sheet_name, new_data):
+    with _pending_lock:
+        if not _buffering:
+            queued = False
+        else:
+            queued = True
+            tabs = _pending.setdefault(spreadsheet_id, {})
+            tabs[sheet_name] = [list(row) for row in new_data]
+            flush_now = len(tabs) >= BUFFER_MAX_TABS
+            if not flush_now and spreadsheet_id not in _flush_timers:
+                timer = threading.Timer(BUFFER_MAX_AGE, flush_writes, args=(spreadsheet_id,))
+                timer.daemon = True
+                _flush_timers[spreadsheet_id] = timer
+                timer.start()
 
-    creds = gen_cred()
+    if not queued:
+        replace_tabs(spreadsheet_id, {sheet_name: new_data})
+    elif flush_now:
+        flush_writes(spreadsheet_id)
 
-    # Clear existing data
-    clear_sheet(creds, spreadsheet_id_2, range_name)
+# Function to write one chunk of a streamed tab, starting at start_row;
+# only rows whose hash differs from old_hashes are sent, unless full_write
+def stream_chunk_requests(props, rows, start_row, row_hashes, old_hashes, full_write):
+    column_count = max((len(row) for row in rows), default=0)
+    requests = grow_grid_requests(props, start_row + len(rows), column_count)
+    if full_write:
+        ranges = [[0, len(rows)]] if rows else []
+    else:
+        ranges = changed_ranges(old_hashes[start_row:start_row + len(rows)], row_hashes)
+    for start, end in ranges:
+        requests.append(update_cells_request(props, rows[start:end], start_row + start, start_row + end))
+    return requests
 
-    # Paste new data
-    paste_data(creds, spreadsheet_id_2, range_name, value_input_option, new_data)
+# Function to count the rows sent by a list of requests
+def rows_in_requests(requests):
+    return sum(len(r['updateCells']['rows']) for r in requests if 'updateCells' in r)
 
+# Function to read a stream of rows to its end into a temporary file, in
+# pickled chunks of STREAM_CHUNK_ROWS, hashing the rows and adding them to
+# the snapshot on the way. Returns the file (rewound), the row hashes, the
+# number of chunks and the widest row's length
+def spool_rows(rows, snapshot):
+    spool = tempfile.TemporaryFile()
+    row_hashes = []
+    chunk_count = 0
+    column_count = 0
+    try:
+        chunk = []
+        for row in rows:
+            chunk.append(list(row))
+            snapshot.add(chunk[-1])
+            column_count = max(column_count, len(chunk[-1]))
+            if len(chunk) == STREAM_CHUNK_ROWS:
+                pickle.dump(chunk, spool, pickle.HIGHEST_PROTOCOL)
+                row_hashes.extend(hash_rows(chunk))
+                chunk_count += 1
+                chunk = []
+        if chunk:
+            pickle.dump(chunk, spool, pickle.HIGHEST_PROTOCOL)
+            row_hashes.extend(hash_rows(chunk))
+            chunk_count += 1
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool, row_hashes, chunk_count, column_count
 
+# Function to read the chunks of a spool file back one at a time
+def spooled_chunks(spool):
+    while True:
+        try:
+            yield pickle.load(spool)
+        except EOFError:
+            return
 
-# Function to update the second spreadsheet
-def sheet_update3(new_data, sheet_name):
-    spreadsheet_id = "10OJCcwvgFA3VDJ4xmzEJ9a1jIWgOTNhnparpxLKvdGo"
-    range_name = f"{sheet_name}!A1:Z999999"
-    value_input_option = "RAW"
+# Function to send one batchUpdate of a streamed write
+def send_batch(spreadsheet_id, requests, tabs, row_count, idempotent=True):
+    request = get_service().spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheet_id, body={'requests': requests}
+    )
+    with tracing.span("sheet-write", tabs=tabs, rows=row_count):
+        return execute_request(request, write=True, idempotent=idempotent)
+
+# Function to return the name and properties of a tab's hidden staging tab,
+# adding the staging tab to the spreadsheet the first time, and the
+# spreadsheet's (possibly refreshed) tab properties
+def staging_tab(spreadsheet_id, sheet_name, props):
+    staging_name = sheet_name + STAGING_SUFFIX
+    if staging_name not in props:
+        props = get_sheet_properties(spreadsheet_id, refresh=True)
+    if staging_name not in props:
+        response = send_batch(spreadsheet_id, [{'addSheet': {'properties': {
+            'title': staging_name,
+            'hidden': True,
+            'gridProperties': {'rowCount': 1, 'columnCount': SHEET_COLUMNS}
+        }}}], [staging_name], 0, idempotent=False)
+        properties = response['replies'][0]['addSheet']['properties']
+        grid = properties.get('gridProperties', {})
+        props[staging_name] = {
+            'sheetId': properties['sheetId'],
+            'rowCount': grid.get('rowCount', 1),
+            'columnCount': grid.get('columnCount', SHEET_COLUMNS)
+        }
+    return staging_name, props[staging_name], props
 
-    creds = gen_cred()
+# Function to build the requests that replace a tab with the first row_count
+# rows of its staging tab, columns [0, column_count), in one step
+def swap_in_requests(tab_props, staging_props, row_count, column_count):
+    requests = grow_grid_requests(tab_props, row_count, column_count)
+    if row_count:
+        source = {'sheetId': staging_props['sheetId'], 'startRowIndex': 0, 'endRowIndex': row_count,
+                  'startColumnIndex': 0, 'endColumnIndex': column_count}
+        requests.append({'copyPaste': {
+            'source': source,
+            'destination': {**source, 'sheetId': tab_props['sheetId']},
+            'pasteType': 'PASTE_VALUES',
+            'pasteOrientation': 'NORMAL'
+        }})
+    requests.append(update_cells_request(tab_props, [], row_count))
+    return requests
 
-    # Clear existing data
-    clear_sheet(creds, spreadsheet_id, range_name)
+# Function to write the spooled chunks to the tab's staging tab and swap
+# them into the tab with one batchUpdate; returns the rows sent, or None
+# when the tab is gone
+def write_staged(spreadsheet_id, sheet_name, props, spool, row_hashes, column_count):
+    staging_name, staging_props, props = staging_tab(spreadsheet_id, sheet_name, props)
+    if sheet_name not in props:
+        print(f"An error occurred: tab {sheet_name} not found in spreadsheet {spreadsheet_id}")
+        return None
+    tab_props = props[sheet_name]
+    previous = previous_write(spreadsheet_id, staging_name, staging_props)
+    full_write = previous is None or time.time() - previous['full_write_at'] > DIFF_FULL_REWRITE_AFTER
+    old_hashes = [] if full_write else previous['row_hashes']
 
-    # Paste new data
-    paste_data(creds, spreadsheet_id, range_name, value_input_option, new_data)
+    rows_sent = 0
+    start_row = 0
+    try:
+        for chunk in spooled_chunks(spool):
+            chunk_hashes = row_hashes[start_row:start_row + len(chunk)]
+            requests = stream_chunk_requests(staging_props, chunk, start_row, chunk_hashes, old_hashes, full_write)
+            if requests:
+                send_batch(spreadsheet_id, requests, [staging_name], len(chunk))
+                rows_sent += rows_in_requests(requests)
+            start_row += len(chunk)
+
+        requests = []
+        if full_write or len(row_hashes) < len(old_hashes):
+            # Clear whatever the staging tab held below the new rows
+            requests.append(update_cells_request(staging_props, [], len(row_hashes)))
+        column_count = max(min(SHEET_COLUMNS, staging_props['columnCount']), column_count)
+        requests.extend(swap_in_requests(tab_props, staging_props, len(row_hashes), column_count))
+        send_batch(spreadsheet_id, requests, [sheet_name], len(row_hashes))
+    except Exception:
+        # The staging tab may be half written; the tab itself is untouched
+        # until the swap, which is applied all or nothing
+        forget_write(spreadsheet_id, staging_name)
+        raise
+
+    remember_write(spreadsheet_id, staging_name, staging_props, row_hashes, full_write)
+    remember_write(spreadsheet_id, sheet_name, tab_props, row_hashes, True)
+    return rows_sent
+
+# Function to write a tab from an iterable of rows without holding the whole
+# grid in memory. The rows are read to the end into a temporary file before
+# the first Sheets call, so a database cursor behind them is closed (and
+# its connection back in the pool) before any quota wait or retry. Up to
+# STREAM_CHUNK_ROWS rows are written in one batchUpdate like replace_tabs;
+# larger grids are written to a hidden staging tab in chunks and then
+# copied into the tab in one batchUpdate, so readers never see a half
+# written tab. Bypasses buffered mode; returns the rows written, or None
+# when the write failed
+def stream_tab(spreadsheet_id, sheet_name, rows):
+    with _pending_lock:
+        # A queued write of this tab is older than the stream; drop it
+        _pending.get(spreadsheet_id, {}).pop(sheet_name, None)
+
+    snapshot = snapshot_store.SnapshotWriter(spreadsheet_id, sheet_name)
+    with tracing.span("spool", tab=sheet_name) as span:
+        spool, row_hashes, chunk_count, column_count = spool_rows(rows, snapshot)
+        span["rows"] = len(row_hashes)
+    try:
+        props = get_sheet_properties(spreadsheet_id)
+        if sheet_name not in props:
+            props = get_sheet_properties(spreadsheet_id, refresh=True)
+        if sheet_name not in props:
+            print(f"An error occurred: tab {sheet_name} not found in spreadsheet {spreadsheet_id}")
+            return None
+        tab_props = props[sheet_name]
+        previous = previous_write(spreadsheet_id, sheet_name, tab_props)
+        unchanged = (previous is not None and previous['row_hashes'] == row_hashes and
+                     time.time() - previous['full_write_at'] <= DIFF_FULL_REWRITE_AFTER)
+
+        rows_sent = 0
+        if unchanged:
+            pass
+        elif chunk_count <= 1:
+            chunk = next(spooled_chunks(spool), [])
+            requests, full_write = tab_write_requests(spreadsheet_id, sheet_name, tab_props, chunk, row_hashes)
+            send_batch(spreadsheet_id, requests, [sheet_name], len(chunk))
+            rows_sent = rows_in_requests(requests)
+            remember_write(spreadsheet_id, sheet_name, tab_props, row_hashes, full_write)
+        else:
+            rows_sent = write_staged(spreadsheet_id, sheet_name, props, spool, row_hashes, column_count)
+            if rows_sent is None:
+                return None
+    except HttpError as error:
+        forget_sheet_properties(spreadsheet_id)
+        forget_write(spreadsheet_id, sheet_name)
+        print(f"An error occurred writing {sheet_name}: {error}")
+        return None
+    finally:
+        spool.close()
+
+    mark_fresh(spreadsheet_id, sheet_name, len(row_hashes), rows_sent)
+    if unchanged:
+        print(f"Data in {sheet_name} unchanged.")
+    else:
+        print(f"Data replaced in {sheet_name}.")
+    snapshot.close()
+    return len(row_hashes)
+
+# Function to update the first spreadsheet
+def sheet_update(new_data, sheet_name):
+    write_tab(SPREADSHEET_ID, sheet_name, new_data)
 
+# Function to update the second spreadsheet
+def sheet_update2(new_data, sheet_name):
+    write_tab(SPREADSHEET_ID_2, sheet_name, new_data)
 
+# Function to update the third spreadsheet
+def sheet_update3(new_data, sheet_name):
+    write_tab(SPREADSHEET_ID_3, sheet_name, new_data)
 
+# Function to stream rows into a tab of the first spreadsheet
+def sheet_update_stream(rows, sheet_name):
+    return stream_tab(SPREADSHEET_ID, sheet_name, rows)
@@ -0,0 +1,256 @@
+import importlib
+import itertools
+import queue
+import threading
+import time
+import traceback
+
+import tracing
+
+# Job states reported back to the caller
+DONE = "done"
+FAILED = "failed"
+TIMED_OUT = "timed out"
+SKIPPED = "skipped"
+
+
+# Function to validate the dependency graph before anything is started
+def check_dependencies(jobs):
+    for name, job in jobs.items():
+        for dep in job.get("depends_on", ()):
+            if dep not in jobs:
+                raise ValueError(f"Job '{name}' depends on unknown job '{dep}'")
+
+    # Depth-first walk to reject dependency cycles
+    visiting, visited = set(), set()
+
+    def visit(name, path):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dep in jobs[name].get("depends_on", ()):
+            visit(dep, path + [name])
+        visiting.discard(name)
+        visited.add(name)
+
+    for name in jobs:
+        visit(name, [])
+
+
+# Modules lazy_job has imported, so only the first import of each is traced
+_imported = set()
+
+
+def lazy_job(module_name, func_name):
+    """
+    Returns a job function that imports module_name when it first runs and
+    calls its func_name, so a job's module and its dependencies are only
+    loaded by jobs that run. The function is named func_name.
+    """
+    def run():
+        # import_module waits for an import another thread has started, which
+        # sys.modules alone would hand out half-initialized
+        if module_name in _imported:
+            module = importlib.import_module(module_name)
+        else:
+            with tracing.span("import", module=module_name):
+                module = importlib.import_module(module_name)
+            _imported.add(module_name)
+        return getattr(module, func_name)()
+
+    run.__name__ = func_name
+    return run
+
+
+# Function to run a single job and report its outcome, tagged with the run
+# it belongs to, on the results queue
+def _run_job(name, run, func, finished):
+    try:
+        func()
+        finished.put((name, run, DONE))
+    except Exception:
+        print(f"Error in {name}: {traceback.format_exc()}")
+        finished.put((name, run, FAILED))
+
+
+def run_jobs(jobs, max_workers=4, default_timeout=None):
+    """
+    Runs the jobs concurrently with at most max_workers of them in flight.
+
+    jobs maps a job name to a dict with:
+        "func":       callable taking no arguments
+        "depends_on": optional list of job names that must finish first
+        "timeout":    optional seconds after which the job is abandoned
+
+    A job starts once all of its dependencies have finished (done or failed).
+    If a dependency timed out or was skipped, the job is skipped as well.
+    Jobs are started in the order they appear in the dict whenever a worker
+    is free. Timed out jobs cannot be killed; their daemon thread keeps
+    running in the background but no longer counts against max_workers.
+
+    Returns a dict of job name -> "done", "failed", "timed out" or "skipped".
+    """
+    check_dependencies(jobs)
+    max_workers = max(1, max_workers)
+
+    status = {}
+    pending = list(jobs)
+    running = {}  # job name -> deadline (None for no timeout)
+    finished = queue.Queue()
+
+    while pending or running:
+        # Skip jobs whose dependencies can no longer complete
+        for name in list(pending):
+            deps = jobs[name].get("depends_on", ())
+            if any(status.get(dep) in (TIMED_OUT, SKIPPED) for dep in deps):
+                pending.remove(name)
+                status[name] = SKIPPED
+                print(f"{name} skipped because a dependency did not complete.")
+
+        # Start every ready job the worker budget allows
+        for name in list(pending):
+            if len(running) >= max_workers:
+                break
+            deps = jobs[name].get("depends_on", ())
+            if all(dep in status for dep in deps):
+                pending.remove(name)
+                timeout = jobs[name].get("timeout", default_timeout)
+                running[name] = time.monotonic() + timeout if timeout else None
+                threading.Thread(
+                    target=_run_job,
+                    args=(name, None, jobs[name]["func"], finished),
+                    name=f"job-{name}",
+                    daemon=True
+                ).start()
+
+        if not running:
+            continue
+
+        # Wait for the next job to finish or the nearest deadline to pass
+        deadlines = [deadline for deadline in running.values() if deadline is not None]
+        wait_for = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+        try:
+            name, _, result = finished.get(timeout=wait_for)
+            # Results of jobs that already timed out are ignored
+            if name in running:
+                del running[name]
+                status[name] = result
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        for name, deadline in list(running.items()):
+            if deadline is not None and now >= deadline:
+                del running[name]
+                status[name] = TIMED_OUT
+                print(f"{name} timed out and was abandoned.")
+
+    return status
+
+
+def run_forever(jobs, max_workers=4, default_timeout=None, default_interval=300,
+                stop_event=None, shutdown_grace=60, on_finish=None):
+    """
+    Keeps running the jobs, each at most once per its own interval, until
+    stop_event is set.
+
+    Jobs use the same dicts as run_jobs, plus:
+        "interval": optional seconds between the starts of two runs
+
+    A job is never started while its previous run is still going, even after
+    that run timed out and was abandoned. A job with "depends_on" runs only
+    after each of its dependencies finished again since its own last start.
+    Overdue jobs start most-overdue first, within max_workers.
+
+    on_finish(name, status) is called after each run with "done", "failed"
+    or "timed out". Once stop_event is set no new runs are started, and
+    running jobs get up to shutdown_grace seconds to finish.
+    """
+    check_dependencies(jobs)
+    max_workers = max(1, max_workers)
+    stop_event = stop_event or threading.Event()
+
+    finished = queue.Queue()
+    threads = {}  # job name -> thread of its latest run
+    running = {}  # job name -> deadline, for runs counting against max_workers
+    # Run currently tracked for each job; an abandoned run can still report
+    # after the job was started again, and its result is then ignored
+    current_run = {}
+    run_ids = itertools.count()
+    last_start = {}
+    # Dependencies that finished since each job last started
+    deps_finished = {name: set() for name in jobs}
+    dependents = {name: [other for other, job in jobs.items() if name in job.get("depends_on", ())]
+                  for name in jobs}
+
+    def next_due(name):
+        if name not in last_start:
+            return 0
+        return last_start[name] + jobs[name].get("interval", default_interval)
+
+    def record(name, run, result):
+        if name in running and current_run.get(name) == run:
+            del running[name]
+            if result != TIMED_OUT:
+                for dependent in dependents[name]:
+                    deps_finished[dependent].add(name)
+            if on_finish:
+                on_finish(name, result)
+
+    while not stop_event.is_set():
+        now = time.monotonic()
+
+        # Start due jobs, most overdue first, within the worker budget
+        due = []
+        for name, job in jobs.items():
+            thread = threads.get(name)
+            if thread is not None and thread.is_alive():
+                continue
+            if next_due(name) > now:
+                continue
+            if any(dep not in deps_finished[name] for dep in job.get("depends_on", ())):
+                continue
+            due.append(name)
+        for name in sorted(due, key=next_due)[:max(0, max_workers - len(running))]:
+            timeout = jobs[name].get("timeout", default_timeout)
+            running[name] = now + timeout if timeout else None
+            last_start[name] = now
+            deps_finished[name] = set()
+            current_run[name] = next(run_ids)
+            threads[name] = threading.Thread(
+                target=_run_job,
+                args=(name, current_run[name], jobs[name]["func"], finished),
+                name=f"job-{name}",
+                daemon=True
+            )
+            threads[name].start()
+
+        # Sleep until a job finishes, a deadline passes or a job falls due,
+        # waking at least every second to notice stop_event
+        wake_at = [deadline for deadline in running.values() if deadline is not None]
+        wake_at += [next_due(name) for name in jobs if next_due(name) > now]
+        wait_for = min([1.0] + [max(0, at - now) for at in wake_at])
+        try:
+            record(*finished.get(timeout=wait_for))
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        for name, deadline in list(running.items()):
+            if deadline is not None and now >= deadline:
+                print(f"{name} timed out and was abandoned.")
+                record(name, current_run[name], TIMED_OUT)
+
+    # Give the runs still in flight a chance to finish
+    grace_end = time.monotonic() + shutdown_grace
+    while running:
+        remaining = grace_end - time.monotonic()
+        if remaining <= 0:
+            print(f"Shutting down with jobs still running: {', '.join(running)}")
+            break
+        try:
+            record(*finished.get(timeout=remaining))
+        except queue.Empty:
+            pass
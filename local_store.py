@@ -0,0 +1,38 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Directory holding the jobs' local SQLite stores
+STATE_DIR = os.getenv("DASHBOARD_STATE_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+@contextmanager
+def connect(filename, schema):
+    """
+    Opens the SQLite store STATE_DIR/filename, creating its tables from schema
+    on first use in this process. The block runs as one transaction that is
+    committed on success and rolled back on error.
+    """
+    path = os.path.join(STATE_DIR, filename)
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with _init_lock:
+            if path not in _initialized:
+                # The schema goes first so it can set pragmas that only
+                # apply to a new file; WAL lets readers carry on while
+                # another job writes
+                conn.executescript(schema)
+                conn.execute("PRAGMA journal_mode=WAL")
+                _initialized.add(path)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
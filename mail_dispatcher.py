@@ -0,0 +1,200 @@
+import atexit
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from collections import namedtuple
+
+from dotenv import load_dotenv
+
+import tracing
+
+load_dotenv()
+
+# Mails are queued and sent by a background thread, so a job hands its mail
+# over and carries on. The thread keeps one logged-in SMTP session per
+# account and reuses it for the following mails, closing it once it has
+# been idle for MAIL_IDLE_CLOSE seconds. Mails still queued when the process
+# exits are sent first, for up to MAIL_FLUSH_TIMEOUT seconds.
+MAIL_SMTP_HOST = os.getenv("MAIL_SMTP_HOST", "smtp.gmail.com")
+MAIL_SMTP_PORT = int(os.getenv("MAIL_SMTP_PORT", 587))
+# Set to 0 for a local SMTP sink without TLS
+MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "1") == "1"
+# Most mails taken from the queue and sent over a session in one go
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 20))
+MAIL_RETRIES = int(os.getenv("MAIL_RETRIES", 3))
+MAIL_RETRY_DELAY = float(os.getenv("MAIL_RETRY_DELAY", 5))
+MAIL_IDLE_CLOSE = float(os.getenv("MAIL_IDLE_CLOSE", 60))
+MAIL_FLUSH_TIMEOUT = float(os.getenv("MAIL_FLUSH_TIMEOUT", 120))
+
+SmtpAccount = namedtuple("SmtpAccount", ["host", "port", "user", "password", "starttls"])
+_Mail = namedtuple("_Mail", ["message", "from_addr", "to_addrs", "account"])
+
+# Queued in place of a mail to have the worker close its sessions
+_CLOSE = object()
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+# Owned by the worker thread: account -> [SMTP session, last used]
+_sessions = {}
+
+
+# Function to describe the SMTP account a mail is sent from
+def account(user, password, host=None, port=None, starttls=None):
+    return SmtpAccount(host or MAIL_SMTP_HOST, int(port or MAIL_SMTP_PORT), user, password,
+                       MAIL_STARTTLS if starttls is None else starttls)
+
+
+def send(message, from_addr=None, to_addrs=None, smtp_account=None):
+    """
+    Queues an email.message.Message and returns at once. Without to_addrs the
+    recipients are taken from its To, Cc and Bcc headers; without
+    smtp_account it is sent from MAIL_SENDER_ADD.
+    """
+    if smtp_account is None:
+        smtp_account = account(os.getenv("MAIL_SENDER_ADD"), os.getenv("MAIL_SENDER_PASS"))
+    _start_worker()
+    _queue.put(_Mail(message, from_addr, to_addrs, smtp_account))
+
+
+# Function to wait until every queued mail was sent or given up on; returns
+# False if the timeout passed first
+def flush(timeout=MAIL_FLUSH_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    with _queue.all_tasks_done:
+        while _queue.unfinished_tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _queue.all_tasks_done.wait(remaining)
+    return True
+
+
+def _start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="mail-dispatcher", daemon=True)
+            _worker.start()
+
+
+def _run():
+    while True:
+        try:
+            item = _queue.get(timeout=MAIL_IDLE_CLOSE)
+        except queue.Empty:
+            _close_sessions(idle_only=True)
+            continue
+        batch = [item]
+        while len(batch) < MAIL_BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        for item in batch:
+            try:
+                if item is _CLOSE:
+                    _close_sessions()
+                else:
+                    _deliver(item)
+            except Exception as e:
+                print(f"Error sending mail: {e}")
+            finally:
+                _queue.task_done()
+        _close_sessions(idle_only=True)
+
+
+# Function to return the account's open session, logging in if there is none;
+# the second value tells whether the session was opened just now
+def _session(smtp_account):
+    entry = _sessions.get(smtp_account)
+    if entry is not None:
+        entry[1] = time.monotonic()
+        return entry[0], False
+    server = smtplib.SMTP(smtp_account.host, smtp_account.port, timeout=60)
+    try:
+        server.ehlo()
+        if smtp_account.starttls:
+            server.starttls(context=ssl.create_default_context())
+            server.ehlo()
+        if smtp_account.user and smtp_account.password:
+            server.login(smtp_account.user, smtp_account.password)
+    except Exception:
+        server.close()
+        raise
+    _sessions[smtp_account] = [server, time.monotonic()]
+    return server, True
+
+
+def _drop_session(smtp_account, quit=False):
+    entry = _sessions.pop(smtp_account, None)
+    if entry is None:
+        return
+    try:
+        if quit:
+            entry[0].quit()
+        else:
+            entry[0].close()
+    except Exception:
+        pass
+
+
+def _close_sessions(idle_only=False):
+    now = time.monotonic()
+    for smtp_account, (server, last_used) in list(_sessions.items()):
+        if not idle_only or now - last_used >= MAIL_IDLE_CLOSE:
+            _drop_session(smtp_account, quit=True)
+
+
+# Function to send one mail, reconnecting and retrying on transient errors;
+# replies in the 5xx range are permanent and not retried
+def _deliver(mail):
+    subject = mail.message.get("Subject", "")
+    attempt = 0
+    while True:
+        reused = False
+        try:
+            with tracing.span("mail", subject=subject, attempt=attempt):
+                server, fresh = _session(mail.account)
+                reused = not fresh
+                refused = server.send_message(mail.message, mail.from_addr, mail.to_addrs)
+            if refused:
+                print(f"Mail '{subject}' was refused for: {', '.join(refused)}")
+            return True
+        except smtplib.SMTPRecipientsRefused as e:
+            print(f"Mail '{subject}' was refused for every recipient: {e.recipients}")
+            return False
+        except smtplib.SMTPResponseException as e:
+            _drop_session(mail.account)
+            if 500 <= e.smtp_code < 600:
+                print(f"Mail '{subject}' was rejected: {e.smtp_code} {e.smtp_error!r}")
+                return False
+            error = e
+        except (smtplib.SMTPException, OSError) as e:
+            _drop_session(mail.account)
+            # A reused session may have been closed by the server while idle
+            if reused and isinstance(e, smtplib.SMTPServerDisconnected):
+                continue
+            error = e
+        if attempt >= MAIL_RETRIES:
+            print(f"Failed to send mail '{subject}' after {attempt + 1} attempts: {error}")
+            return False
+        time.sleep(MAIL_RETRY_DELAY * 2 ** attempt)
+        attempt += 1
+
+
+# Function to send what is still queued and log out at exit
+def _shutdown():
+    if _worker is None:
+        return
+    if not flush():
+        print("Mails still queued at exit were not sent.")
+        return
+    _queue.put(_CLOSE)
+    flush(timeout=10)
+
+
+atexit.register(_shutdown)
@@ -1,33 +1,17 @@
 import traceback
 import time
-import smtplib
+import argparse
+import signal
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 import os
-from recharge_controller import recharge_main
-from sms_controller import sms_main
-from cash_in_rocket import cashin_rocket_main
-from moneyout_controller import moneyout_main
-from sqr_controller import sqr_main_threaded
-from bankout_controller import bank_money_out
-from registration_controller_v2 import sqr_reg
-from daily_service_analysis import main_daily_service_analysis
-from Visa_Card_Transfer import VISA_Transfers
-from service_health_all_service import service_health
-from recharge_new import recharge_new
-from NPSB import NPSB
-from porichoy import porichoy
-from reconcilation import reconciliation_reports
-from avg_4week import threshold_avg
-from sqr_not_success import run_sqr_user_extraction
-from recharge_cashback import recharge_cashbackk
-from tk_premium import tk_premium
-from nagad_money_in import nagad_money_in
-from all_balance import all_balance
-from ssl_balance import fetch_and_update_ssl_balance
-from registration_controller import tp_reg
-from tk_log import tallykhata_log
+from job_scheduler import run_jobs, run_forever, lazy_job, DONE, TIMED_OUT, SKIPPED
+import isheet_controller
+import mail_dispatcher
+import tracing
+import metrics
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -38,6 +22,16 @@ SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 RECIPIENT_EMAIL = os.getenv("RECIPIENT_EMAIL")
 
+# Number of jobs allowed to run at the same time and the per-job time limit
+MAX_WORKERS = int(os.getenv("DASHBOARD_MAX_WORKERS", 6))
+JOB_TIMEOUT = float(os.getenv("DASHBOARD_JOB_TIMEOUT", 900))
+# Daemon mode: seconds between runs of jobs without their own "interval",
+# and how long running jobs get to finish on shutdown
+DEFAULT_INTERVAL = float(os.getenv("DASHBOARD_DEFAULT_INTERVAL", 300))
+SHUTDOWN_GRACE = float(os.getenv("DASHBOARD_SHUTDOWN_GRACE", 60))
+# Coalesce the cycle's sheet updates into batched writes per spreadsheet
+BUFFER_SHEET_WRITES = os.getenv("DASHBOARD_BUFFER_SHEET_WRITES", "1") == "1"
+
 # Dictionary to store the time taken for each function
 timing_data = {}
 
@@ -45,12 +39,15 @@ timing_data = {}
 def profile_function(func):
     """
     Measures the execution time of a function and stores it in the timing_data dictionary.
+    Each run is also traced as a "job" span, with its stages nested under it.
     """
 
     def wrapper():
         start_time = time.time()
         try:
-            func()
+            # Stage timings of the run are written by tracing as spans
+            with tracing.job_run(func.__name__):
+                func()
             timing_data[func.__name__] = time.time() - start_time
             print(f"{func.__name__} completed successfully.")
         except Exception as e:
@@ -69,50 +66,68 @@ def send_email(subject, body, to_email):
     msg['Subject'] = subject
     msg.attach(MIMEText(body, 'plain'))
 
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
-            server.send_message(msg)
-        print("Email sent successfully.")
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-
-
-# List of functions to be executed sequentially
-functions_to_run = [
-    profile_function(recharge_main),
-    profile_function(nagad_money_in),
-    profile_function(sms_main),
-    profile_function(cashin_rocket_main),
-    profile_function(moneyout_main),
-    profile_function(sqr_main_threaded),
-    profile_function(bank_money_out),
-    profile_function(sqr_reg),
-    profile_function(main_daily_service_analysis),
-    profile_function(VISA_Transfers),
-    profile_function(service_health),
-    profile_function(recharge_new),
-    profile_function(NPSB),
-    profile_function(porichoy),
-    profile_function(reconciliation_reports),
-    profile_function(threshold_avg),
-    profile_function(run_sqr_user_extraction),
-    profile_function(recharge_cashbackk),
-    profile_function(tk_premium),
-    profile_function(all_balance),
-    profile_function(fetch_and_update_ssl_balance),
-    profile_function(tp_reg),
-    profile_function(tallykhata_log)
-]
+    # Sent in the background; queued mails are still sent before exit
+    mail_dispatcher.send(msg, smtp_account=mail_dispatcher.account(EMAIL_USER, EMAIL_PASSWORD, SMTP_SERVER, SMTP_PORT))
+    print("Email queued.")
+
+
+# Jobs to be executed, in start order. Independent jobs run concurrently;
+# "depends_on" holds back a job until the listed jobs have finished.
+# "interval" is how often the job is refreshed in daemon mode. Each job's
+# module is imported when the job first runs (see lazy_job).
+jobs = {
+    "recharge_main": {"func": profile_function(lazy_job("recharge_controller", "recharge_main"))},
+    "nagad_money_in": {"func": profile_function(lazy_job("nagad_money_in", "nagad_money_in"))},
+    "sms_main": {"func": profile_function(lazy_job("sms_controller", "sms_main"))},
+    "cashin_rocket_main": {"func": profile_function(lazy_job("cash_in_rocket", "cashin_rocket_main"))},
+    "moneyout_main": {"func": profile_function(lazy_job("moneyout_controller", "moneyout_main"))},
+    "sqr_main_threaded": {"func": profile_function(lazy_job("sqr_controller", "sqr_main_threaded"))},
+    "bank_money_out": {"func": profile_function(lazy_job("bankout_controller", "bank_money_out"))},
+    "sqr_reg": {"func": profile_function(lazy_job("registration_controller_v2", "sqr_reg"))},
+    "main_daily_service_analysis": {"func": profile_function(lazy_job("daily_service_analysis", "main_daily_service_analysis"))},
+    "VISA_Transfers": {"func": profile_function(lazy_job("Visa_Card_Transfer", "VISA_Transfers"))},
+    "service_health": {"func": profile_function(lazy_job("service_health_all_service", "service_health")), "interval": 60},
+    "recharge_new": {"func": profile_function(lazy_job("recharge_new", "recharge_new"))},
+    "NPSB": {"func": profile_function(lazy_job("NPSB", "NPSB"))},
+    "porichoy": {"func": profile_function(lazy_job("porichoy", "porichoy"))},
+    "reconciliation_reports": {"func": profile_function(lazy_job("reconcilation", "reconciliation_reports")), "interval": 3600},
+    "threshold_avg": {"func": profile_function(lazy_job("avg_4week", "threshold_avg")), "interval": 900},
+    # Reads back the SQR tabs written by the two jobs below
+    "run_sqr_user_extraction": {
+        "func": profile_function(lazy_job("sqr_not_success", "run_sqr_user_extraction")),
+        "depends_on": ["sqr_main_threaded", "porichoy"]
+    },
+    "recharge_cashbackk": {"func": profile_function(lazy_job("recharge_cashback", "recharge_cashbackk"))},
+    "tk_premium": {"func": profile_function(lazy_job("tk_premium", "tk_premium"))},
+    # Balances are published up to all_balance.BALANCE_QUERY_TTL (60 s) old;
+    # a TTL at or above the interval would republish cached balances
+    "all_balance": {"func": profile_function(lazy_job("all_balance", "all_balance")), "interval": 300},
+    "fetch_and_update_ssl_balance": {"func": profile_function(lazy_job("ssl_balance", "fetch_and_update_ssl_balance"))},
+    "tp_reg": {"func": profile_function(lazy_job("registration_controller", "tp_reg"))},
+    "tallykhata_log": {"func": profile_function(lazy_job("tk_log", "tallykhata_log"))}
+}
 
 
 def main():
     print('Main controller initiating...')
+    cycle_start = time.time()
+
+    # Queue sheet writes and send them per spreadsheet in batches
+    if BUFFER_SHEET_WRITES:
+        isheet_controller.start_buffering()
+
+    # Run independent jobs concurrently within the worker budget
+    try:
+        job_status = run_jobs(jobs, max_workers=MAX_WORKERS, default_timeout=JOB_TIMEOUT)
+    finally:
+        if BUFFER_SHEET_WRITES:
+            isheet_controller.stop_buffering()
+    for job_name, state in job_status.items():
+        if state in (TIMED_OUT, SKIPPED):
+            timing_data[job_name] = state
 
-    # Run each function sequentially to ensure full completion
-    for func in functions_to_run:
-        func()
+    wall_time_seconds = time.time() - cycle_start
+    metrics.CYCLE_SECONDS.observe(wall_time_seconds)
 
     # Prepare timing summary
     total_time_seconds = 0
@@ -121,23 +136,97 @@ def main():
         if isinstance(elapsed_time, float):
             timing_summary += f"{func_name} took {elapsed_time:.2f} seconds to run.\n"
             total_time_seconds += elapsed_time
+        elif elapsed_time in (TIMED_OUT, SKIPPED):
+            timing_summary += f"{func_name} {elapsed_time}.\n"
         else:
             timing_summary += f"{func_name} failed to execute.\n"
 
     # Calculate total time in minutes
     total_time_minutes = total_time_seconds / 60
-    timing_summary += f"\nTotal execution time: {total_time_minutes:.2f} minutes."
+    timing_summary += f"\nTotal job time: {total_time_minutes:.2f} minutes."
+    timing_summary += f"\nTotal execution time: {wall_time_seconds / 60:.2f} minutes."
+
+    # Time spent waiting on the Sheets API quota limiters
+    for kind, stats in isheet_controller.limiter_stats().items():
+        timing_summary += (f"\nSheets {kind} requests: {stats['calls']}, "
+                           f"{stats['waited_calls']} throttled for {stats['wait_seconds']:.2f} seconds "
+                           f"(longest {stats['max_wait']:.2f}).")
 
     print(timing_summary)
+    if tracing.PRINT_SUMMARY:
+        print(f"\nStage timings over the last {tracing.SUMMARY_RUNS} runs of each job:\n{tracing.summarize(jobs=jobs)}")
 
     # Send the timing summary via email
     # send_email("DASHBOARD Script Execution Timing Summary", timing_summary, RECIPIENT_EMAIL)
 
 
-try:
-    main()
+# Daemon mode has no cycles; a pass lasts until every job has finished once
+# since the previous pass ended, and its wall time is reported as a cycle
+daemon_pass = {"start": None, "finished": set()}
+
+
+# Function to report each finished run in daemon mode
+def report_job(job_name, state):
+    elapsed_time = timing_data.get(job_name)
+    if state == DONE and isinstance(elapsed_time, float):
+        print(f"{job_name} took {elapsed_time:.2f} seconds to run.")
+    elif state == DONE:
+        print(f"{job_name} failed to execute.")
+    else:
+        print(f"{job_name} {state}.")
+
+    daemon_pass["finished"].add(job_name)
+    if daemon_pass["finished"] >= set(jobs):
+        metrics.CYCLE_SECONDS.observe(time.time() - daemon_pass["start"])
+        daemon_pass["start"] = time.time()
+        daemon_pass["finished"] = set()
 
-except Exception as e:
-    error_msg = traceback.format_exc()
-    print("Error occurred: ", error_msg)
-    # send_skype_msg(error_msg)
+
+# Keeps every job refreshed on its own interval until SIGTERM or SIGINT
+def run_daemon():
+    print('Main controller running in daemon mode...')
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"Received signal {signum}, finishing running jobs...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    if BUFFER_SHEET_WRITES:
+        isheet_controller.start_buffering()
+    daemon_pass["start"] = time.time()
+    try:
+        run_forever(jobs, max_workers=MAX_WORKERS, default_timeout=JOB_TIMEOUT,
+                    default_interval=DEFAULT_INTERVAL, stop_event=stop_event,
+                    shutdown_grace=SHUTDOWN_GRACE, on_finish=report_job)
+    finally:
+        if BUFFER_SHEET_WRITES:
+            isheet_controller.stop_buffering()
+    if tracing.PRINT_SUMMARY:
+        print(f"Stage timings over the last {tracing.SUMMARY_RUNS} runs of each job:\n{tracing.summarize(jobs=jobs)}")
+    print('Main controller stopped.')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refreshes the dashboard spreadsheets.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and refresh each job on its own interval")
+    parser.add_argument("--metrics-port", type=int, default=metrics.METRICS_PORT,
+                        help="serve Prometheus metrics on this port (0 to disable)")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.start_server(args.metrics_port)
+
+    try:
+        if args.daemon:
+            run_daemon()
+        else:
+            main()
+
+    except Exception as e:
+        error_msg = traceback.format_exc()
+        print("Error occurred: ", error_msg)
+        # send_skype_msg(error_msg)
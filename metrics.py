@@ -0,0 +1,194 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+import tracing
+
+load_dotenv()
+
+# The /metrics endpoint is only served when a port is configured
+METRICS_PORT = int(os.getenv("DASHBOARD_METRICS_PORT", 0))
+METRICS_HOST = os.getenv("DASHBOARD_METRICS_HOST", "127.0.0.1")
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._callback = None
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def set_callback(self, func):
+        """
+        Computes the values at scrape time instead: func() returns a dict of
+        label value tuples (in labelnames order) to values.
+        """
+        self._callback = func
+
+    def _samples(self):
+        if self._callback is not None:
+            values = self._callback()
+            return [(self.name, tuple(str(v) for v in key), (), value) for key, value in values.items()]
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {float(value)!r}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then sum and total count
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        samples = []
+        for key, counts in values.items():
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", key, (("le", repr(float(bound))),), count))
+            samples.append((f"{self.name}_bucket", key, (("le", "+Inf"),), counts[-1]))
+            samples.append((f"{self.name}_sum", key, (), counts[-2]))
+            samples.append((f"{self.name}_count", key, (), counts[-1]))
+        return samples
+
+
+# Function to render every metric in the Prometheus text format
+def render():
+    lines = []
+    for metric in list(_registry):
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            print(f"Error rendering metric {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+
+QUERY_SECONDS = Histogram("dashboard_query_seconds", "Time to execute a query.", ("query_key", "db"))
+QUERY_ROWS = Counter("dashboard_query_rows_total", "Rows fetched by queries.", ("query_key", "db"))
+POOL_WAIT_SECONDS = Histogram("dashboard_pg_pool_wait_seconds",
+                              "Time to get a pooled connection, including connecting.", ("db",))
+POOL_CONNECTIONS = Gauge("dashboard_pg_pool_connections",
+                         "Pooled connections by state (in_use, idle, max).", ("host", "db", "state"))
+SHEETS_SECONDS = Histogram("dashboard_sheets_request_seconds",
+                           "Time of Sheets API calls, including retries and limiter waits.", ("operation",))
+SHEETS_RETRIES = Counter("dashboard_sheets_retries_total", "Sheets API requests retried.", ("status",))
+SHEETS_LIMITER_WAIT = Counter("dashboard_sheets_limiter_wait_seconds_total",
+                              "Time Sheets requests waited on the quota limiter.", ("kind",))
+TAB_ROWS = Gauge("dashboard_tab_rows", "Rows in a tab after its last write.", ("spreadsheet", "tab"))
+ROWS_WRITTEN = Counter("dashboard_rows_written_total", "Rows sent to a tab, changed rows only.",
+                       ("spreadsheet", "tab"))
+TAB_STALENESS = Gauge("dashboard_tab_staleness_seconds",
+                      "Seconds since a tab was last confirmed up to date.", ("spreadsheet", "tab"))
+JOB_SECONDS = Histogram("dashboard_job_seconds", "Duration of a job run.", ("job", "status"))
+CYCLE_SECONDS = Histogram("dashboard_cycle_seconds",
+                          "Wall time of a full cycle, or in daemon mode of a pass in which every job finished.")
+QUERY_CACHE_LOOKUPS = Counter("dashboard_query_cache_total",
+                              "Query result cache lookups by result (hit, miss, wait).", ("result",))
+
+
+# Function to turn finished tracing spans into metrics
+def _observe_span(record):
+    stage, duration = record.get("stage"), record.get("duration", 0)
+    if stage == "execute":
+        QUERY_SECONDS.observe(duration, query_key=record.get("query_key", ""), db=record.get("db", ""))
+    elif stage == "fetch":
+        QUERY_ROWS.inc(record.get("rows", 0), query_key=record.get("query_key", ""), db=record.get("db", ""))
+    elif stage == "connect":
+        POOL_WAIT_SECONDS.observe(duration, db=record.get("db", ""))
+    elif stage in ("sheet-write", "sheet-read", "sheet-metadata"):
+        SHEETS_SECONDS.observe(duration, operation=stage)
+    elif stage == "job":
+        JOB_SECONDS.observe(duration, job=record.get("job", ""), status=record.get("status", ""))
+
+
+tracing.add_listener(_observe_span)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serves /metrics on a background thread and returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+if __name__ == "__main__":
+    print(render(), end="")
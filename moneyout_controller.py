@@ -1,8 +1,12 @@
+import itertools
 import os
 import traceback
 from dotenv import load_dotenv
-import psycopg2
-from isheet_controller import sheet_update
+import pg_pool
+import bucket_cache
+import tracing
+import request_log_extract
+from isheet_controller import sheet_update, sheet_update_stream
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 load_dotenv()
@@ -19,7 +23,7 @@ queries = {
         FROM
             tallypay_to_fi_integration.public.transaction_info ti
         WHERE
-            ti.create_date::date = CURRENT_DATE
+            ti.create_date >= %(start)s AND ti.create_date < %(end)s
             AND ti.financial_institute IN ('ROCKET', 'NAGAD')
         GROUP BY 1, 2, 3;
     ''',
@@ -33,65 +37,11 @@ queries = {
         FROM
             tallypay_to_fi_integration.public.transaction_info ti
         WHERE
-            ti.create_date::date >= CURRENT_DATE - interval '30 days'
-            AND ti.create_date <= NOW() - interval '5 minutes'
+            ti.create_date >= %(start)s AND ti.create_date < %(end)s
             AND ti.financial_institute IN ('ROCKET', 'NAGAD')
         GROUP BY 1, 2, 3;
     ''',
 
-    'rckt_log_hr_cohort': '''
-        select
-                                to_char(ti.create_date, 'HH24') as hour,
-                                (regexp_match(rl.response,
-                                '<ResponseCode>(.*?)</ResponseCode>.*?<ResponseMessage>(.*?)</ResponseMessage>'))[1] || ' -> ' || (regexp_match(rl.response,
-                                '<ResponseCode>(.*?)</ResponseCode>.*?<ResponseMessage>(.*?)</ResponseMessage>'))[2] as combined_result,
-                                count(distinct(ti.request_id))
-                            from
-                                tallypay_to_fi_integration.public.transaction_info ti
-                            inner join tallypay_to_fi_integration.public.request_log rl 
-                            on
-                                ti.request_id = rl.request_id
-                            where
-                                1 = 1
-                                and ti.create_date::date = 'now()'
-                                and ti.financial_institute = 'ROCKET'
-                                and rl.request ilike '%https://dbblobftlive.dutchbanglabank.com:8003/rocketgw/api/v1/%'
-                            group by
-                                1,
-                                2
-                            order by
-                                1 asc,
-                                3 desc
-                            ;
-    ''',
-
-    'rckt_log_day_cohort': '''
-        select
-                                    to_char(ti.create_date, 'YYYY-MM-DD') as date,
-                                    (regexp_match(rl.response,
-                                    '<ResponseCode>(.*?)</ResponseCode>.*?<ResponseMessage>(.*?)</ResponseMessage>'))[1] || ' -> ' || (regexp_match(rl.response,
-                                    '<ResponseCode>(.*?)</ResponseCode>.*?<ResponseMessage>(.*?)</ResponseMessage>'))[2] as combined_result,
-                                    count(distinct(ti.request_id))
-                                from
-                                    tallypay_to_fi_integration.public.transaction_info ti
-                                inner join tallypay_to_fi_integration.public.request_log rl 
-                                on
-                                    ti.request_id = rl.request_id
-                                where
-                                    1 = 1
-                                    and ti.create_date::date >= now() - interval '30 days'
-                                    and ti.create_date <= now() - interval '5 minutes'
-                                    and ti.financial_institute = 'ROCKET'
-                                    and rl.request ilike '%https://dbblobftlive.dutchbanglabank.com:8003/rocketgw/api/v1/%'
-                                group by
-                                    1,
-                                    2
-                                order by
-                                    1 asc,
-                                    3 desc
-                                ;
-    ''',
-
     'nagad_notsuccess_hr_cohort': '''
         select
                                         to_char(ti.create_date, 'HH24') as request_hr,
@@ -104,7 +54,7 @@ queries = {
                                         ti.request_id = rl.request_id
                                     where
                                         1 = 1
-                                        and ti.create_date::date = 'now()'
+                                        and ti.create_date >= CURRENT_DATE AND ti.create_date < CURRENT_DATE + interval '1 day'
                                         and ti.financial_institute = 'NAGAD'
                                         and ti.status <> 'SUCCESS'
                                         and rl.request ilike '%https://api.mynagad.com/api%'
@@ -130,7 +80,7 @@ queries = {
                                         ti.request_id = rl.request_id
                                     where
                                         1 = 1
-                                        and ti.create_date::date >= now() - interval '30 days'
+                                        and ti.create_date >= CURRENT_DATE - interval '29 days'
                                         and ti.financial_institute = 'NAGAD'
                                         and ti.status <> 'SUCCESS'
                                         and rl.request ilike '%https://api.mynagad.com/api%'
@@ -147,35 +97,55 @@ queries = {
 }
 
 
-# Function to execute a query and return the results
-def fetch_data(query, db_params):
+# Cohorts that only query their recent hours or days (see bucket_cache):
+# today's hourly cohort, and the day cohort of today and the 30 days before
+cached_queries = {
+    'hourly_cohort': lambda query, db_params: bucket_cache.fetch_today(
+        "moneyout_hourly_cohort", query, db_params, db_params["database"]),
+    'day_cohort': lambda query, db_params: bucket_cache.fetch_days(
+        "moneyout_day_cohort", query, db_params, db_params["database"], days=31, lag=bucket_cache.SETTLEMENT_LAG)
+}
+
+
+# Function to stream a query's rows, or None if it failed or returned nothing;
+# cached is the cached_queries entry of the query, if it has one
+def fetch_data(query, db_params, cached=None):
     try:
-        conn = psycopg2.connect(
-            database=db_params["database"],
-            user=db_params["user"],
-            password=db_params["password"],
-            host=db_params["host"],
-            port=db_params["port"]
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        if cached:
+            rows = iter(cached(query, db_params))
+        else:
+            rows = pg_pool.stream_rows(query, db_params, db_params["database"])
+        first = next(rows, None)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
+    return None if first is None else itertools.chain([first], rows)
 
 
-# Function to process each query and update the Google Sheet
+# Function to process each query and stream its rows into the Google Sheet
 def process_cohort(query_name, query, db_params, headers, sheet_name):
-    result = fetch_data(query, db_params)
-    data = [headers]
+    result = fetch_data(query, db_params, cached_queries.get(query_name))
+    if result:
+        if sheet_update_stream(itertools.chain([headers], result), sheet_name) is not None:
+            print(f"Data for {query_name} updated successfully in sheet '{sheet_name}'.")
+    else:
+        print(f"No data returned for {query_name}")
+
+
+# Rocket response tabs, served from the locally extracted request_log
+# aggregates instead of regex queries
+store_queries = {
+    'rckt_log_hr_cohort': lambda: request_log_extract.rocket_result_counts("hour"),
+    'rckt_log_day_cohort': lambda: request_log_extract.rocket_result_counts("day")
+}
+
+
+# Function to write a cohort tab from the request_log aggregates
+def process_stored_cohort(query_name, headers, sheet_name):
+    request_log_extract.refresh("rocket")
+    result = store_queries[query_name]()
     if result:
-        for row in result:
-            data.append(row)
-        sheet_update(data, sheet_name)
+        sheet_update([headers] + result, sheet_name)
         print(f"Data for {query_name} updated successfully in sheet '{sheet_name}'.")
     else:
         print(f"No data returned for {query_name}")
@@ -214,7 +184,7 @@ def moneyout_main():
     with ThreadPoolExecutor(max_workers=6) as executor:
         future_to_query = {
             executor.submit(
-                process_cohort,
+                tracing.bind(process_cohort, query_key=query_name),
                 query_name,
                 query,
                 db_params,
@@ -223,6 +193,13 @@ def moneyout_main():
             ): query_name
             for query_name, query in queries.items()
         }
+        for query_name in store_queries:
+            future_to_query[executor.submit(
+                tracing.bind(process_stored_cohort, query_key=query_name),
+                query_name,
+                headers_mapping[query_name],
+                sheet_mapping[query_name]
+            )] = query_name
 
         for future in as_completed(future_to_query):
             query_name = future_to_query[future]
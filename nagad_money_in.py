@@ -1,8 +1,8 @@
-import psycopg2
+import pg_pool
+import row_convert
+import tracing
 from isheet_controller import sheet_update
-from decimal import Decimal
 from dotenv import load_dotenv
-import datetime
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -33,7 +33,7 @@ queries = {
         FROM 
             nobopay_payment_gw.public.nagad_txn nt
         WHERE 
-            create_date::date = CURRENT_DATE
+            create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
         ORDER BY 
             id DESC;
     """,
@@ -99,7 +99,7 @@ ORDER BY
         FROM 
             nobopay_payment_gw.public.nagad_txn nt
         WHERE 
-            create_date::date = CURRENT_DATE
+            create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
             AND nagad_status = 'Failed'
         ORDER BY 
             id DESC;
@@ -138,18 +138,7 @@ ORDER BY
 # Function to fetch data from the database
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
@@ -160,13 +149,10 @@ def process_query(service_name, query, db_params, dbname, headers, sheet_name):
     data = [headers]
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
+        with tracing.span("transform", rows=len(result)):
+            for converted_row in row_convert.convert_rows(result, result.description):
+                if len(converted_row) == len(headers):
+                    data.append(converted_row)
 
         sheet_update(data, sheet_name)
         print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
@@ -205,7 +191,7 @@ def nagad_money_in():
     with ThreadPoolExecutor(max_workers=5) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params,
@@ -1,9 +1,11 @@
-import os
+import itertools
 from dotenv import load_dotenv
 
 import psycopg2
+import pg_pool
+import bucket_cache
 import traceback
-from isheet_controller import sheet_update
+from isheet_controller import sheet_update, sheet_update_stream
 
 load_dotenv()
 
@@ -22,8 +24,7 @@ def gen_q(q):
                     from
                         nobopay_payment_gw.public.nagad_txn nt
                     where
-                        nt.create_date::date = 'now()'
-                        and nt.create_date <= now() - interval '5 minutes'
+                        nt.create_date >= %(start)s AND nt.create_date < %(end)s
                         and nt.status not in ('ORDER_ERR', 'INITIATED', 'CHECKOUT')
                     group by
                         1,
@@ -46,9 +47,7 @@ def gen_q(q):
                 from
                     nobopay_payment_gw.public.nagad_txn nt
                 where
-                    1 = 1
-                    and nt.create_date::date >= now() - interval '30 days'
-                    and nt.create_date <= now() - interval '5 minutes'
+                    nt.create_date >= %(start)s AND nt.create_date < %(end)s
                     and nt.status not in ('ORDER_ERR', 'INITIATED', 'CHECKOUT')
                 group by
                     1,
@@ -64,36 +63,22 @@ def gen_q(q):
     return query[q]
 
 
-def pg_conn(query):
-    conn = None
-    cur = None
-
+# With a cache_key, query is one of today's hourly cohorts and only its
+# recent hours are queried; with days as well, it is a cohort of the last
+# `days` days and only its recent days are queried (see bucket_cache)
+def pg_conn(query, cache_key=None, days=None):
     try:
-        # establishing the connection
-        conn = psycopg2.connect(
-            # ---Please change the credentials---
-            database='nobopay_payment_gw',
-            user=os.environ.get("TP_PG_USR"),
-            password=os.environ.get("TP_PG_PWD"),
-            host=os.environ.get("TP_HOST"),
-            port='5432'
-        )
-
-        #print('Connection established')
-        cur = conn.cursor()
-        #print('Executing query')
-        cur.execute(query)
-        #print('Retreiving queryset')
-        queryset = cur.fetchall()
+        if cache_key and days:
+            queryset = bucket_cache.fetch_days(cache_key, query, pg_pool.env_db_params(), 'nobopay_payment_gw',
+                                               days=days, lag=bucket_cache.SETTLEMENT_LAG)
+        elif cache_key:
+            queryset = bucket_cache.fetch_today(cache_key, query, pg_pool.env_db_params(), 'nobopay_payment_gw',
+                                                lag=bucket_cache.SETTLEMENT_LAG)
+        else:
+            queryset = pg_pool.fetch_all(query, pg_pool.env_db_params(), 'nobopay_payment_gw')
     except psycopg2.Error as error:
         queryset = f"Error connecting to Postgres database: {error}"
-    finally:
-        if cur is not None:
-            cur.close()
-        if conn is not None:
-            conn.close()
 
-    # #print(queryset)
     return queryset
 
 
@@ -102,14 +87,19 @@ def nagadin_main():
     #print('Initiating nagad cash-in controller')
 
     q = gen_q("nagadin_hr")
-    q_r = pg_conn(q)
+    q_r = pg_conn(q, cache_key="nagadin_hr")
     nagadin_hr = [('Hour', 'status', 'NGD_Status', 'Count', 'Amt')] + q_r
     sheet_update(nagadin_hr, 'nagadin_curday_hour_cohort')
 
+    # The month cohort only queries its recent days; it can still be large,
+    # so its rows are written to the sheet in chunks
     q = gen_q('nagadin_m')
-    q_r = pg_conn(q)
-    nagadin_m = [('Day', 'status', 'NGD_Status', 'Count', 'Amt')] + q_r
-    sheet_update(nagadin_m, 'nagadin_curmonth_cohort')
+    q_r = pg_conn(q, cache_key="nagadin_m", days=30)
+    if isinstance(q_r, str):
+        print(q_r)
+    else:
+        nagadin_m = itertools.chain([('Day', 'status', 'NGD_Status', 'Count', 'Amt')], q_r)
+        sheet_update_stream(nagadin_m, 'nagadin_curmonth_cohort')
 
     #print('Nagad cash-in controller terminating...')
 
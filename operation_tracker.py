@@ -3,14 +3,13 @@ from datetime import datetime, timedelta
 import pandas as pd
 import warnings
 import mysql.connector
-import matplotlib.pyplot as plt
 from email.mime.image import MIMEImage
 import numpy as np
 from email.mime.text import MIMEText
-import smtplib
 from email.mime.multipart import MIMEMultipart
-import math
 from isheet_controller import sheet_update
+import mail_dispatcher
+import chart_render
 from dotenv import load_dotenv
 import os
 
@@ -59,7 +58,7 @@ def db_connection_and_result_set(host, database, user, password, conn, cur):
                 WHERE
                     1 = 1
                     AND i.author_id in ('44', '45', '59', '6', '41')
-                    AND DATE(i.start_date) >= CURDATE() - INTERVAL 30 DAY
+                    AND i.start_date >= CURDATE() - INTERVAL 30 DAY
                    ;
 
               '''
@@ -120,15 +119,13 @@ def db_result_dividor(db_result):
     return parent_list
 
 
+# Function to keep the first row of each issue
 def distinct_db_result(db_result):
     list1 = []
+    seen = set()
     for i in db_result:
-        flag = False
-        for j in list1:
-            if i[1] == j[1]:
-                flag = True
-                break
-        if flag == False:
+        if i[1] not in seen:
+            seen.add(i[1])
             list1.append(i)
     return list1
 
@@ -158,38 +155,32 @@ def thirty_days_list():
     return date_strings
 
 
+# Person of each ticket, matched on the address in this order
+PERSON_PATTERNS = ["irfan", "jannat", "afzal", "javeed", "shilton"]
+# Order of the people in the date-wise hours, sheet and chart
+COUNT_ORDER = ["irfan", "jannat", "javeed", "shilton", "afzal"]
+
+
+# Hours are totalled as whole millionths of an hour, so a total does not
+# depend on the order it is summed in and whole hours are not rounded up
+HOUR_UNITS = 1000000
+
+
+# Function to total each person's hours per date of date_list, rounded up,
+# one list per person in COUNT_ORDER
 def date_wise_count(date_list, db_list):
-    irfan_bhai_list = []
-    jannat_apu_list = []
-    afzal_list = []
-    javeed_bhai_list = []
-    shilton_bhai_list = []
-    for date in date_list:
-        irfan_bhai = 0
-        jannat_apu = 0
-        afzal = 0
-        javeed_bhai = 0
-        shilton_bhai = 0
-        for ticket in db_list:
-            timestamp = ticket[5]
-            hour = float(ticket[9])
-            date_string = timestamp.strftime('%Y-%m-%d')
-            if date == date_string and "irfan" in ticket[8]:
-                irfan_bhai += hour
-            elif date == date_string and "jannat" in ticket[8]:
-                jannat_apu += hour
-            elif date == date_string and "afzal" in ticket[8]:
-                afzal += hour
-            elif date == date_string and "javeed" in ticket[8]:
-                javeed_bhai += hour
-            elif date == date_string and "shilton" in ticket[8]:
-                shilton_bhai += hour
-        irfan_bhai_list.append(math.ceil(irfan_bhai))
-        jannat_apu_list.append(math.ceil(jannat_apu))
-        afzal_list.append(math.ceil(afzal))
-        javeed_bhai_list.append(math.ceil(javeed_bhai))
-        shilton_bhai_list.append(math.ceil(shilton_bhai))
-    return [irfan_bhai_list, jannat_apu_list, javeed_bhai_list, shilton_bhai_list, afzal_list]
+    hours = pd.Series([ticket[9] for ticket in db_list], dtype=object).astype(float)
+    frame = pd.DataFrame({
+        "date": pd.to_datetime(pd.Series([ticket[5] for ticket in db_list], dtype=object)).dt.normalize(),
+        "address": pd.Series([ticket[8] for ticket in db_list], dtype=object),
+        "units": (hours * HOUR_UNITS).round().astype("int64")
+    })
+    frame["person"] = np.select([frame["address"].str.contains(pattern, regex=False, na=False)
+                                 for pattern in PERSON_PATTERNS], PERSON_PATTERNS, default="")
+    units = (frame.groupby(["person", "date"])["units"].sum()
+             .unstack(fill_value=0)
+             .reindex(index=COUNT_ORDER, columns=pd.to_datetime(date_list), fill_value=0))
+    return [[-(-value // HOUR_UNITS) for value in row] for row in units.to_numpy(dtype="int64").tolist()]
 
 
 def build_sheet_data(date_list, individual_count):
@@ -217,7 +208,9 @@ def build_sheet_data(date_list, individual_count):
     return result
 
 
-def graph_builder(date_list, individual):
+# Function to draw the stacked per-person bars of each date on figure
+def draw_graph(figure, data):
+    date_list, individual = data
     date_list1 = []
     for i in date_list:
         date = i[5:7] + "\n" + i[8:] + "\n" + i[0:4]
@@ -231,15 +224,15 @@ def graph_builder(date_list, individual):
     y5 = np.array(individual[4])
 
     # plot bars in stack manner
-    plt.figure(figsize=(9, 6))
-    ax1 = plt.bar(x, y1, color='r')
-    ax2 = plt.bar(x, y2, bottom=y1, color='b')
-    ax3 = plt.bar(x, y3, bottom=y1 + y2, color='y')
-    ax4 = plt.bar(x, y4, bottom=y1 + y2 + y3, color='g')
-    ax5 = plt.bar(x, y5, bottom=y1 + y2 + y3 + y4, color='purple')
-    plt.xlabel("Dates")
-    plt.xticks(rotation=0, fontsize=6)
-    plt.ylabel("Hour")
+    ax = figure.subplots()
+    ax1 = ax.bar(x, y1, color='r')
+    ax2 = ax.bar(x, y2, bottom=y1, color='b')
+    ax3 = ax.bar(x, y3, bottom=y1 + y2, color='y')
+    ax4 = ax.bar(x, y4, bottom=y1 + y2 + y3, color='g')
+    ax5 = ax.bar(x, y5, bottom=y1 + y2 + y3 + y4, color='purple')
+    ax.set_xlabel("Dates")
+    ax.tick_params(axis='x', labelrotation=0, labelsize=6)
+    ax.set_ylabel("Hour")
 
     for r1, r2, r3, r4, r5 in zip(ax1, ax2, ax3, ax4, ax5):
         h1 = r1.get_height()
@@ -248,28 +241,28 @@ def graph_builder(date_list, individual):
         h4 = r4.get_height()
         h5 = r5.get_height()
         if h1 > 0:
-            plt.text(r1.get_x() + r1.get_width() / 2., h1 / 2., "%d" % h1, ha="center", va="center", color="white",
-                     fontsize=6)
+            ax.text(r1.get_x() + r1.get_width() / 2., h1 / 2., "%d" % h1, ha="center", va="center", color="white",
+                    fontsize=6)
         if h2 > 0:
-            plt.text(r2.get_x() + r2.get_width() / 2., h1 + h2 / 2., "%d" % h2, ha="center", va="center", color="white",
-                     fontsize=6)
+            ax.text(r2.get_x() + r2.get_width() / 2., h1 + h2 / 2., "%d" % h2, ha="center", va="center", color="white",
+                    fontsize=6)
         if h3 > 0:
-            plt.text(r3.get_x() + r3.get_width() / 2., h1 + h2 + h3 / 2., "%d" % h3, ha="center", va="center",
-                     color="white", fontsize=6)
+            ax.text(r3.get_x() + r3.get_width() / 2., h1 + h2 + h3 / 2., "%d" % h3, ha="center", va="center",
+                    color="white", fontsize=6)
         if h4 > 0:
-            plt.text(r3.get_x() + r3.get_width() / 2., h1 + h2 + h3 + h4 / 2., "%d" % h4, ha="center", va="center",
-                     color="white", fontsize=6)
+            ax.text(r3.get_x() + r3.get_width() / 2., h1 + h2 + h3 + h4 / 2., "%d" % h4, ha="center", va="center",
+                    color="white", fontsize=6)
         if h5 > 0:
-            plt.text(r3.get_x() + r3.get_width() / 2., h1 + h2 + h3 + h4 + h5 / 2., "%d" % h5, ha="center", va="center",
-                     color="white", fontsize=6)
+            ax.text(r3.get_x() + r3.get_width() / 2., h1 + h2 + h3 + h4 + h5 / 2., "%d" % h5, ha="center", va="center",
+                    color="white", fontsize=6)
+
+    ax.legend(["Irfan Bhai", "Jannat Apu", "Javeed Bhai", "Shilton Bhai", "Afzal"])
+    ax.set_title("Tech_Ops Operation Hourly Count")
 
-    plt.legend(["Irfan Bhai", "Jannat Apu", "Javeed Bhai", "Shilton Bhai", "Afzal"])
-    plt.title("Tech_Ops Operation Hourly Count")
-    plt.savefig("graph.png")
 
-    with open('graph.png', 'rb') as f:
-        img_data = f.read()
-    img = MIMEImage(img_data)
+def graph_builder(date_list, individual):
+    png = chart_render.render("operation_hourly_count", [date_list, individual], draw_graph, figsize=(9, 6))
+    img = MIMEImage(png)
     img.add_header('Content-ID', '<graph>')
 
     return img
@@ -373,11 +366,7 @@ def send_mail(sender, receiver, Cc, mail_pass, subject, pivot_table, img):
     html_part = MIMEText(mail_body, 'html')
     message.attach(html_part)
 
-    with smtplib.SMTP('smtp.gmail.com', 587) as smtp:
-        smtp.starttls()
-        smtp.login(sender, mail_pass)
-        smtp.send_message(message)
-        smtp.close()
+    mail_dispatcher.send(message, smtp_account=mail_dispatcher.account(sender, mail_pass))
 
     #print("Mail Sent")
 
@@ -0,0 +1,306 @@
+import atexit
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import PoolError
+from dotenv import load_dotenv
+
+import query_cache
+import row_convert
+import tracing
+import metrics
+
+load_dotenv()
+
+# Pool sizing and housekeeping, shared by every (host, database, user) pool
+POOL_MINCONN = int(os.getenv("PG_POOL_MINCONN", 0))
+POOL_MAXCONN = int(os.getenv("PG_POOL_MAXCONN", 8))
+# Idle connections above POOL_MINCONN are closed after this many seconds
+POOL_IDLE_TIMEOUT = float(os.getenv("PG_POOL_IDLE_TIMEOUT", 300))
+# Connections idle for longer than this are pinged before being handed out
+POOL_CHECK_AFTER = float(os.getenv("PG_POOL_CHECK_AFTER", 30))
+# How long a caller waits for a free connection when the pool is full
+POOL_WAIT_TIMEOUT = float(os.getenv("PG_POOL_WAIT_TIMEOUT", 60))
+# Rows fetched per round trip by streaming (server-side) cursors
+STREAM_ITERSIZE = int(os.getenv("PG_STREAM_ITERSIZE", 2000))
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of autocommit connections to a single database.
+
+    Connections run in autocommit mode so every query sees a fresh NOW()
+    and no connection is left idle in a transaction between jobs.
+    """
+
+    def __init__(self, connect_kwargs, minconn=POOL_MINCONN, maxconn=POOL_MAXCONN,
+                 idle_timeout=POOL_IDLE_TIMEOUT, check_after=POOL_CHECK_AFTER):
+        self.connect_kwargs = connect_kwargs
+        self.minconn = minconn
+        self.maxconn = max(1, maxconn)
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self._idle = []  # (connection, last used) pairs, most recent last
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        conn.autocommit = True
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def _evict_idle(self):
+        # Close connections that sat unused for too long, keeping minconn open
+        now = time.monotonic()
+        open_count = len(self._idle) + self._in_use
+        keep = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.idle_timeout and open_count > self.minconn:
+                self._close(conn)
+                open_count -= 1
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+
+    def getconn(self, timeout=POOL_WAIT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.maxconn:
+                    conn, last_used = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError(f"connection pool exhausted for {self.connect_kwargs.get('database')}")
+                self._cond.wait(remaining)
+
+        # Health checks and new connections happen outside the lock
+        try:
+            if conn is not None:
+                stale = time.monotonic() - last_used > self.check_after
+                if conn.closed or (stale and not self._is_alive(conn)):
+                    self._close(conn)
+                    conn = None
+            if conn is None:
+                conn = self._connect()
+            return conn
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed and not conn.autocommit:
+            # Someone switched autocommit off; end whatever they started
+            try:
+                conn.rollback()
+                conn.autocommit = True
+            except Exception:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            return {"in_use": self._in_use, "idle": len(self._idle), "max": self.maxconn}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Function to get (or create) the pool for a host, database and credentials
+def get_pool(dbname, user, password, host, port='5432'):
+    key = (host, str(port), dbname, user, password)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool({
+                "database": dbname,
+                "user": user,
+                "password": password,
+                "host": host,
+                "port": str(port)
+            })
+            _pools[key] = pool
+        return pool
+
+
+@contextmanager
+def connection(dbname, db_params):
+    """
+    Borrows a pooled connection for db_params (user, password, host and an
+    optional port) and returns it to the pool afterwards. Connections that
+    broke while in use are discarded instead of being reused.
+    """
+    pool = get_pool(dbname, db_params['user'], db_params['password'],
+                    db_params['host'], db_params.get('port', '5432'))
+    with tracing.span("connect", db=dbname):
+        conn = pool.getconn()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+
+
+class Rows(list):
+    """Rows of a result, keeping the cursor's description of its columns."""
+
+    def __init__(self, rows, description):
+        super().__init__(rows)
+        self.description = description
+
+
+# Function to key a query's result in query_cache
+def _cache_key(kind, query, db_params, dbname, params):
+    return (kind, db_params.get('host'), str(db_params.get('port', '5432')), dbname,
+            db_params.get('user'), query, repr(params))
+
+
+# Function to run a query on a pooled connection and return every row.
+# Without params the query is sent as is; with params, literal % signs in it
+# must be written as %%. With a ttl (seconds) the result is shared with every
+# job running the same query within the ttl (see query_cache)
+def fetch_all(query, db_params, dbname, params=None, ttl=None):
+    if ttl:
+        rows = query_cache.get_or_compute(_cache_key("all", query, db_params, dbname, params), ttl,
+                                          lambda: fetch_all(query, db_params, dbname, params))
+        # A copy, so callers can change their rows without touching the cache
+        return Rows(rows, rows.description)
+    with connection(dbname, db_params) as conn:
+        with conn.cursor() as cur:
+            with tracing.span("execute", db=dbname):
+                cur.execute(query, params)
+            with tracing.span("fetch", db=dbname) as span:
+                rows = Rows(cur.fetchall(), cur.description)
+                span["rows"] = len(rows)
+            return rows
+
+
+# Function to run a query on a pooled connection and return the first row;
+# ttl as in fetch_all
+def fetch_one(query, db_params, dbname, params=None, ttl=None):
+    if ttl:
+        return query_cache.get_or_compute(_cache_key("one", query, db_params, dbname, params), ttl,
+                                          lambda: fetch_one(query, db_params, dbname, params),
+                                          size=lambda row: 1)
+    with connection(dbname, db_params) as conn:
+        with conn.cursor() as cur:
+            with tracing.span("execute", db=dbname):
+                cur.execute(query, params)
+            with tracing.span("fetch", db=dbname):
+                return cur.fetchone()
+
+
+# Function to run a query on a named server-side cursor and yield its rows,
+# fetching itersize rows per round trip so the result set is never held in
+# memory as a whole. With convert, rows are converted for the sheets with
+# row_convert (formats as in row_convert.convert_rows). Named cursors need a
+# transaction, so the connection leaves autocommit while the rows are read
+# and is handed back rolled back. The connection stays checked out, idle in
+# that transaction, until the last row is read: read the rows to the end
+# without waiting on other services in between (isheet_controller.stream_tab
+# spools them to a file before writing)
+def stream_rows(query, db_params, dbname, params=None, itersize=STREAM_ITERSIZE,
+                convert=False, formats=None):
+    with connection(dbname, db_params) as conn:
+        conn.autocommit = False
+        try:
+            with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+                cur.itersize = itersize
+                with tracing.span("execute", db=dbname):
+                    cur.execute(query, params)
+                while True:
+                    with tracing.span("fetch", db=dbname) as span:
+                        rows = cur.fetchmany(itersize)
+                        span["rows"] = len(rows)
+                    if not rows:
+                        break
+                    if convert:
+                        rows = row_convert.convert_rows(rows, cur.description, formats)
+                    yield from rows
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+
+
+# Function to build db_params from the TP_* environment variables
+def env_db_params(suffix=""):
+    return {
+        "user": os.getenv(f"TP_PG_USR{suffix}"),
+        "password": os.getenv(f"TP_PG_PWD{suffix}"),
+        "host": os.getenv(f"TP_HOST{suffix}"),
+        "port": '5432'
+    }
+
+
+# Function to report pool usage per (host, database), summed over users
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.items())
+    stats = {}
+    for (host, _, dbname, _, _), pool in pools:
+        totals = stats.setdefault((host, dbname), {"in_use": 0, "idle": 0, "max": 0})
+        for name, value in pool.stats().items():
+            totals[name] += value
+    return stats
+
+
+metrics.POOL_CONNECTIONS.set_callback(
+    lambda: {(host, dbname, state): value
+             for (host, dbname), stats in pool_stats().items()
+             for state, value in stats.items()}
+)
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.closeall()
+
+
+atexit.register(close_all)
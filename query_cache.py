@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+# Results of queries that opt in with a ttl are kept in memory and shared by
+# every job running the same query (text, params, server, database and
+# user) until the ttl passes. Concurrent runs of a query that is not cached
+# wait for the first one instead of sending it again. Least recently used
+# results are dropped beyond QUERY_CACHE_MAX_ENTRIES results or
+# QUERY_CACHE_MAX_ROWS rows in total.
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE", "1") == "1"
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 256))
+QUERY_CACHE_MAX_ROWS = int(os.getenv("QUERY_CACHE_MAX_ROWS", 200000))
+
+_entries = OrderedDict()  # key -> (expires at, row count, value), oldest use first
+_rows = 0
+_in_flight = {}  # key -> _Flight of the run computing it
+_lock = threading.Lock()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _evict():
+    global _rows
+    while _entries and (len(_entries) > QUERY_CACHE_MAX_ENTRIES or _rows > QUERY_CACHE_MAX_ROWS):
+        _, (_, row_count, _) = _entries.popitem(last=False)
+        _rows -= row_count
+
+
+def get_or_compute(key, ttl, compute, size=len):
+    """
+    Returns the value cached under key, or computes it with compute() and
+    keeps it for ttl seconds. While one caller computes a key, the others
+    asking for it wait and get the same value (or the same exception).
+    size(value) gives the value's row count for the memory bound. Values are
+    shared, so callers must not change them.
+    """
+    global _rows
+    if not QUERY_CACHE_ENABLED or not ttl:
+        return compute()
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _entries.move_to_end(key)
+            metrics.QUERY_CACHE_LOOKUPS.inc(result="hit")
+            return entry[2]
+        flight = _in_flight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _in_flight[key] = _Flight()
+
+    if not leader:
+        metrics.QUERY_CACHE_LOOKUPS.inc(result="wait")
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    metrics.QUERY_CACHE_LOOKUPS.inc(result="miss")
+    try:
+        value = compute()
+    except Exception as e:
+        # Failures are handed to the waiting callers but not cached
+        flight.error = e
+        with _lock:
+            del _in_flight[key]
+        flight.done.set()
+        raise
+
+    row_count = size(value)
+    with _lock:
+        del _in_flight[key]
+        old = _entries.pop(key, None)
+        if old is not None:
+            _rows -= old[1]
+        if row_count <= QUERY_CACHE_MAX_ROWS:
+            _entries[key] = (time.monotonic() + ttl, row_count, value)
+            _rows += row_count
+            _evict()
+    flight.value = value
+    flight.done.set()
+    return value
+
+
+def clear():
+    global _rows
+    with _lock:
+        _entries.clear()
+        _rows = 0
+
+
+# Function to report the cache's current size
+def stats():
+    with _lock:
+        return {"entries": len(_entries), "rows": _rows, "in_flight": len(_in_flight)}
@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` calls per `per` seconds, with
+    bursts of up to `capacity` calls.
+
+    acquire() blocks until a token is available and returns how long the
+    caller waited; the totals are kept for reporting.
+    """
+
+    def __init__(self, rate, per=60.0, capacity=None):
+        self.rate = float(rate)
+        self.per = float(per)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._waited_calls = 0
+        self._wait_seconds = 0.0
+        self._max_wait = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate / self.per)
+        self._updated = now
+
+    def acquire(self):
+        start = time.monotonic()
+        with self._lock:
+            # Reserve a token now, possibly driving the balance negative, so
+            # waiting callers are served in the order they arrived
+            self._refill(start)
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens * self.per / self.rate)
+            self._calls += 1
+            if wait > 0:
+                self._waited_calls += 1
+                self._wait_seconds += wait
+                self._max_wait = max(self._max_wait, wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "waited_calls": self._waited_calls,
+                "wait_seconds": self._wait_seconds,
+                "max_wait": self._max_wait
+            }
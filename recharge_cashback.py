@@ -1,8 +1,7 @@
-import psycopg2
+import pg_pool
+import row_convert
 from isheet_controller import sheet_update, sheet_update2
-from decimal import Decimal
 from dotenv import load_dotenv
-import datetime
 import os
 
 # Load environment variables from .env file
@@ -61,18 +60,7 @@ queries = {
 
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname)
 
     except Exception as e:
         #print(f"Error fetching data: {e}")
@@ -111,9 +99,7 @@ def recharge_cashbackk():
         data = [headers]
 
         if result:
-            for row in result:
-                converted_row = [x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x for x in row]
-
+            for converted_row in row_convert.convert_rows(result, result.description):
                 if len(converted_row) == len(headers):
                     data.append(converted_row)
                 else:
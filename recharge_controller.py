@@ -1,7 +1,8 @@
-import os
 from dotenv import load_dotenv
 
 import psycopg2
+import pg_pool
+import bucket_cache
 
 
 import traceback
@@ -23,8 +24,7 @@ def gen_q(q):
                 from
                     topup_service.public.top_up_info tui
                 where
-                    create_date::date = 'now()'
-                    and create_date <= NOW() - interval '5 minutes'
+                    create_date >= %(start)s AND create_date < %(end)s
                 group by
                     1,
                     2,
@@ -60,7 +60,7 @@ def gen_q(q):
                     from
                         topup_service.public.top_up_info t
                     where
-                        create_date::date = 'now()'
+                        create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
                         and create_date <= now() - interval '5 minutes'
                         and t.status != 'SUCCESS'
                     group by
@@ -81,9 +81,7 @@ def gen_q(q):
                 from
                     topup_service.public.top_up_info tui
                 where
-                    1=1 
-                    and create_date::date >= now() - interval '30 days'
-                    and create_date <= now() - interval '5 minutes'
+                    create_date >= %(start)s AND create_date < %(end)s
                 group by
                     1,
                     2
@@ -115,7 +113,7 @@ def gen_q(q):
                                 top_up_info tui
                             where
                                 1 = 1
-                                and create_date::date = 'now()'
+                                and create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
                                 and create_date <= now() - interval '5 minutes'
                             group by
                                 1,
@@ -147,9 +145,7 @@ def gen_q(q):
                                 from
                                     top_up_info tui
                                 where
-                                    1 = 1
-                                    and create_date::date >= now() - interval '30 days'
-                                    and create_date <= now() - interval '5 minutes'
+                                    create_date >= %(start)s AND create_date < %(end)s
                                 group by
                                     1,
                                     2
@@ -166,10 +162,10 @@ def gen_q(q):
                         to_char(create_date, 'YYYY-MM-DD') as "day",
                         case
                             when description is null then 'NULL'
-                            when description like 'invalid transfer value%' then 'Invalid Transfer Value'
-                            when description like 'The mobile number%cannot use the same recharge service within 2.00 minutes of last successful transaction as last transfer amount is same as current requested amount.' then 'duplicate 2 minutes'
-                            when description like '%3006202:The mobile number%cannot use the any recharge service within 3.00 minutes of last successful transaction as last transfer amount is same as current requested amount.%' then 'duplicate 3 minutes'
-                            when description like '%Your current request to transfer % TAKA cannot be processed as you do not have enough credit.%' then 'Your current request to transfer {amount} TAKA cannot be processed as you do not have enough credit'
+                            when description like 'invalid transfer value%%' then 'Invalid Transfer Value'
+                            when description like 'The mobile number%%cannot use the same recharge service within 2.00 minutes of last successful transaction as last transfer amount is same as current requested amount.' then 'duplicate 2 minutes'
+                            when description like '%%3006202:The mobile number%%cannot use the any recharge service within 3.00 minutes of last successful transaction as last transfer amount is same as current requested amount.%%' then 'duplicate 3 minutes'
+                            when description like '%%Your current request to transfer %% TAKA cannot be processed as you do not have enough credit.%%' then 'Your current request to transfer {amount} TAKA cannot be processed as you do not have enough credit'
                             else description
                         end as description,
                         COUNT(t.txn_id) as count,
@@ -182,8 +178,7 @@ def gen_q(q):
                     from
                         topup_service.public.top_up_info t
                     where
-                        create_date::date >= now() - interval '30 days'
-                        and create_date <= now() - interval '5 minutes'
+                        create_date >= %(start)s AND create_date < %(end)s
                         and t.status != 'SUCCESS'
                     group by
                         1,
@@ -207,38 +202,24 @@ def gen_q(q):
     return query[q]
 
 
-def pg_conn(query):
-    conn = None
-    cur = None
-
+# With a cache_key, query is one of today's hourly cohorts and only its
+# recent hours are queried; with days as well, it is a cohort of the last
+# `days` days and only its recent days are queried (see bucket_cache)
+def pg_conn(query, cache_key=None, days=None):
     try:
-        # establishing the connection
-        conn = psycopg2.connect(
-            # ---Please change the credentials---
-            database='topup_service',
-            user=os.environ.get("TP_PG_USR"),
-            password=os.environ.get("TP_PG_PWD"),
-            host=os.environ.get("TP_HOST"),
-            port='5432'
-        )
-
-        ##print('Connection established')
-        cur = conn.cursor()
-        ##print('Executing query')
-        cur.execute(query)
-        ##print('Retreiving queryset')
-        queryset = cur.fetchall()
+        if cache_key and days:
+            queryset = bucket_cache.fetch_days(cache_key, query, pg_pool.env_db_params(), 'topup_service',
+                                               days=days, lag=bucket_cache.SETTLEMENT_LAG)
+        elif cache_key:
+            queryset = bucket_cache.fetch_today(cache_key, query, pg_pool.env_db_params(), 'topup_service',
+                                                lag=bucket_cache.SETTLEMENT_LAG)
+        else:
+            queryset = pg_pool.fetch_all(query, pg_pool.env_db_params(), 'topup_service')
     except psycopg2.Error as error:
         queryset = f"Error connecting to Postgres database: {error}"
     except Exception as query_error:
         queryset = f"Error executing query: {query_error}"
-    finally:
-        if cur is not None:
-            cur.close()
-        if conn is not None:
-            conn.close()
 
-    # ##print(queryset)
     return queryset
 
 
@@ -247,7 +228,7 @@ def recharge_main():
     ##print('Recharge program initiated...')
 
     q = gen_q("stat_q")
-    tui_r = pg_conn(q)
+    tui_r = pg_conn(q, cache_key="recharge_stat_q")
     ##print(tui_r)
     stat_r = [('hour', 'status', 'operator', 'status_count', 'amount')] + tui_r
     sheet_update(stat_r, 'recharge_curday_hour_cohort')
@@ -258,7 +239,7 @@ def recharge_main():
     sheet_update(desc_r, 'recharge_description')
 
     q = gen_q("sum_q")
-    tui_r = pg_conn(q)
+    tui_r = pg_conn(q, cache_key="recharge_sum_q", days=30)
     sum_r = [('day','status', 'status_count', 'amount')] + tui_r
     sheet_update(sum_r, 'recharge_month_summary')
 
@@ -268,12 +249,12 @@ def recharge_main():
     sheet_update(tui_r, 'recharge_duration_curday_hour_cohort')
 
     q = gen_q("month_duration_cohort")
-    tui_r = pg_conn(q)
+    tui_r = pg_conn(q, cache_key="recharge_month_duration_cohort", days=30)
     tui_r = [('day', 'duration', 'status_count')] + tui_r
     sheet_update(tui_r, 'recharge_duration_curm_cohort')
 
     q = gen_q("desc_m_q")
-    tui_r = pg_conn(q)
+    tui_r = pg_conn(q, cache_key="recharge_desc_m_q", days=30)
     tui_r = [('day', 'description', 'status_count')] + tui_r
     sheet_update(tui_r, 'desc_month_cohort')
 
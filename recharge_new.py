@@ -1,8 +1,8 @@
-import psycopg2
+import pg_pool
+import row_convert
+import tracing
 from isheet_controller import sheet_update
-from decimal import Decimal
 from dotenv import load_dotenv
-import datetime
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -19,7 +19,7 @@ queries = {
     FROM 
         topup_service.public.top_up_info tui
     WHERE 
-        create_date::date = CURRENT_DATE
+        create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
         AND create_date <= NOW() - interval '5 minutes'
     GROUP BY 
         1, 2
@@ -52,7 +52,7 @@ queries = {
     from
         topup_service.public.top_up_info tui
     where 1=1
-        and create_date::date = 'now()'
+        and create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
         and create_date <= NOW() - interval '5 minutes'
     group by
         1,
@@ -87,7 +87,7 @@ queries = {
         FROM 
             topup_service.public.top_up_info tui
         WHERE 
-            create_date::date = CURRENT_DATE
+            create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
             AND status NOT IN ('SUCCESS')
             AND create_date <= NOW() - interval '5 minutes'
         GROUP BY 
@@ -105,7 +105,7 @@ queries = {
         FROM 
             topup_service.public.top_up_info tui
         WHERE 
-            create_date::date = CURRENT_DATE
+            create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
             AND status NOT IN ('SUCCESS')
             AND create_date <= NOW() - interval '5 minutes'
         GROUP BY 
@@ -124,7 +124,7 @@ queries = {
         FROM 
             topup_service.public.top_up_info tui
         WHERE 
-            create_date::date = CURRENT_DATE
+            create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
             AND status NOT IN ('SUCCESS')
             AND create_date <= NOW() - interval '5 minutes'
         GROUP BY 
@@ -196,7 +196,7 @@ queries = {
         FROM
             topup_service.public.top_up_info tui
         WHERE
-            create_date::date = CURRENT_DATE
+            create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
             AND create_date <= NOW() - INTERVAL '5 minutes'
         GROUP BY
             1, 2, 3
@@ -228,7 +228,7 @@ queries = {
     FROM
         top_up_info tui
     WHERE
-        create_date::date = CURRENT_DATE
+        create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day'
         AND create_date <= NOW() - INTERVAL '5 minutes'
     GROUP BY
         1, 2, 3
@@ -241,18 +241,7 @@ queries = {
 # Function to fetch data from the database
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
@@ -263,13 +252,10 @@ def process_query(service_name, query, db_params, dbname, headers, sheet_name):
     data = [headers]
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
+        with tracing.span("transform", rows=len(result)):
+            for converted_row in row_convert.convert_rows(result, result.description):
+                if len(converted_row) == len(headers):
+                    data.append(converted_row)
 
         sheet_update(data, sheet_name)
         print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
@@ -332,7 +318,7 @@ def recharge_new():
     with ThreadPoolExecutor(max_workers=10) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params,
@@ -1,8 +1,8 @@
-import psycopg2
-from isheet_controller import sheet_update
-from decimal import Decimal
+import pg_pool
+import tracing
+from isheet_controller import sheet_update_stream
 from dotenv import load_dotenv
-import datetime
+import itertools
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -20,7 +20,7 @@ queries = {
                COUNT(*) OVER (PARTITION BY id, tallykhata_user_id) AS transaction_count
         FROM sync_appevent
         WHERE event_name = 'event_sqr_rtlr_form_open'
-        AND created_at::date = CURRENT_DATE
+        AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + interval '1 day'
         ORDER BY id DESC;
     """,
 
@@ -34,7 +34,7 @@ queries = {
         FROM audit_log
         WHERE old_value = 'CUSTOMER'
         AND new_value IN ('MERCHANT', 'MICRO_MERCHANT')
-        AND create_date::date = CURRENT_DATE;
+        AND create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day';
     """,
 
     # SQR approved monthly count
@@ -51,41 +51,24 @@ queries = {
     """
 }
 
-# Function to fetch data from the database
+# Function to stream rows from the database, or None if the query failed
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        rows = pg_pool.stream_rows(query, db_params, dbname, convert=True)
+        first = next(rows, None)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
+    return None if first is None else itertools.chain([first], rows)
 
-# Function to handle each query and update the corresponding Google Sheet
+# Function to handle each query and stream its rows into the corresponding Google Sheet
 def process_query(service_name, query, db_params, dbname, headers, sheet_name):
     result = fetch_data(query, db_params, dbname)
-    data = [headers]
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
-
-        sheet_update(data, sheet_name)
-        print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
+        data = itertools.chain([headers], (row for row in result if len(row) == len(headers)))
+        if sheet_update_stream(data, sheet_name) is not None:
+            print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
     else:
         print(f"No data returned for {service_name}")
 
@@ -124,7 +107,7 @@ def sqr_reg():
     with ThreadPoolExecutor(max_workers=5) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params_2 if service_name == "sqr_form_opened_today" else db_params,
@@ -0,0 +1,410 @@
+import datetime
+import json
+import os
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import local_store
+import pg_pool
+import tracing
+
+load_dotenv()
+
+# Error messages, response codes and receivers are parsed out of request_log
+# here instead of with regexes in every dashboard query. A row is read once,
+# when it is older than its source's lag and its status has settled: each
+# refresh pulls the rows created between the previous refresh's end (the
+# high-water mark kept in the store) and the database's clock minus the lag,
+# and adds them to the stored hour aggregates. The store keeps EXTRACT_DAYS
+# days; a source without a high-water mark is backfilled once.
+EXTRACT_STORE = "request_log_store.sqlite3"
+EXTRACT_DAYS = 30
+# Jobs asking for a refresh within this many seconds of the last one reuse it
+EXTRACT_MIN_INTERVAL = float(os.getenv("REQUEST_LOG_MIN_INTERVAL", 30))
+
+EXTRACT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extract_marks (
+    source TEXT PRIMARY KEY,
+    fetched_before TEXT NOT NULL,
+    refreshed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sqr_status_hours (
+    hour_start TEXT NOT NULL,
+    status TEXT,
+    request_count INTEGER NOT NULL,
+    success_amount REAL NOT NULL,
+    last_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sqr_status_hours_hour ON sqr_status_hours (hour_start);
+CREATE TABLE IF NOT EXISTS sqr_error_receivers (
+    hour_start TEXT NOT NULL,
+    status TEXT,
+    receiver TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sqr_error_receivers_hour ON sqr_error_receivers (hour_start);
+CREATE TABLE IF NOT EXISTS sqr_success_times (
+    create_date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sqr_success_times_date ON sqr_success_times (create_date);
+CREATE TABLE IF NOT EXISTS rocket_result_hours (
+    hour_start TEXT NOT NULL,
+    result TEXT,
+    request_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rocket_result_hours_hour ON rocket_result_hours (hour_start);
+"""
+
+# Rows of a source created in [start, end)
+SQR_ROWS_QUERY = """
+    SELECT create_date, request_id, request, response
+    FROM tallypay_issuer.public.request_log
+    WHERE create_date >= %(start)s AND create_date < %(end)s
+"""
+
+ROCKET_ROWS_QUERY = """
+    SELECT ti.create_date, ti.request_id, rl.response
+    FROM tallypay_to_fi_integration.public.transaction_info ti
+    INNER JOIN tallypay_to_fi_integration.public.request_log rl
+        ON ti.request_id = rl.request_id
+    WHERE ti.create_date >= %(start)s AND ti.create_date < %(end)s
+      AND ti.financial_institute = 'ROCKET'
+      AND rl.request ILIKE '%%https://dbblobftlive.dutchbanglabank.com:8003/rocketgw/api/v1/%%'
+"""
+
+MESSAGE_PATTERN = re.compile(r'"message":\s*"([^"]+)"')
+ERROR_PATTERN = re.compile(r'"error":\s*"([^"]+)"')
+RECEIVER_PATTERN = re.compile(r'"receiver_wallet_no":\s*"([^"]+)"')
+ROCKET_RESULT_PATTERN = re.compile(
+    r'<ResponseCode>(.*?)</ResponseCode>.*?<ResponseMessage>(.*?)</ResponseMessage>', re.S
+)
+NPSB_CREDIT = "npsb transfer credit"
+
+# SQR statuses are final once the request is 3 minutes old; Rocket
+# responses are read after 5 minutes, the cut-off its day tab always had
+SQR_LAG = datetime.timedelta(minutes=3)
+ROCKET_LAG = datetime.timedelta(minutes=5)
+# Window of the SQR PAYMENT health check
+SQR_HEALTH_WINDOW = datetime.timedelta(minutes=30)
+
+# Timestamps as stored: hours, high-water marks and times
+HOUR_FORMAT = '%Y-%m-%d %H:%M'
+MARK_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_refresh_locks = {"sqr": threading.Lock(), "rocket": threading.Lock()}
+_refreshed_at = {}
+
+
+# Function to return the group of the last match of pattern, the way the
+# '.*"message":\s*"([^"]+)"' style expressions in the old queries did
+def last_match(pattern, text):
+    match = None
+    for match in pattern.finditer(text):
+        pass
+    return match.group(1) if match else None
+
+
+# Function to tell whether a response matches ILIKE '%{%NPSB transfer credit%}%'
+def is_npsb_credit(response):
+    lower = response.lower()
+    brace = lower.find("{")
+    if brace < 0:
+        return False
+    text = lower.find(NPSB_CREDIT, brace + 1)
+    return text >= 0 and lower.rfind("}") >= text + len(NPSB_CREDIT)
+
+
+# Function to pick an SQR request's status: SUCCESS for NPSB transfer
+# credits, otherwise the response's message or error, otherwise the response
+def sqr_status(response):
+    if response is None:
+        return None
+    if is_npsb_credit(response):
+        return "SUCCESS"
+    return last_match(MESSAGE_PATTERN, response) or last_match(ERROR_PATTERN, response) or response
+
+
+# Function to read the top-level amount of a JSON response, if any
+def response_amount(response):
+    try:
+        amount = json.loads(response).get("amount")
+        return float(amount) if amount is not None else None
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+# Function to combine a Rocket response's code and message as "code -> message"
+def rocket_result(response):
+    match = ROCKET_RESULT_PATTERN.search(response) if response else None
+    return f"{match.group(1)} -> {match.group(2)}" if match else None
+
+
+# Function to label the hour a timestamp falls in, as stored
+def hour_key(value):
+    return value.replace(minute=0, second=0, microsecond=0).strftime(HOUR_FORMAT)
+
+
+# Function to fold new SQR request_log rows into per-hour aggregates, as
+# rows to add to the store's tables
+def aggregate_sqr(rows):
+    statuses = {}
+    receivers = set()
+    success_times = []
+    for create_date, request_id, request, response in rows:
+        status = sqr_status(response)
+        # The health check looks at every request
+        if status == "SUCCESS":
+            success_times.append({"create_date": create_date.strftime(MARK_FORMAT)})
+        if request_id is None or request is None or "hex" in request.lower():
+            continue
+
+        hour = hour_key(create_date)
+        totals = statuses.setdefault((hour, status), [0, 0.0, create_date])
+        totals[0] += 1
+        totals[2] = max(totals[2], create_date)
+        if status == "SUCCESS":
+            totals[1] += response_amount(response) or 0.0
+        # Receivers are counted for every request that is not a transfer credit
+        if response is not None and not is_npsb_credit(response):
+            receiver = last_match(RECEIVER_PATTERN, request) or ""
+            receivers.add((hour, status, receiver))
+
+    return {
+        "sqr_status_hours": [
+            {"hour": hour, "status": status, "count": count, "amount": amount,
+             "last_time": last_time.strftime(TIME_FORMAT)}
+            for (hour, status), (count, amount, last_time) in statuses.items()
+        ],
+        "sqr_error_receivers": [
+            {"hour": hour, "status": status, "receiver": receiver}
+            for hour, status, receiver in sorted(receivers, key=lambda row: (row[0], row[1] or "", row[2]))
+        ],
+        "sqr_success_times": success_times
+    }
+
+
+# Function to fold new Rocket transfers into distinct request counts per
+# hour and result. A transfer's request_log rows share its create_date, so
+# they all come in the same refresh
+def aggregate_rocket(rows):
+    requests = {}
+    for create_date, request_id, response in rows:
+        requests.setdefault((hour_key(create_date), rocket_result(response)), set()).add(request_id)
+    return {
+        "rocket_result_hours": [
+            {"hour": hour, "result": result, "count": len(ids)} for (hour, result), ids in requests.items()
+        ]
+    }
+
+
+SOURCES = {
+    "sqr": {
+        "dbname": "tallypay_issuer",
+        "query": SQR_ROWS_QUERY,
+        "lag": SQR_LAG,
+        "aggregate": aggregate_sqr,
+        "tables": ["sqr_status_hours", "sqr_error_receivers", "sqr_success_times"]
+    },
+    "rocket": {
+        "dbname": "tallypay_to_fi_integration",
+        "query": ROCKET_ROWS_QUERY,
+        "lag": ROCKET_LAG,
+        "aggregate": aggregate_rocket,
+        "tables": ["rocket_result_hours"]
+    }
+}
+
+# Store table -> (statement adding to an existing row or None, statement
+# inserting a new one), run for each aggregated row until one changes a row.
+# Statuses and results can be NULL, hence the IS comparisons
+FOLD_STATEMENTS = {
+    "sqr_status_hours": (
+        "UPDATE sqr_status_hours SET request_count = request_count + :count, "
+        "success_amount = success_amount + :amount, last_time = MAX(last_time, :last_time) "
+        "WHERE hour_start = :hour AND status IS :status",
+        "INSERT INTO sqr_status_hours VALUES (:hour, :status, :count, :amount, :last_time)"
+    ),
+    "sqr_error_receivers": (
+        None,
+        "INSERT INTO sqr_error_receivers SELECT :hour, :status, :receiver WHERE NOT EXISTS ("
+        "SELECT 1 FROM sqr_error_receivers "
+        "WHERE hour_start = :hour AND status IS :status AND receiver = :receiver)"
+    ),
+    "sqr_success_times": (
+        None,
+        "INSERT INTO sqr_success_times VALUES (:create_date)"
+    ),
+    "rocket_result_hours": (
+        "UPDATE rocket_result_hours SET request_count = request_count + :count "
+        "WHERE hour_start = :hour AND result IS :result",
+        "INSERT INTO rocket_result_hours VALUES (:hour, :result, :count)"
+    )
+}
+
+
+# Function to add aggregated rows to a store table
+def fold(conn, table, rows):
+    update, insert = FOLD_STATEMENTS[table]
+    for row in rows:
+        if update is None or not conn.execute(update, row).rowcount:
+            conn.execute(insert, row)
+
+
+# Function to pull a source's rows created since its high-water mark and
+# add them to its aggregates; skipped when the last refresh is recent enough
+def refresh(source_name):
+    source = SOURCES[source_name]
+    with _refresh_locks[source_name]:
+        last = _refreshed_at.get(source_name)
+        if last is not None and time.monotonic() - last < EXTRACT_MIN_INTERVAL:
+            return
+
+        db_params = pg_pool.env_db_params()
+        now = pg_pool.fetch_one("SELECT LOCALTIMESTAMP", db_params, source["dbname"])[0]
+        end = now - source["lag"]
+        oldest = datetime.datetime.combine(now.date() - datetime.timedelta(days=EXTRACT_DAYS - 1),
+                                           datetime.time())
+
+        with local_store.connect(EXTRACT_STORE, EXTRACT_SCHEMA) as conn:
+            mark = conn.execute("SELECT fetched_before FROM extract_marks WHERE source = ?",
+                                (source_name,)).fetchone()
+        start = max(oldest, datetime.datetime.strptime(mark[0], MARK_FORMAT)) if mark else oldest
+
+        tables = {}
+        if start < end:
+            rows = pg_pool.stream_rows(source["query"], db_params, source["dbname"],
+                                       params={"start": start, "end": end})
+            with tracing.span("extract", source=source_name):
+                tables = source["aggregate"](rows)
+
+        with local_store.connect(EXTRACT_STORE, EXTRACT_SCHEMA) as conn:
+            # Moving the mark first takes the store's write lock; if another
+            # process moved it since it was read, that process already
+            # added these rows
+            if mark:
+                moved = conn.execute(
+                    "UPDATE extract_marks SET fetched_before = ?, refreshed_at = ? "
+                    "WHERE source = ? AND fetched_before = ?",
+                    (max(start, end).strftime(MARK_FORMAT), now.strftime(TIME_FORMAT), source_name, mark[0])
+                ).rowcount
+            else:
+                moved = conn.execute(
+                    "INSERT OR IGNORE INTO extract_marks (source, fetched_before, refreshed_at) VALUES (?, ?, ?)",
+                    (source_name, max(start, end).strftime(MARK_FORMAT), now.strftime(TIME_FORMAT))
+                ).rowcount
+                if moved:
+                    # A first run (or one after the store changed format)
+                    # rebuilds the source's aggregates from scratch
+                    for table in source["tables"]:
+                        conn.execute(f"DELETE FROM {table}")
+            if moved:
+                for table, rows in tables.items():
+                    fold(conn, table, rows)
+                for table in source["tables"]:
+                    if table == "sqr_success_times":
+                        conn.execute("DELETE FROM sqr_success_times WHERE create_date < ?",
+                                     ((now - SQR_HEALTH_WINDOW).strftime(MARK_FORMAT),))
+                    else:
+                        conn.execute(f"DELETE FROM {table} WHERE hour_start < ?", (oldest.strftime(HOUR_FORMAT),))
+        _refreshed_at[source_name] = time.monotonic()
+        if moved:
+            print(f"Extracted request_log of {source_name} from {start:%Y-%m-%d %H:%M:%S}.")
+
+
+# Function to return the time of a source's last refresh, by the database's clock
+def source_now(conn, source_name):
+    mark = conn.execute("SELECT refreshed_at FROM extract_marks WHERE source = ?",
+                        (source_name,)).fetchone()
+    return datetime.datetime.strptime(mark[0], TIME_FORMAT) if mark else datetime.datetime.now()
+
+
+# Function to return the day of a source's last refresh, by the database's clock
+def source_today(conn, source_name):
+    return source_now(conn, source_name).date().isoformat()
+
+
+# Function to build the period label and the first hour_start to include
+# for hourly (today's hours, as 'HH') or daily ('YYYY-MM-DD') results
+def period(conn, source_name, by):
+    if by == "hour":
+        return "substr(hour_start, 12, 2)", source_today(conn, source_name)
+    return "substr(hour_start, 1, 10)", ""
+
+
+# Function to return SQR request counts per hour (today) or day, as
+# (period, status, count), ordered by period and count descending
+def sqr_status_counts(by="hour"):
+    with local_store.connect(EXTRACT_STORE, EXTRACT_SCHEMA) as conn:
+        label, since = period(conn, "sqr", by)
+        return conn.execute(
+            f"SELECT {label}, status, SUM(request_count) FROM sqr_status_hours "
+            f"WHERE hour_start >= ? GROUP BY 1, 2 ORDER BY 1, 3 DESC", (since,)
+        ).fetchall()
+
+
+# Function to return distinct receivers of failed SQR requests per hour
+# (today) or day, as (period, status, count), latest period first
+def sqr_error_receivers(by="hour"):
+    with local_store.connect(EXTRACT_STORE, EXTRACT_SCHEMA) as conn:
+        label, since = period(conn, "sqr", by)
+        rows = conn.execute(
+            f"SELECT {label}, status, COUNT(DISTINCT NULLIF(receiver, '')) FROM sqr_error_receivers "
+            f"WHERE hour_start >= ? GROUP BY 1, 2 ORDER BY 1 DESC, 3 DESC", (since,)
+        ).fetchall()
+    # The sheet has always shown these counts as text
+    return [(when, status, str(count)) for when, status, count in rows]
+
+
+# Function to return distinct Rocket transfers per hour (today) or day and
+# response, as (period, "code -> message", count)
+def rocket_result_counts(by="hour"):
+    with local_store.connect(EXTRACT_STORE, EXTRACT_SCHEMA) as conn:
+        label, since = period(conn, "rocket", by)
+        return conn.execute(
+            f"SELECT {label}, result, SUM(request_count) FROM rocket_result_hours "
+            f"WHERE hour_start >= ? GROUP BY 1, 2 ORDER BY 1, 3 DESC", (since,)
+        ).fetchall()
+
+
+# Function to compute today's SQR PAYMENT health row as (date,
+# last_success_time, success, reverse, failed, dispute, success_amount,
+# health, success_rate), or None when there were no requests today
+def sqr_health():
+    with local_store.connect(EXTRACT_STORE, EXTRACT_SCHEMA) as conn:
+        now = source_now(conn, "sqr")
+        today = now.date().isoformat()
+        recent_success = conn.execute(
+            "SELECT COUNT(*) FROM sqr_success_times WHERE create_date >= ?",
+            ((now - SQR_HEALTH_WINDOW).strftime(MARK_FORMAT),)
+        ).fetchone()[0]
+        total, success, reverse, amount, last_success = conn.execute(
+            "SELECT SUM(request_count), "
+            "SUM(CASE WHEN status = 'SUCCESS' THEN request_count ELSE 0 END), "
+            "SUM(CASE WHEN status = 'REVERSED' THEN request_count ELSE 0 END), "
+            "SUM(success_amount), "
+            "MAX(CASE WHEN status = 'SUCCESS' THEN last_time END) "
+            "FROM sqr_status_hours WHERE hour_start >= ?", (today,)
+        ).fetchone()
+    if not total:
+        return None
+
+    if recent_success < 5:
+        health = "NOT OK"
+    elif recent_success <= 20:
+        health = "ACCEPTABLE"
+    else:
+        health = "OK"
+    return (
+        today,
+        last_success[11:16] if last_success else "00:00",
+        success,
+        reverse,
+        total - success - reverse,
+        0,
+        f"{int(amount + 0.5):,}",
+        health,
+        f"{success * 100.0 / total:.2f}%"
+    )
@@ -0,0 +1,84 @@
+import datetime
+from decimal import Decimal
+
+# PostgreSQL type OIDs, as reported in cursor.description's type_code
+DATE_OID = 1082
+TIMESTAMP_OIDS = {
+    1114,  # timestamp
+    1184   # timestamptz
+}
+NUMERIC_OIDS = {
+    1700   # numeric
+}
+
+
+# Function to write a date (or the date of a timestamp) the way the sheets expect
+def to_date_string(value):
+    return value.strftime('%Y-%m-%d')
+
+
+# Function to write a date column; isoformat gives the same text much faster
+def to_iso_date(value):
+    return value.isoformat()
+
+
+# Function to format an amount as a whole number with thousands separators
+def to_thousands(value):
+    return f"{int(value):,}"
+
+
+# Function to convert a single value when its column type is not known
+def convert_value(value):
+    if isinstance(value, datetime.date):
+        return to_date_string(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def column_converters(description, formats=None):
+    """
+    Returns one conversion function per result column, or None for columns
+    passed through as they are. Columns are picked by their type in
+    description; formats maps a column index or name to a function that
+    replaces the default for that column.
+    """
+    formats = formats or {}
+    converters = []
+    for index, column in enumerate(description):
+        name, type_code = column[0], column[1]
+        if index in formats:
+            converters.append(formats[index])
+        elif name in formats:
+            converters.append(formats[name])
+        elif type_code == DATE_OID:
+            converters.append(to_iso_date)
+        elif type_code in TIMESTAMP_OIDS:
+            converters.append(to_date_string)
+        elif type_code in NUMERIC_OIDS:
+            # Numerics go to the sheet as numbers
+            converters.append(float)
+        else:
+            converters.append(None)
+    return converters
+
+
+def convert_rows(rows, description, formats=None):
+    """
+    Converts rows for the sheet: dates become ISO strings and numerics become
+    floats, unless formats says otherwise. The column types are looked up once
+    from description; without one every value is checked on its own.
+    """
+    if description is None:
+        return [[convert_value(value) for value in row] for row in rows]
+
+    active = [(index, func) for index, func in enumerate(column_converters(description, formats)) if func]
+    converted = []
+    for row in rows:
+        row = list(row)
+        for index, func in active:
+            value = row[index]
+            if value is not None:
+                row[index] = func(value)
+        converted.append(row)
+    return converted
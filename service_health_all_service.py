@@ -1,8 +1,9 @@
-import psycopg2
+import pg_pool
+import row_convert
+import tracing
+import request_log_extract
 from isheet_controller import sheet_update
-from decimal import Decimal
 from dotenv import load_dotenv
-import datetime
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -11,239 +12,6 @@ load_dotenv()
 
 # Queries
 queries = {
-    "RECHARGE (GP)": """
-    WITH date_generator AS (
-    SELECT CURRENT_DATE AS date
-),
-service_health_calc AS (
-    SELECT 
-        SUM(CASE WHEN status = 'SUCCESS' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS success_percentage
-    FROM top_up_info
-    WHERE create_date >= NOW() - interval '30 minutes'
-      AND create_date <= NOW() - interval '3 minutes'
-      AND mobile_operator = 'GP'
-)
-SELECT
-    dg.date AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN tui.status = 'SUCCESS' THEN tui.create_date END), 'HH24:MI'), '00:00') AS last_success_time,
-    COALESCE(SUM(CASE WHEN tui.status = 'SUCCESS' THEN 1 ELSE 0 END), 0) AS success,
-    COALESCE(SUM(CASE WHEN tui.status = 'REVERSED' THEN 1 ELSE 0 END), 0) AS reverse,
-    COALESCE(SUM(CASE WHEN tui.status = 'FAILED' THEN 1 ELSE 0 END), 0) AS failed,
-    COALESCE(SUM(CASE WHEN tui.status NOT IN ('SUCCESS', 'REVERSED', 'FAILED') THEN 1 ELSE 0 END), 0) AS dispute,
-    COALESCE(TRUNC(SUM(CASE WHEN tui.status = 'SUCCESS' THEN tui.amount ELSE 0 END)), 0) AS today_success_amount,
-    COALESCE(
-        CASE 
-            WHEN shc.success_percentage IS NULL OR shc.success_percentage = 0 THEN 'DOWN'
-            WHEN shc.success_percentage < 30 THEN 'NOT OK'
-            WHEN shc.success_percentage BETWEEN 30 AND 70 THEN 'ACCEPTABLE'
-            WHEN shc.success_percentage > 70 THEN 'OK'
-        END, 'DOWN'
-    ) AS service_health,
-    COALESCE(ROUND(shc.success_percentage, 2) || '%', '0%') AS success_rate
-FROM 
-    date_generator dg
-LEFT JOIN top_up_info tui
-    ON DATE(tui.create_date) = dg.date
-   AND tui.create_date <= NOW() - interval '3 minutes'
-   AND tui.mobile_operator = 'GP'
-LEFT JOIN service_health_calc shc ON TRUE
-GROUP BY 
-    dg.date, shc.success_percentage
-ORDER BY 
-    success DESC,
-    reverse DESC,
-    failed DESC,
-    dispute DESC;
-    """,
-
-
-    "RECHARGE (BL)": """
-    WITH date_generator AS (
-    SELECT CURRENT_DATE AS date
-),
-service_health_calc AS (
-    SELECT 
-        SUM(CASE WHEN status = 'SUCCESS' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS success_percentage
-    FROM top_up_info
-    WHERE create_date >= NOW() - interval '30 minutes'
-      AND create_date <= NOW() - interval '3 minutes'
-      AND mobile_operator = 'BL'
-)
-SELECT
-    dg.date AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN tui.status = 'SUCCESS' THEN tui.create_date END), 'HH24:MI'), '00:00') AS last_success_time,
-    COALESCE(SUM(CASE WHEN tui.status = 'SUCCESS' THEN 1 ELSE 0 END), 0) AS success,
-    COALESCE(SUM(CASE WHEN tui.status = 'REVERSED' THEN 1 ELSE 0 END), 0) AS reverse,
-    COALESCE(SUM(CASE WHEN tui.status = 'FAILED' THEN 1 ELSE 0 END), 0) AS failed,
-    COALESCE(SUM(CASE WHEN tui.status NOT IN ('SUCCESS', 'REVERSED', 'FAILED') THEN 1 ELSE 0 END), 0) AS dispute,
-    COALESCE(TRUNC(SUM(CASE WHEN tui.status = 'SUCCESS' THEN tui.amount ELSE 0 END)), 0) AS today_success_amount,
-    COALESCE(
-        CASE 
-            WHEN shc.success_percentage IS NULL OR shc.success_percentage = 0 THEN 'DOWN'
-            WHEN shc.success_percentage < 30 THEN 'NOT OK'
-            WHEN shc.success_percentage BETWEEN 30 AND 70 THEN 'ACCEPTABLE'
-            WHEN shc.success_percentage > 70 THEN 'OK'
-        END, 'DOWN'
-    ) AS service_health,
-    COALESCE(ROUND(shc.success_percentage, 2) || '%', '0%') AS success_rate
-FROM 
-    date_generator dg
-LEFT JOIN top_up_info tui
-    ON DATE(tui.create_date) = dg.date
-   AND tui.create_date <= NOW() - interval '3 minutes'
-   AND tui.mobile_operator = 'BL'
-LEFT JOIN service_health_calc shc ON TRUE
-GROUP BY 
-    dg.date, shc.success_percentage
-ORDER BY 
-    success DESC,
-    reverse DESC,
-    failed DESC,
-    dispute DESC;
-    """,
-
-
-    "RECHARGE (ROBI)": """
-     WITH date_generator AS (
-    SELECT CURRENT_DATE AS date
-),
-service_health_calc AS (
-    SELECT 
-        SUM(CASE WHEN status = 'SUCCESS' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS success_percentage
-    FROM top_up_info
-    WHERE create_date >= NOW() - interval '30 minutes'
-      AND create_date <= NOW() - interval '3 minutes'
-      AND mobile_operator = 'ROBI'
-)
-SELECT
-    dg.date AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN tui.status = 'SUCCESS' THEN tui.create_date END), 'HH24:MI'), '00:00') AS last_success_time,
-    COALESCE(SUM(CASE WHEN tui.status = 'SUCCESS' THEN 1 ELSE 0 END), 0) AS success,
-    COALESCE(SUM(CASE WHEN tui.status = 'REVERSED' THEN 1 ELSE 0 END), 0) AS reverse,
-    COALESCE(SUM(CASE WHEN tui.status = 'FAILED' THEN 1 ELSE 0 END), 0) AS failed,
-    COALESCE(SUM(CASE WHEN tui.status NOT IN ('SUCCESS', 'REVERSED', 'FAILED') THEN 1 ELSE 0 END), 0) AS dispute,
-    COALESCE(TRUNC(SUM(CASE WHEN tui.status = 'SUCCESS' THEN tui.amount ELSE 0 END)), 0) AS today_success_amount,
-    COALESCE(
-        CASE 
-            WHEN shc.success_percentage IS NULL OR shc.success_percentage = 0 THEN 'DOWN'
-            WHEN shc.success_percentage < 30 THEN 'NOT OK'
-            WHEN shc.success_percentage BETWEEN 30 AND 70 THEN 'ACCEPTABLE'
-            WHEN shc.success_percentage > 70 THEN 'OK'
-        END, 'DOWN'
-    ) AS service_health,
-    COALESCE(ROUND(shc.success_percentage, 2) || '%', '0%') AS success_rate
-FROM 
-    date_generator dg
-LEFT JOIN top_up_info tui
-    ON DATE(tui.create_date) = dg.date
-   AND tui.create_date <= NOW() - interval '3 minutes'
-   AND tui.mobile_operator = 'ROBI'
-LEFT JOIN service_health_calc shc ON TRUE
-GROUP BY 
-    dg.date, shc.success_percentage
-ORDER BY 
-    success DESC,
-    reverse DESC,
-    failed DESC,
-    dispute DESC;
-    """,
-
-
-
-    "RECHARGE (AIRTEL)": """
-      WITH date_generator AS (
-    SELECT CURRENT_DATE AS date
-),
-service_health_calc AS (
-    SELECT 
-        SUM(CASE WHEN status = 'SUCCESS' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS success_percentage
-    FROM top_up_info
-    WHERE create_date >= NOW() - interval '30 minutes'
-      AND create_date <= NOW() - interval '3 minutes'
-      AND mobile_operator = 'AIRTEL'
-)
-SELECT
-    dg.date AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN tui.status = 'SUCCESS' THEN tui.create_date END), 'HH24:MI'), '00:00') AS last_success_time,
-    COALESCE(SUM(CASE WHEN tui.status = 'SUCCESS' THEN 1 ELSE 0 END), 0) AS success,
-    COALESCE(SUM(CASE WHEN tui.status = 'REVERSED' THEN 1 ELSE 0 END), 0) AS reverse,
-    COALESCE(SUM(CASE WHEN tui.status = 'FAILED' THEN 1 ELSE 0 END), 0) AS failed,
-    COALESCE(SUM(CASE WHEN tui.status NOT IN ('SUCCESS', 'REVERSED', 'FAILED') THEN 1 ELSE 0 END), 0) AS dispute,
-    COALESCE(TRUNC(SUM(CASE WHEN tui.status = 'SUCCESS' THEN tui.amount ELSE 0 END)), 0) AS today_success_amount,
-    COALESCE(
-        CASE 
-            WHEN shc.success_percentage IS NULL OR shc.success_percentage = 0 THEN 'DOWN'
-            WHEN shc.success_percentage < 30 THEN 'NOT OK'
-            WHEN shc.success_percentage BETWEEN 30 AND 70 THEN 'ACCEPTABLE'
-            WHEN shc.success_percentage > 70 THEN 'OK'
-        END, 'DOWN'
-    ) AS service_health,
-    COALESCE(ROUND(shc.success_percentage, 2) || '%', '0%') AS success_rate
-FROM 
-    date_generator dg
-LEFT JOIN top_up_info tui
-    ON DATE(tui.create_date) = dg.date
-   AND tui.create_date <= NOW() - interval '3 minutes'
-   AND tui.mobile_operator = 'AIRTEL'
-LEFT JOIN service_health_calc shc ON TRUE
-GROUP BY 
-    dg.date, shc.success_percentage
-ORDER BY 
-    success DESC,
-    reverse DESC,
-    failed DESC,
-    dispute DESC;
-    """,
-
-
-
-   "RECHARGE (TT)": """
-     WITH date_generator AS (
-    SELECT CURRENT_DATE AS date
-),
-service_health_calc AS (
-    SELECT 
-        SUM(CASE WHEN status = 'SUCCESS' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS success_percentage
-    FROM top_up_info
-    WHERE create_date >= NOW() - interval '30 minutes'
-      AND create_date <= NOW() - interval '3 minutes'
-      AND mobile_operator = 'TT'
-)
-SELECT
-    dg.date AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN tui.status = 'SUCCESS' THEN tui.create_date END), 'HH24:MI'), '00:00') AS last_success_time,
-    COALESCE(SUM(CASE WHEN tui.status = 'SUCCESS' THEN 1 ELSE 0 END), 0) AS success,
-    COALESCE(SUM(CASE WHEN tui.status = 'REVERSED' THEN 1 ELSE 0 END), 0) AS reverse,
-    COALESCE(SUM(CASE WHEN tui.status = 'FAILED' THEN 1 ELSE 0 END), 0) AS failed,
-    COALESCE(SUM(CASE WHEN tui.status NOT IN ('SUCCESS', 'REVERSED', 'FAILED') THEN 1 ELSE 0 END), 0) AS dispute,
-    COALESCE(TRUNC(SUM(CASE WHEN tui.status = 'SUCCESS' THEN tui.amount ELSE 0 END)), 0) AS today_success_amount,
-    COALESCE(
-        CASE 
-            WHEN shc.success_percentage IS NULL OR shc.success_percentage = 0 THEN 'DOWN'
-            WHEN shc.success_percentage < 30 THEN 'NOT OK'
-            WHEN shc.success_percentage BETWEEN 30 AND 70 THEN 'ACCEPTABLE'
-            WHEN shc.success_percentage > 70 THEN 'OK'
-        END, 'DOWN'
-    ) AS service_health,
-    COALESCE(ROUND(shc.success_percentage, 2) || '%', '0%') AS success_rate
-FROM 
-    date_generator dg
-LEFT JOIN top_up_info tui
-    ON DATE(tui.create_date) = dg.date
-   AND tui.create_date <= NOW() - interval '3 minutes'
-   AND tui.mobile_operator = 'TT'
-LEFT JOIN service_health_calc shc ON TRUE
-GROUP BY 
-    dg.date, shc.success_percentage
-ORDER BY 
-    success DESC,
-    reverse DESC,
-    failed DESC,
-    dispute DESC;
-    """,
-
-
-
     "NAGAD IN": """
              WITH date_generator AS (
     SELECT CURRENT_DATE AS date
@@ -289,7 +57,8 @@ SELECT
 FROM 
     date_generator dg
 LEFT JOIN nagad_txn ntx
-    ON DATE(ntx.create_date) = dg.date
+    ON ntx.create_date >= dg.date
+   AND ntx.create_date < dg.date + interval '1 day'
    AND ntx.create_date <= NOW() - interval '3 minutes'
 LEFT JOIN service_health_calc shc ON TRUE
 GROUP BY 
@@ -335,7 +104,8 @@ SELECT
 FROM 
     date_generator dg
 LEFT JOIN dbbl_transaction dtx
-    ON DATE(dtx.create_date) = dg.date
+    ON dtx.create_date >= dg.date
+   AND dtx.create_date < dg.date + interval '1 day'
    AND dtx.create_date <= NOW() - interval '3 minutes'
 LEFT JOIN service_health_calc shc ON TRUE
 GROUP BY 
@@ -349,101 +119,6 @@ ORDER BY
 
 
 
-    "ROCKET OUT": """
-              WITH date_generator AS (
-    SELECT CURRENT_DATE AS date
-),
-service_health_calc AS (
-    SELECT 
-        SUM(CASE WHEN status = 'SUCCESS' AND amount >= 10 THEN 1 ELSE 0 END) * 100.0 / NULLIF(COUNT(CASE WHEN amount >= 10 THEN 1 END), 0) AS success_percentage
-    FROM transaction_info
-    WHERE create_date >= NOW() - interval '30 minutes'
-      AND create_date <= NOW() - interval '3 minutes'
-      AND financial_institute = 'ROCKET'
-)
-SELECT
-    dg.date AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN ti.status = 'SUCCESS' THEN ti.create_date END), 'HH24:MI'), '00:00') AS last_success_time,
-    COALESCE(SUM(CASE WHEN ti.status = 'SUCCESS' THEN 1 ELSE 0 END), 0) AS success,
-    COALESCE(SUM(CASE WHEN ti.status = 'REVERSE' THEN 1 ELSE 0 END), 0) AS reverse,
-    COALESCE(SUM(CASE WHEN ti.status = 'FAILED' AND ti.amount >= 10 THEN 1 ELSE 0 END), 0) AS failed,
-    COALESCE(SUM(CASE WHEN ti.status NOT IN ('SUCCESS', 'REVERSE', 'FAILED') THEN 1 ELSE 0 END), 0) AS dispute,
-    COALESCE(TRUNC(SUM(CASE WHEN ti.status = 'SUCCESS' THEN ti.amount ELSE 0 END)), 0) AS today_success_amount,
-    COALESCE(
-        CASE 
-            WHEN shc.success_percentage IS NULL OR shc.success_percentage = 0 THEN 'DOWN'
-            WHEN shc.success_percentage < 30 THEN 'NOT OK'
-            WHEN shc.success_percentage BETWEEN 30 AND 70 THEN 'ACCEPTABLE'
-            WHEN shc.success_percentage > 70 THEN 'OK'
-        END, 'DOWN'
-    ) AS service_health,
-    COALESCE(ROUND(shc.success_percentage, 2) || '%', '0%') AS success_rate
-FROM 
-    date_generator dg
-LEFT JOIN transaction_info ti
-    ON DATE(ti.create_date) = dg.date
-   AND ti.create_date <= NOW() - interval '3 minutes'
-   AND ti.financial_institute = 'ROCKET'
-LEFT JOIN service_health_calc shc ON TRUE
-GROUP BY 
-    dg.date, shc.success_percentage
-ORDER BY 
-    success DESC,
-    reverse DESC,
-    failed DESC,
-    dispute DESC;
-    """,
-
-
-
-
-    "NAGAD OUT": """
-               WITH date_generator AS (
-    SELECT CURRENT_DATE AS date
-),
-service_health_calc AS (
-    SELECT 
-        SUM(CASE WHEN status = 'SUCCESS' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS success_percentage
-    FROM transaction_info
-    WHERE create_date >= NOW() - interval '30 minutes'
-      AND create_date <= NOW() - interval '3 minutes'
-      AND financial_institute = 'NAGAD'
-)
-SELECT
-    dg.date AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN ti.status = 'SUCCESS' THEN ti.create_date END), 'HH24:MI'), '00:00') AS last_success_time,
-    COALESCE(SUM(CASE WHEN ti.status = 'SUCCESS' THEN 1 ELSE 0 END), 0) AS success,
-    COALESCE(SUM(CASE WHEN ti.status = 'REVERSE' THEN 1 ELSE 0 END), 0) AS reverse,
-    COALESCE(SUM(CASE WHEN ti.status = 'FAILED' THEN 1 ELSE 0 END), 0) AS failed,
-    COALESCE(SUM(CASE WHEN ti.status NOT IN ('SUCCESS', 'REVERSE', 'FAILED') THEN 1 ELSE 0 END), 0) AS dispute,
-    COALESCE(TRUNC(SUM(CASE WHEN ti.status = 'SUCCESS' THEN ti.amount ELSE 0 END)), 0) AS today_success_amount,
-    COALESCE(
-        CASE 
-            WHEN shc.success_percentage IS NULL OR shc.success_percentage = 0 THEN 'DOWN'
-            WHEN shc.success_percentage < 30 THEN 'NOT OK'
-            WHEN shc.success_percentage BETWEEN 30 AND 70 THEN 'ACCEPTABLE'
-            WHEN shc.success_percentage > 70 THEN 'OK'
-        END, 'DOWN'
-    ) AS service_health,
-    COALESCE(ROUND(shc.success_percentage, 2) || '%', '0%') AS success_rate
-FROM 
-    date_generator dg
-LEFT JOIN transaction_info ti
-    ON DATE(ti.create_date) = dg.date
-   AND ti.create_date <= NOW() - interval '3 minutes'
-   AND ti.financial_institute = 'NAGAD'
-LEFT JOIN service_health_calc shc ON TRUE
-GROUP BY 
-    dg.date, shc.success_percentage
-ORDER BY 
-    success DESC,
-    reverse DESC,
-    failed DESC,
-    dispute DESC;
-    """,
-
-
-
     "VISA CARD": """
           WITH date_generator AS (
     SELECT CURRENT_DATE AS date
@@ -475,7 +150,8 @@ SELECT
 FROM 
     date_generator dg
 LEFT JOIN card_txn_log ti
-    ON DATE(ti.create_date) = dg.date
+    ON ti.create_date >= dg.date
+   AND ti.create_date < dg.date + interval '1 day'
    AND ti.create_date <= NOW() - interval '3 minutes'
 LEFT JOIN service_health_calc shc ON TRUE
 GROUP BY 
@@ -490,169 +166,6 @@ ORDER BY
 
 
 
-    "SQR PAYMENT": """
-      WITH last_30_min_health AS (
-    SELECT 
-        COUNT(*) FILTER (
-            WHERE 
-                CASE
-                    WHEN response ILIKE '%{%NPSB transfer credit%}%' THEN 'SUCCESS'
-                    WHEN response ~ '.*"message":\\s*"([^"]+)"' THEN substring(response FROM '.*"message":\\s*"([^"]+)"')
-                    WHEN response ~ '.*"error":\\s*"([^"]+)"' THEN substring(response FROM '.*"error":\\s*"([^"]+)"')
-                    ELSE 'FAILED'
-                END = 'SUCCESS'
-        ) AS recent_success_count
-    FROM request_log
-    WHERE create_date >= NOW() - interval '30 minutes' 
-      AND create_date <= NOW() - interval '3 minutes'
-)
-
-SELECT
-    DATE(create_date) AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN status = 'SUCCESS' THEN create_date END), 'HH24:MI'), '00:00') AS last_success_time,
-    COUNT(CASE WHEN status = 'SUCCESS' THEN 1 END) AS success,
-    COUNT(CASE WHEN status = 'REVERSED' THEN 1 END) AS reverse,
-    COUNT(CASE WHEN status NOT IN ('SUCCESS', 'REVERSED') THEN 1 END) AS failed,
-    0 AS dispute,
-    ROUND(SUM(CASE WHEN status = 'SUCCESS' THEN amount ELSE 0 END)) AS success_amount,
-    CASE 
-        WHEN recent_success_count < 5 THEN 'NOT OK'
-        WHEN recent_success_count BETWEEN 5 AND 20 THEN 'ACCEPTABLE'
-        ELSE 'OK'
-    END AS health,
-    TO_CHAR(
-        ROUND(
-            (
-                COUNT(CASE WHEN status = 'SUCCESS' THEN 1 END)::NUMERIC * 100.0
-            ) / NULLIF(COUNT(*), 0), 2
-        ), 'FM999999999.00'
-    ) || '%' AS success_rate
-FROM (
-    SELECT
-        rl.create_date,
-        CASE
-            WHEN response ILIKE '%{%NPSB transfer credit%}%' THEN 'SUCCESS'
-            WHEN response ~ '.*"message":\\s*"([^"]+)"' THEN substring(response FROM '.*"message":\\s*"([^"]+)"')
-            WHEN response ~ '.*"error":\\s*"([^"]+)"' THEN substring(response FROM '.*"error":\\s*"([^"]+)"')
-            ELSE 'FAILED'
-        END AS status,
-        CAST(response::jsonb ->> 'amount' AS NUMERIC) AS amount
-    FROM
-        tallypay_issuer.public.request_log rl
-    WHERE
-        rl.create_date::date = CURRENT_DATE
-        AND rl.request_id IS NOT NULL
-        AND rl.request NOT ILIKE '%hex%'
-) subquery,
-last_30_min_health
-GROUP BY 
-    DATE(create_date),
-    recent_success_count
-ORDER BY 
-    DATE(create_date) DESC;
-    """,
-
-
-    "CBL": """
-                WITH date_generator AS (
-    SELECT CURRENT_DATE AS date
-),
-service_health_calc AS (
-    SELECT 
-        SUM(CASE WHEN status = 'SUCCESS' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS success_percentage
-    FROM backend_db.public.bank_txn_request btr2
-    WHERE (btr2.issue_time + interval '6 hours') >= NOW() - interval '30 minutes'
-      AND (btr2.issue_time + interval '6 hours') <= NOW() - interval '3 minutes'
-      AND btr2.txn_request_type = 'CASH_OUT'
-      AND btr2.bank_swift_code = 'CIBLBDDH'
-      AND btr2.channel = 'CBL'
-)
-SELECT
-    dg.date AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN btr.status = 'SUCCESS' THEN btr.issue_time + interval '6 hours' END), 'HH24:MI'), '00:00') AS last_success_time,
-    COALESCE(SUM(CASE WHEN btr.status = 'SUCCESS' THEN 1 ELSE 0 END), 0) AS success,
-    COALESCE(SUM(CASE WHEN btr.status = 'REVERSE' THEN 1 ELSE 0 END), 0) AS reverse,
-    COALESCE(SUM(CASE WHEN btr.status NOT IN ('SUCCESS') THEN 1 ELSE 0 END), 0) AS failed,
-    COALESCE(SUM(CASE WHEN btr.status IN ('DISPUTE', 'PENDING') THEN 1 ELSE 0 END), 0) AS dispute,
-    COALESCE(TRUNC(SUM(CASE WHEN btr.status = 'SUCCESS' THEN btr.amount ELSE 0 END)), 0) AS today_success_amount,
-    COALESCE(
-        CASE 
-            WHEN shc.success_percentage IS NULL OR shc.success_percentage = 0 THEN 'DOWN'
-            WHEN shc.success_percentage < 50 THEN 'NOT OK'
-            WHEN shc.success_percentage BETWEEN 50 AND 70 THEN 'ACCEPTABLE'
-            WHEN shc.success_percentage > 70 THEN 'OK'
-        END, 'DOWN'
-    ) AS service_health,
-    COALESCE(ROUND(shc.success_percentage, 2) || '%', '0%') AS success_rate
-FROM 
-    date_generator dg
-LEFT JOIN backend_db.public.bank_txn_request btr
-    ON DATE(btr.issue_time + interval '6 hours') = dg.date
-   AND (btr.issue_time + interval '6 hours') <= NOW() - interval '3 minutes'
-   AND btr.txn_request_type = 'CASH_OUT'
-   AND btr.bank_swift_code = 'CIBLBDDH'
-   AND btr.channel = 'CBL'
-LEFT JOIN service_health_calc shc ON TRUE
-GROUP BY 
-    dg.date, shc.success_percentage
-ORDER BY 
-    success DESC,
-    reverse DESC,
-    failed DESC,
-    dispute DESC;
-            """,
-
-    "BEFTN": """
-            WITH date_generator AS (
-    SELECT CURRENT_DATE AS date
-),
-service_health_calc AS (
-    SELECT 
-        SUM(CASE WHEN status IN ('SUCCESS', 'REQUESTED', 'PENDING') THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS success_percentage
-    FROM backend_db.public.bank_txn_request btr2
-    WHERE (btr2.issue_time + interval '6 hours') >= NOW() - interval '60 minutes'
-      AND (btr2.issue_time + interval '6 hours') <= NOW() - interval '3 minutes'
-      AND btr2.txn_request_type = 'CASH_OUT'
-      AND btr2.channel = 'BEFTN'
-)
-SELECT
-    dg.date AS date,
-    COALESCE(TO_CHAR(MAX(CASE WHEN btr.status IN ('SUCCESS', 'REQUESTED', 'PENDING') THEN btr.issue_time + interval '6 hours' END), 'HH24:MI'), '00:00') AS last_success_time,
-    COALESCE(SUM(CASE WHEN btr.status IN ('SUCCESS', 'REQUESTED', 'PENDING') THEN 1 ELSE 0 END), 0) AS success,
-    COALESCE(SUM(CASE WHEN btr.status = 'REVERSIBLE' THEN 1 ELSE 0 END), 0) AS reversible,
-    COALESCE(SUM(CASE WHEN btr.status = 'FAILED' THEN 1 ELSE 0 END), 0) AS failed,
-    COALESCE(SUM(CASE WHEN btr.status NOT IN ('SUCCESS', 'REVERSIBLE', 'FAILED', 'REQUESTED', 'PENDING') THEN 1 ELSE 0 END), 0) AS pending,
-    COALESCE(TRUNC(SUM(CASE WHEN btr.status IN ('SUCCESS', 'REQUESTED', 'PENDING') THEN btr.amount ELSE 0 END)), 0) AS today_success_amount,
-    COALESCE(
-        CASE 
-            WHEN shc.success_percentage IS NULL OR shc.success_percentage = 0 THEN 'DOWN'
-            WHEN shc.success_percentage < 30 THEN 'NOT OK'
-            WHEN shc.success_percentage BETWEEN 30 AND 70 THEN 'ACCEPTABLE'
-            WHEN shc.success_percentage > 70 THEN 'OK'
-        END, 'DOWN'
-    ) AS service_health,
-    COALESCE(ROUND(shc.success_percentage, 2) || '%', '0%') AS success_rate
-FROM 
-    date_generator dg
-LEFT JOIN backend_db.public.bank_txn_request btr
-    ON DATE(btr.issue_time + interval '6 hours') = dg.date
-   AND btr.txn_request_type = 'CASH_OUT'
-   AND btr.channel = 'BEFTN'
-LEFT JOIN service_health_calc shc ON TRUE
-WHERE
-    (btr.issue_time + interval '6 hours') <= NOW()
-GROUP BY 
-    dg.date, shc.success_percentage
-ORDER BY 
-    success DESC,
-    reversible DESC,
-    failed DESC,
-    pending DESC;
-            """,
-
-
-
-
     "NPSB INSTANT": """
        WITH date_generator AS (
     SELECT CURRENT_DATE AS date
@@ -685,7 +198,8 @@ SELECT
 FROM 
     date_generator dg
 LEFT JOIN tp_bank_service.public.bank_transaction_info bti
-    ON DATE(bti.create_date) = dg.date
+    ON bti.create_date >= dg.date
+   AND bti.create_date < dg.date + interval '1 day'
    AND bti.create_date <= NOW() - interval '3 minutes'
    AND bti.channel IN ('NPSB', 'MTB')
 LEFT JOIN service_health_calc shc ON TRUE
@@ -698,24 +212,163 @@ ORDER BY
     dispute DESC;
          """
 }
+
+# Services that share a source table are computed by one grouped scan. Each
+# group's txn query tags every row with its service_key and flags how it
+# counts; the template aggregates those flags per service and emits a row for
+# every service, even when it has no transactions yet.
+GROUPED_HEALTH_QUERY = """
+WITH services (service_key, not_ok_below) AS (
+    VALUES {services}
+),
+txn AS (
+{txn}
+),
+totals AS (
+    SELECT
+        service_key,
+        MAX(CASE WHEN is_today AND is_success THEN txn_time END) AS last_success,
+        SUM(CASE WHEN is_today AND is_success THEN 1 ELSE 0 END) AS success,
+        SUM(CASE WHEN is_today AND is_reverse THEN 1 ELSE 0 END) AS reverse,
+        SUM(CASE WHEN is_today AND is_failed THEN 1 ELSE 0 END) AS failed,
+        SUM(CASE WHEN is_today AND is_dispute THEN 1 ELSE 0 END) AS dispute,
+        TRUNC(SUM(CASE WHEN is_today AND is_success THEN amount ELSE 0 END)) AS today_success_amount,
+        SUM(CASE WHEN in_window AND is_counted AND is_success THEN 1 ELSE 0 END) * 100.0 /
+            NULLIF(SUM(CASE WHEN in_window AND is_counted THEN 1 ELSE 0 END), 0) AS success_percentage
+    FROM txn
+    GROUP BY service_key
+)
+SELECT
+    s.service_key,
+    CURRENT_DATE AS date,
+    COALESCE(TO_CHAR(t.last_success, 'HH24:MI'), '00:00') AS last_success_time,
+    COALESCE(t.success, 0) AS success,
+    COALESCE(t.reverse, 0) AS reverse,
+    COALESCE(t.failed, 0) AS failed,
+    COALESCE(t.dispute, 0) AS dispute,
+    COALESCE(t.today_success_amount, 0) AS today_success_amount,
+    COALESCE(
+        CASE
+            WHEN t.success_percentage IS NULL OR t.success_percentage = 0 THEN 'DOWN'
+            WHEN t.success_percentage < s.not_ok_below THEN 'NOT OK'
+            WHEN t.success_percentage BETWEEN s.not_ok_below AND 70 THEN 'ACCEPTABLE'
+            WHEN t.success_percentage > 70 THEN 'OK'
+        END, 'DOWN'
+    ) AS service_health,
+    COALESCE(ROUND(t.success_percentage, 2) || '%', '0%') AS success_rate
+FROM services s
+LEFT JOIN totals t ON t.service_key = s.service_key;
+"""
+
+# Grouped queries: service key -> (service name, health NOT OK threshold)
+grouped_queries = {
+    "RECHARGE": {
+        "dbname": "topup_service",
+        "services": {
+            "GP": ("RECHARGE (GP)", 30),
+            "BL": ("RECHARGE (BL)", 30),
+            "ROBI": ("RECHARGE (ROBI)", 30),
+            "AIRTEL": ("RECHARGE (AIRTEL)", 30),
+            "TT": ("RECHARGE (TT)", 30)
+        },
+        "txn": """
+    SELECT
+        mobile_operator::text AS service_key,
+        create_date AS txn_time,
+        amount,
+        status = 'SUCCESS' AS is_success,
+        status = 'REVERSED' AS is_reverse,
+        status = 'FAILED' AS is_failed,
+        status NOT IN ('SUCCESS', 'REVERSED', 'FAILED') AS is_dispute,
+        create_date >= CURRENT_DATE AS is_today,
+        create_date >= NOW() - interval '30 minutes' AS in_window,
+        TRUE AS is_counted
+    FROM top_up_info
+    WHERE mobile_operator IN ({keys})
+      AND create_date >= LEAST(CURRENT_DATE, NOW() - interval '30 minutes')
+      AND create_date <= NOW() - interval '3 minutes'
+"""
+    },
+
+    "FI OUT": {
+        "dbname": "tallypay_to_fi_integration",
+        "services": {
+            "ROCKET": ("ROCKET OUT", 30),
+            "NAGAD": ("NAGAD OUT", 30)
+        },
+        # ROCKET OUT leaves transfers below 10 out of its failures and health
+        "txn": """
+    SELECT
+        financial_institute::text AS service_key,
+        create_date AS txn_time,
+        amount,
+        status = 'SUCCESS' AS is_success,
+        status = 'REVERSE' AS is_reverse,
+        status = 'FAILED' AND (financial_institute <> 'ROCKET' OR amount >= 10) AS is_failed,
+        status NOT IN ('SUCCESS', 'REVERSE', 'FAILED') AS is_dispute,
+        create_date >= CURRENT_DATE AS is_today,
+        create_date >= NOW() - interval '30 minutes' AS in_window,
+        financial_institute <> 'ROCKET' OR amount >= 10 AS is_counted
+    FROM transaction_info
+    WHERE financial_institute IN ({keys})
+      AND create_date >= LEAST(CURRENT_DATE, NOW() - interval '30 minutes')
+      AND create_date <= NOW() - interval '3 minutes'
+"""
+    },
+
+    "BANK OUT": {
+        "dbname": "backend_db",
+        "services": {
+            "CBL": ("CBL", 50),
+            "BEFTN": ("BEFTN", 30)
+        },
+        # issue_time is stored 6 hours behind local time. BEFTN counts
+        # requested and pending transfers as successful, looks at the last
+        # hour for its health and includes the last 3 minutes in its totals.
+        "txn": """
+    SELECT
+        channel::text AS service_key,
+        issue_time + interval '6 hours' AS txn_time,
+        amount,
+        CASE WHEN channel = 'CBL' THEN status = 'SUCCESS'
+             ELSE status IN ('SUCCESS', 'REQUESTED', 'PENDING') END AS is_success,
+        CASE WHEN channel = 'CBL' THEN status = 'REVERSE'
+             ELSE status = 'REVERSIBLE' END AS is_reverse,
+        CASE WHEN channel = 'CBL' THEN status <> 'SUCCESS'
+             ELSE status = 'FAILED' END AS is_failed,
+        CASE WHEN channel = 'CBL' THEN status IN ('DISPUTE', 'PENDING')
+             ELSE status NOT IN ('SUCCESS', 'REVERSIBLE', 'FAILED', 'REQUESTED', 'PENDING') END AS is_dispute,
+        issue_time + interval '6 hours' >= CURRENT_DATE
+            AND issue_time + interval '6 hours' <= NOW() - CASE WHEN channel = 'CBL' THEN interval '3 minutes' ELSE interval '0 minutes' END AS is_today,
+        issue_time + interval '6 hours' >= NOW() - CASE WHEN channel = 'CBL' THEN interval '30 minutes' ELSE interval '60 minutes' END
+            AND issue_time + interval '6 hours' <= NOW() - interval '3 minutes' AS in_window,
+        TRUE AS is_counted
+    FROM backend_db.public.bank_txn_request
+    WHERE txn_request_type = 'CASH_OUT'
+      AND (channel = 'BEFTN' OR (channel = 'CBL' AND bank_swift_code = 'CIBLBDDH'))
+      AND issue_time >= LEAST(CURRENT_DATE, NOW() - interval '60 minutes') - interval '6 hours'
+      AND issue_time <= NOW() - interval '6 hours'
+"""
+    }
+}
+
+# Function to build the SQL of a grouped query from its services and txn rows
+def build_grouped_query(group):
+    keys = ", ".join(f"'{key}'" for key in group["services"])
+    services = ", ".join(f"('{key}', {threshold})" for key, (_, threshold) in group["services"].items())
+    return GROUPED_HEALTH_QUERY.format(services=services, txn=group["txn"].format(keys=keys))
+
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname)
     except Exception as e:
         print(f"Error fetching data for {dbname}: {e}")
         return None
 
+# SUCCESS_AMOUNT is shown as a whole number with thousands separators; its
+# index counts the columns after the service key of grouped queries
+SUCCESS_AMOUNT_COLUMN = 6
+
 # Function to handle each query and update the corresponding Google Sheet
 # Updates row by row instead of replacing the entire sheet
 def process_query(service_name, query, db_params, dbname):
@@ -723,21 +376,45 @@ def process_query(service_name, query, db_params, dbname):
     processed_data = []
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else
-                f"{int(x):,}" if isinstance(x, Decimal) and row.index(x) == 6 else  # Format SUCCESS_AMOUNT with commas
-                float(x) if isinstance(x, Decimal) else
-                x
-                for x in row
-            ]
-            # Append the service name at the start of each row
-            processed_data.append([service_name] + converted_row)
+        with tracing.span("transform", rows=len(result)):
+            formats = {SUCCESS_AMOUNT_COLUMN: row_convert.to_thousands}
+            for row in row_convert.convert_rows(result, result.description, formats):
+                # Append the service name at the start of each row
+                processed_data.append([service_name] + row)
     else:
         print(f"No data returned for {service_name}.")
 
     return processed_data
 
+# Function to run a grouped query and split it into one row per service,
+# in the order the group lists its services
+def process_grouped_query(group_name, group, db_params):
+    result = fetch_data(build_grouped_query(group), db_params, group["dbname"])
+    if not result:
+        print(f"No data returned for {group_name}.")
+        return []
+
+    with tracing.span("transform", rows=len(result)):
+        formats = {SUCCESS_AMOUNT_COLUMN + 1: row_convert.to_thousands}
+        rows = row_convert.convert_rows(result, result.description, formats)
+        rows_by_key = {row[0]: row[1:] for row in rows}
+        processed_data = []
+        for key, (service_name, _) in group["services"].items():
+            if key in rows_by_key:
+                processed_data.append([service_name] + rows_by_key[key])
+    return processed_data
+
+
+# Function to build the SQR PAYMENT row from the locally extracted
+# request_log aggregates, which replace a regex scan of the day's requests
+def process_sqr_payment():
+    request_log_extract.refresh("sqr")
+    row = request_log_extract.sqr_health()
+    if row is None:
+        print("No data returned for SQR PAYMENT.")
+        return []
+    return [["SQR PAYMENT"] + list(row)]
+
 
 # Main function to process all services and update the sheet
 def service_health():
@@ -748,19 +425,9 @@ def service_health():
     }
 
     db_mapping = {
-        "RECHARGE (GP)": "topup_service",
-        "RECHARGE (BL)": "topup_service",
-        "RECHARGE (ROBI)": "topup_service",
-        "RECHARGE (AIRTEL)": "topup_service",
-        "RECHARGE (TT)": "topup_service",
         "NAGAD IN": "nobopay_payment_gw",
         "ROCKET IN": "nobopay_payment_gw",
-        "ROCKET OUT": "tallypay_to_fi_integration",
-        "NAGAD OUT": "tallypay_to_fi_integration",
         "VISA CARD": "tp_bank_service",
-        "SQR PAYMENT": "tallypay_issuer",
-        "CBL": "backend_db",
-        "BEFTN": "backend_db",
         "NPSB INSTANT": "tp_bank_service"
     }
 
@@ -773,7 +440,10 @@ def service_health():
         # Submit all queries for parallel processing
         for service_name, query in queries.items():
             dbname = db_mapping.get(service_name)
-            futures[executor.submit(process_query, service_name, query, db_params, dbname)] = service_name
+            futures[executor.submit(tracing.bind(process_query, query_key=service_name), service_name, query, db_params, dbname)] = service_name
+        for group_name, group in grouped_queries.items():
+            futures[executor.submit(tracing.bind(process_grouped_query, query_key=group_name), group_name, group, db_params)] = group_name
+        futures[executor.submit(tracing.bind(process_sqr_payment, query_key="SQR PAYMENT"))] = "SQR PAYMENT"
 
         # Collect results from all queries
         for future in as_completed(futures):
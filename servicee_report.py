@@ -3,13 +3,14 @@ from typing import List
 import os
 from dotenv import load_dotenv
 import psycopg2
+import pg_pool
 import pandas as pd
 from pretty_html_table import build_table
-import smtplib, ssl
+import mail_dispatcher
+import chart_render
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
-import matplotlib.pyplot as plt
 import seaborn as sns
 
 load_dotenv()
@@ -44,8 +45,8 @@ def gen_q(dates: List[str], query) -> str:
                             tallypay_to_fi_integration.public.transaction_info ti
                         where
                             1 = 1
-                            and ti.create_date::date >= '{dates[0]}'
-                            and ti.create_date::date < '{dates[1]}'
+                            and ti.create_date >= '{dates[0]}'
+                            and ti.create_date < '{dates[1]}'
                             and ti.status in ('REVERSE', 'SUCCESS', 'FAILED')
                         group by
                             1
@@ -74,8 +75,8 @@ def gen_q(dates: List[str], query) -> str:
                             btr.np_txn_log_id = ntl.id
                         where
                             1 = 1
-                            and (btr.issue_time + interval '6 hours')::date >= '{dates[0]}'
-                            and (btr.issue_time + interval '6 hours')::date < '{dates[1]}'
+                            and btr.issue_time >= '{dates[0]}'::date - interval '6 hours'
+                            and btr.issue_time < '{dates[1]}'::date - interval '6 hours'
                             and btr.txn_request_type = 'CASH_OUT'
                             and btr.status in ('SUCCESS','SUCCESS','FAILED')
                         group by
@@ -97,8 +98,8 @@ def gen_q(dates: List[str], query) -> str:
                         topup_service.public.top_up_info tui
                     where
                         1 = 1
-                        and tui.create_date::date >= '{dates[0]}'
-                        and tui.create_date::date < '{dates[1]}'
+                        and tui.create_date >= '{dates[0]}'
+                        and tui.create_date < '{dates[1]}'
                     ;'''
 
     money_in_NGD = f'''select
@@ -116,8 +117,8 @@ def gen_q(dates: List[str], query) -> str:
                             nobopay_payment_gw.public.nagad_txn nt
                         where
                             1 = 1
-                            and nt.create_date::date >= '{dates[0]}'
-                            and nt.create_date::date < '{dates[1]}'
+                            and nt.create_date >= '{dates[0]}'
+                            and nt.create_date < '{dates[1]}'
                             and nt.status in ('FAILED', 'SUCCESS')
                         ;'''
 
@@ -136,8 +137,8 @@ def gen_q(dates: List[str], query) -> str:
                             nobopay_payment_gw.public.dbbl_transaction dt
                         where
                             1 = 1
-                            and dt.create_date::date >= '{dates[0]}'
-                            and dt.create_date::date < '{dates[1]}'
+                            and dt.create_date >= '{dates[0]}'
+                            and dt.create_date < '{dates[1]}'
                             and dt.status in ('FAILED', 'SUCCESS')
                         ;'''
 
@@ -156,8 +157,8 @@ def gen_q(dates: List[str], query) -> str:
                             nobopay_payment_gw.public.payment_info pi2
                         where
                             1 = 1
-                            and pi2.create_date::date >= '{dates[0]}'
-                            and pi2.create_date::date < '{dates[1]}'
+                            and pi2.create_date >= '{dates[0]}'
+                            and pi2.create_date < '{dates[1]}'
                             and pi2.status in ('FAILED', 'SUCCESS')
                         ;'''
 
@@ -182,8 +183,8 @@ def gen_q(dates: List[str], query) -> str:
                 from
                     tallypay_issuer.public.request_log rl
                 where
-                    rl.create_date::date >= '{dates[0]}'
-                    and rl.create_date::date < '{dates[1]}'
+                    rl.create_date >= '{dates[0]}'
+                    and rl.create_date < '{dates[1]}'
                     and request_id is not null
                     and request not ilike '%hex%'
                 group by
@@ -204,37 +205,13 @@ def gen_q(dates: List[str], query) -> str:
 
 
 def select_db(db: str, query: str):
-    conn = None
-    cur = None
-
     try:
-        # establishing the connection
-        conn = psycopg2.connect(
-            # ---Please change the credentials---
-            database=db,
-            user=os.environ.get("TP_PG_USR"),
-            password=os.environ.get("TP_PG_PWD"),
-            host=os.environ.get("TP_HOST"),
-            port='5432'
-        )
-
-        #print('Connection established')
-        cur = conn.cursor()
-        #print('Executing query')
-        cur.execute(query)
-        #print('Retreiving queryset')
-        queryset = cur.fetchall()
+        queryset = pg_pool.fetch_all(query, pg_pool.env_db_params(), db)
     except psycopg2.Error as error:
         queryset = f"Error connecting to Postgres database: {error}"
     except Exception as query_error:
         queryset = f"Error executing query: {query_error}"
-    finally:
-        if cur is not None:
-            cur.close()
-        if conn is not None:
-            conn.close()
 
-    # #print(queryset)
     return queryset
 
 
@@ -282,14 +259,14 @@ def mak_bold(serv_name: str, html_table) -> str:
     return html_table
 
 
-def gen_chart(dates: List[str], df):
-    chart_df = df.copy()
+# Function to draw the attempts and satisfaction of each service on figure
+def draw_chart(figure, records):
+    chart_df = pd.DataFrame.from_records(records)
     chart_df.set_index('Service', inplace=True)
 
-    plt.figure(figsize=(10, 6))
-
-    ax1 = sns.barplot(data=chart_df, x=chart_df.index, y='Satisfaction Level', color='green',
-                      label='Satisfaction Level')
+    ax1 = figure.subplots()
+    sns.barplot(data=chart_df, x=chart_df.index, y='Satisfaction Level', color='green',
+                label='Satisfaction Level', ax=ax1)
     ax1.set_xlabel('Service')
     ax1.set_ylabel('Satisfaction Percentage')
 
@@ -311,16 +288,16 @@ def gen_chart(dates: List[str], df):
     labels = labels1 + labels2
     ax1.legend(handles, labels, loc='upper left', bbox_to_anchor=(1.05, 1), borderaxespad=0.)
 
-    plt.tight_layout()
+    figure.tight_layout()
 
-    chart_img_path = f'chart_{dates[2]}.png'
-    plt.savefig(chart_img_path)
-    plt.close()
 
-    return chart_img_path
+def gen_chart(dates: List[str], df):
+    '''Return the PNG bytes of the service chart, rendered in memory (see chart_render)'''
+    records = df[['Service', 'Satisfaction Level', 'Total Attempt']].to_dict('records')
+    return chart_render.render('service_summary', records, draw_chart, figsize=(10, 6))
 
 
-def send_mail(dates: List[str], html_table_code, chart_img_path=None, csv_string=None):
+def send_mail(dates: List[str], html_table_code, chart_png=None, csv_string=None):
     sender_email = os.environ.get('MAIL_SENDER_ADD')
     sender_pass = os.environ.get('MAIL_SENDER_PASS')
 
@@ -330,8 +307,6 @@ def send_mail(dates: List[str], html_table_code, chart_img_path=None, csv_string
     # receiver_email = 'irfan.ahmed@tallykhata.com'
     # cc_email = ['overlodahmed.irfan@gmail.com']
 
-    smtp_server = "smtp.gmail.com"  # for Gmail
-    port = 587
     text1 = f'''Dear Team,\nPlease find the service summary from <strong>{dates[0]}</strong> to <strong>{dates[1]}</strong>'''
     text2 = f'''\n\nBest regards,\nIrfan Ahmed\nEngineer, Product Engineering\nGenerated on: {dates[2]}'''
     text3 = html_table_code
@@ -342,9 +317,8 @@ def send_mail(dates: List[str], html_table_code, chart_img_path=None, csv_string
     msg['To'] = receiver_email
     msg['Cc'] = ', '.join(cc_email)
 
-    if chart_img_path:
-        with open(chart_img_path, 'rb') as fp:
-            img_data = fp.read()
+    if chart_png:
+        img_data = chart_png
         img_cid = f'chart_{dates[2]}.png'
         part = MIMEApplication(img_data, Name=img_cid)
         part['Content-Disposition'] = f'inline; filename="{img_cid}"'
@@ -365,26 +339,9 @@ def send_mail(dates: List[str], html_table_code, chart_img_path=None, csv_string
     msg.attach(MIMEText(text3, 'html'))
     msg.attach(MIMEText(text2, 'plain'))
 
-    context = ssl.create_default_context()
-    # Try to log in to server and send email
-    try:
-        server = smtplib.SMTP(smtp_server, port)
-        server.ehlo()  # check connection
-        server.starttls(context=context)  # Secure the connection
-        server.ehlo()  # check connection
-        server.login(sender_email, sender_pass)
-
-        # Send email here
-        server.sendmail(sender_email, [receiver_email] + cc_email, msg.as_string())
-        #print('Sent email Successfully')
-        return ('Success')
-
-    except Exception as e:
-        # #print any error messages
-        #print("Error is: " + str(e))
-        return "Error is: " + str(e)
-    finally:
-        server.quit()
+    mail_dispatcher.send(msg, sender_email, [receiver_email] + cc_email,
+                         mail_dispatcher.account(sender_email, sender_pass))
+    return 'Queued'
 
 
 def main():
@@ -459,11 +416,9 @@ def main():
     sum_df_html_table = '<h2>Service Summary</h2>' + sum_df_html_table + '<br>'
 
     fin_html_table = sum_df_html_table + measure_df_html_table + serv_df_html_table
-    img_path = gen_chart(dates, serv_df)
-
-    send_mail(dates, fin_html_table, img_path)
+    chart_png = gen_chart(dates, serv_df)
 
-    os.remove(img_path)
+    send_mail(dates, fin_html_table, chart_png)
 
 
 main()
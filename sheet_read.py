@@ -1,38 +1,18 @@
 from __future__ import print_function
-import os.path
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-
-def gen_cred():
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
-    return creds
+from isheet_controller import get_service, execute_request, flush_writes
+import tracing
 
 def read_sheet_data(spreadsheet_id, range_name):
     """Reads data from a specified range in a Google Sheets document."""
-    creds = gen_cred()  # Ensure credentials are set
     try:
-        service = build('sheets', 'v4', credentials=creds)
-        sheet = service.spreadsheets()
+        # Make sure buffered writes to this spreadsheet are visible first
+        flush_writes(spreadsheet_id)
+        sheet = get_service().spreadsheets()
 
         # Get the values from the specified range
-        result = sheet.values().get(spreadsheetId=spreadsheet_id, range=range_name).execute()
+        with tracing.span("sheet-read", range=range_name):
+            result = execute_request(sheet.values().get(spreadsheetId=spreadsheet_id, range=range_name))
         values = result.get('values', [])
 
         if not values:
@@ -1,14 +1,18 @@
 import mysql.connector
 from pretty_html_table import build_table
 import pandas as pd
-import smtplib, ssl
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from datetime import datetime, timedelta
 import os
+import sys
 from dotenv import load_dotenv
 
+# The mail dispatcher is shared with the dashboard one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mail_dispatcher
+
 
 load_dotenv()
 DEBUG = False
@@ -126,8 +130,6 @@ def send_mail(timeframe, html_table_code):
         receiver_email = 'amin@tallykhata.com'
         cc_email = ['mahidul@tallykhata.com', 'amyou@tallykhata.com', 'product_eng@tallykhata.com ', 'tech_ops@surecash.net', 'finance@tallykhata.com']
 
-    smtp_server = "smtp.gmail.com"  # for Gmail
-    port = 587
     last_month = find_last_month_name()
     text1 = f'''To Whom It May Concern, \nKindly get the SMS count and bill for BANGLALINK of {last_month}, {datetime.now().year}. According to our database. Please keep in mind that we are using an assumed cost per message of 0.28 tk. The starting timeframe is {timeframe[0]} and ends at excluding {timeframe[1]}
     '''
@@ -146,26 +148,10 @@ def send_mail(timeframe, html_table_code):
     msg.attach(MIMEText(text4, 'plain'))
     msg.attach(MIMEText(text2, 'plain'))
 
-    context = ssl.create_default_context()
-    # Try to log in to server and send email
-    try:
-        server = smtplib.SMTP(smtp_server, port)
-        server.ehlo()  # check connection
-        server.starttls(context=context)  # Secure the connection
-        server.ehlo()  # check connection
-        server.login(sender_email, sender_pass)
-
-        # Send email here
-        server.sendmail(sender_email, [receiver_email] + cc_email, msg.as_string())
-        print('Sent email Successfully')
-        return ('Success')
-
-    except Exception as e:
-        # Print any error messages
-        print("Error is: " + str(e))
-        return "Error is: " + str(e)
-    finally:
-        server.quit()
+    mail_dispatcher.send(msg, sender_email, [receiver_email] + cc_email,
+                         mail_dispatcher.account(sender_email, sender_pass))
+    print('Email queued')
+    return 'Queued'
 
 
 def main():
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from dotenv import load_dotenv
+
+import local_store
+import tracing
+
+load_dotenv()
+
+# Every grid published to a tab is kept as a compressed snapshot, so a tab can
+# be looked at as it was earlier without querying the databases again. A
+# snapshot is only stored when the tab's content changed; it stays current
+# until the next one. Snapshots older than SNAPSHOT_HOURLY_AFTER hours are
+# thinned to the last one of each hour, and dropped after
+# SNAPSHOT_RETENTION_DAYS days.
+SNAPSHOTS_ENABLED = os.getenv("DASHBOARD_SNAPSHOTS", "1") == "1"
+SNAPSHOT_STORE = "snapshot_store.sqlite3"
+SNAPSHOT_RETENTION_DAYS = float(os.getenv("SNAPSHOT_RETENTION_DAYS", 30))
+SNAPSHOT_HOURLY_AFTER = float(os.getenv("SNAPSHOT_HOURLY_AFTER", 24))
+# Compaction runs at most this often, from whichever job stores a snapshot
+SNAPSHOT_COMPACT_INTERVAL = float(os.getenv("SNAPSHOT_COMPACT_INTERVAL", 3600))
+
+# auto_vacuum only takes effect on a new store; it lets compact() hand the
+# space of removed snapshots back to the file system
+SNAPSHOT_SCHEMA = """
+PRAGMA auto_vacuum = INCREMENTAL;
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    spreadsheet_id TEXT NOT NULL,
+    tab TEXT NOT NULL,
+    taken_at REAL NOT NULL,
+    row_count INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    rows BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_tab_time ON snapshots (tab, taken_at);
+"""
+
+_last_compacted = 0.0
+_compact_lock = threading.Lock()
+
+
+class SnapshotWriter:
+    """
+    Builds one tab's snapshot row by row, compressing as it goes, so streamed
+    writes can be recorded without holding the grid in memory. Rows are
+    stored as JSON lines; values JSON cannot hold are stored as text.
+    """
+
+    def __init__(self, spreadsheet_id, tab):
+        self.spreadsheet_id = spreadsheet_id
+        self.tab = tab
+        self.row_count = 0
+        self._compressor = zlib.compressobj(6)
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._chunks = []
+
+    def add(self, row):
+        if not SNAPSHOTS_ENABLED:
+            return
+        line = json.dumps(list(row), default=str, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._hash.update(line)
+        self._chunks.append(self._compressor.compress(line))
+        self.row_count += 1
+
+    def close(self):
+        """Stores the snapshot unless the tab already holds the same content."""
+        if not SNAPSHOTS_ENABLED:
+            return None
+        self._chunks.append(self._compressor.flush())
+        blob = b"".join(self._chunks)
+        content_hash = self._hash.hexdigest()
+        try:
+            with tracing.span("snapshot", tab=self.tab, rows=self.row_count):
+                with local_store.connect(SNAPSHOT_STORE, SNAPSHOT_SCHEMA) as conn:
+                    latest = conn.execute(
+                        "SELECT content_hash FROM snapshots WHERE spreadsheet_id = ? AND tab = ? "
+                        "ORDER BY taken_at DESC LIMIT 1",
+                        (self.spreadsheet_id, self.tab)
+                    ).fetchone()
+                    if latest is not None and latest[0] == content_hash:
+                        return None
+                    snapshot_id = conn.execute(
+                        "INSERT INTO snapshots (spreadsheet_id, tab, taken_at, row_count, content_hash, rows) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (self.spreadsheet_id, self.tab, time.time(), self.row_count, content_hash, blob)
+                    ).lastrowid
+        except sqlite3.Error as e:
+            print(f"Error storing snapshot of {self.tab}: {e}")
+            return None
+        maybe_compact()
+        return snapshot_id
+
+
+# Function to record the grid just published to a tab
+def record(spreadsheet_id, tab, rows):
+    writer = SnapshotWriter(spreadsheet_id, tab)
+    for row in rows:
+        writer.add(row)
+    return writer.close()
+
+
+# Function to unpack a stored snapshot into its rows
+def decode_rows(blob):
+    text = zlib.decompress(blob).decode("utf-8")
+    return [json.loads(line) for line in text.splitlines()]
+
+
+# Function to return (taken_at, rows) of a tab as it was at `when` (a unix
+# timestamp, default now), or None if no snapshot was taken by then
+def tab_at(tab, when=None, spreadsheet_id=None):
+    when = time.time() if when is None else when
+    query = "SELECT taken_at, rows FROM snapshots WHERE tab = ? AND taken_at <= ?"
+    params = [tab, when]
+    if spreadsheet_id is not None:
+        query += " AND spreadsheet_id = ?"
+        params.append(spreadsheet_id)
+    with local_store.connect(SNAPSHOT_STORE, SNAPSHOT_SCHEMA) as conn:
+        row = conn.execute(query + " ORDER BY taken_at DESC LIMIT 1", params).fetchone()
+    if row is None:
+        return None
+    return row[0], decode_rows(row[1])
+
+
+# Function to yield (taken_at, rows) for every snapshot of a tab taken in
+# [since, until), oldest first, decoding one snapshot at a time
+def history(tab, since, until=None, spreadsheet_id=None):
+    query = "SELECT id, taken_at FROM snapshots WHERE tab = ? AND taken_at >= ?"
+    params = [tab, since]
+    if until is not None:
+        query += " AND taken_at < ?"
+        params.append(until)
+    if spreadsheet_id is not None:
+        query += " AND spreadsheet_id = ?"
+        params.append(spreadsheet_id)
+    with local_store.connect(SNAPSHOT_STORE, SNAPSHOT_SCHEMA) as conn:
+        snapshots = conn.execute(query + " ORDER BY taken_at", params).fetchall()
+    for snapshot_id, taken_at in snapshots:
+        with local_store.connect(SNAPSHOT_STORE, SNAPSHOT_SCHEMA) as conn:
+            row = conn.execute("SELECT rows FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+        if row is not None:
+            yield taken_at, decode_rows(row[0])
+
+
+# Function to apply the retention policy: drop old snapshots and keep only
+# the last snapshot per tab and hour once they are older than
+# SNAPSHOT_HOURLY_AFTER hours. Returns the number of snapshots removed
+def compact(now=None):
+    now = time.time() if now is None else now
+    with local_store.connect(SNAPSHOT_STORE, SNAPSHOT_SCHEMA) as conn:
+        removed = conn.execute(
+            "DELETE FROM snapshots WHERE taken_at < ?",
+            (now - SNAPSHOT_RETENTION_DAYS * 86400,)
+        ).rowcount
+        removed += conn.execute(
+            """
+            DELETE FROM snapshots
+            WHERE taken_at < :hourly_before
+              AND id NOT IN (
+                  SELECT id FROM (
+                      SELECT id, ROW_NUMBER() OVER (
+                          PARTITION BY spreadsheet_id, tab, CAST(taken_at / 3600 AS INTEGER)
+                          ORDER BY taken_at DESC
+                      ) AS position
+                      FROM snapshots
+                      WHERE taken_at < :hourly_before
+                  ) WHERE position = 1
+              )
+            """,
+            {"hourly_before": now - SNAPSHOT_HOURLY_AFTER * 3600}
+        ).rowcount
+        if removed:
+            # executescript commits the deletes first and runs the pragma to
+            # the end; execute() would free a single page
+            conn.executescript("PRAGMA incremental_vacuum;")
+    return removed
+
+
+# Function to run compact() when the last run is older than SNAPSHOT_COMPACT_INTERVAL
+def maybe_compact():
+    global _last_compacted
+    with _compact_lock:
+        if time.time() - _last_compacted < SNAPSHOT_COMPACT_INTERVAL:
+            return
+        _last_compacted = time.time()
+    try:
+        removed = compact()
+        if removed:
+            print(f"Compacted snapshot history: {removed} snapshots removed.")
+    except sqlite3.Error as e:
+        print(f"Error compacting snapshot history: {e}")
+
+
+# Function to list the stored tabs with their snapshot counts and time span
+def summary():
+    with local_store.connect(SNAPSHOT_STORE, SNAPSHOT_SCHEMA) as conn:
+        return conn.execute(
+            "SELECT tab, COUNT(*), MIN(taken_at), MAX(taken_at), SUM(LENGTH(rows)) "
+            "FROM snapshots GROUP BY tab ORDER BY tab"
+        ).fetchall()
+
+
+if __name__ == "__main__":
+    for tab, count, first, last, size in summary():
+        print(f"{tab:<40} {count:>6} snapshots  "
+              f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(first))} .. "
+              f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(last))}  {size / 1024:>8.1f} KiB")
@@ -1,36 +1,16 @@
-import os
+import itertools
 from dotenv import load_dotenv
 import psycopg2
-from isheet_controller import sheet_update
+import pg_pool
+import bucket_cache
+import tracing
+import request_log_extract
+from isheet_controller import sheet_update, sheet_update_stream
 from threading import Thread
 
 load_dotenv()
 
 def gen_q(q):
-    hr_log = '''SELECT
-                    to_char(create_date, 'HH24') AS "Hour",
-                    CASE
-                        when response ilike '%{%NPSB transfer credit%}%' then 'SUCCESS'
-                        WHEN response ~ '.*"message":\s*"([^"]+)"' THEN substring(response from '.*"message":\s*"([^"]+)"')
-                        WHEN response ~ '.*"error":\s*"([^"]+)"' THEN substring(response from '.*"error":\s*"([^"]+)"')
-                        ELSE response
-                    END AS status,
-                    count(request_id)
-                FROM
-                    tallypay_issuer.public.request_log rl
-                WHERE
-                    create_date::date = 'now()'
-                    AND create_date <= current_timestamp - interval '5 minutes'
-                    AND request_id IS NOT NULL
-                    and request not ilike '%hex%'
-                GROUP BY
-                    1,
-                    2
-                ORDER BY
-                    1 ASC,
-                    3 desc
-                ;'''
-
     hr_cohort = '''select
                         to_char(nti.create_date,
                         'HH24'),
@@ -45,66 +25,13 @@ def gen_q(q):
                         nti.acquirer_id = nfc.acquirer_id 
                     where
                         1 = 1
-                        and nti.create_date::date = 'now()'
-                        and nti.create_date <= now() - interval '5 minutes'
+                        and nti.create_date >= %(start)s AND nti.create_date < %(end)s
                     group by
                         1,
                         2,
                         3
                     ;'''
 
-    hr_err_user_count = '''select
-                                to_char(create_date,
-                                'HH24') as "Hour",
-                                case
-                                    when response ~ '.*"message":\s*"([^"]+)"' then substring(response
-                                from
-                                    '.*"message":\s*"([^"]+)"')
-                                    when response ~ '.*"error":\s*"([^"]+)"' then substring(response
-                                from
-                                    '.*"error":\s*"([^"]+)"')
-                                    else response
-                                end as status,
-                                count(distinct(SUBSTRING(request from '.*"receiver_wallet_no":\s*"([^"]+)"')))::text
-                            from
-                                tallypay_issuer.public.request_log rl
-                            where
-                                rl.create_date::date = 'now()'
-                                and rl.create_date <= now() - interval '5 minutes'
-                                and request_id is not null
-                                and request not ilike '%hex%'
-                                and response not ilike '%{%NPSB transfer credit%}%'
-                            group by
-                                1,
-                                2
-                            order by
-                                1 desc,
-                                3 desc
-                            ;'''
-
-    m_log = '''select
-                    to_char(create_date, 'YYYY-MM-DD') as "Hour",
-                    case
-                        when response ilike '%{%NPSB transfer credit%}%' then 'SUCCESS'
-                        when response ~ '.*"message":\s*"([^"]+)"' then substring(response from '.*"message":\s*"([^"]+)"') when response ~ '.*"error":\s*"([^"]+)"' then substring(response  from '.*"error":\s*"([^"]+)"')
-                        else response
-                    end as status,
-                    count(request_id)
-                from
-                    tallypay_issuer.public.request_log rl
-                where
-                    create_date::date >= now() - interval '30 days' 
-                    and create_date <= current_timestamp - interval '5 minutes'
-                    and request_id is not null
-                    and request not ilike '%hex%'
-                group by
-                    1,
-                    2
-                order by
-                    1 asc,
-                    3 desc
-                ;'''
-
     m_cohort = '''select
                         to_char(nti.create_date,
                         'YYYY-MM-DD'),
@@ -119,38 +46,13 @@ def gen_q(q):
                         nti.acquirer_id = nfc.acquirer_id
                     where
                         1 = 1
-                        and nti.create_date::date >= now() - interval '30 days'
-                        and nti.create_date <= now() - interval '5 minutes'
+                        and nti.create_date >= %(start)s AND nti.create_date < %(end)s
                     group by
                         1,
                         2,
                         3
                     ;'''
 
-    m_err_user_count = '''select
-                                to_char(create_date, 'YYYY-MM-DD') as "Day",
-                                case
-                                    when response ~ '.*"message":\s*"([^"]+)"' then substring(response from '.*"message":\s*"([^"]+)"')
-                                    when response ~ '.*"error":\s*"([^"]+)"' then substring(response from '.*"error":\s*"([^"]+)"')
-                                    else response
-                                end as status,
-                                count(distinct(SUBSTRING(request from '.*"receiver_wallet_no":\s*"([^"]+)"')))::text
-                            from
-                                tallypay_issuer.public.request_log rl
-                            where
-                                rl.create_date::date >= now() - interval '30 days'
-                                and rl.create_date <= now() - interval '5 minutes'
-                                and request_id is not null
-                                and request not ilike '%hex%'
-                                and response not ilike '%{%NPSB transfer credit%}%'
-                            group by
-                                1,
-                                2
-                            order by
-                                1 desc,
-                                3 desc
-                            ;'''
-
     m_growth_rate = '''WITH DailyStats AS (
                                     SELECT
                                         TO_CHAR(create_date, 'YYYY-MM-DD') AS transaction_date,
@@ -161,8 +63,8 @@ def gen_q(q):
                                     FROM
                                         tp_bank_service.public.npsb_transaction_info
                                     WHERE
-                                        create_date::date >= now() - interval '30 days'
-                                        AND create_date::date < 'now()'
+                                        create_date >= %(start)s AND create_date < %(end)s
+                                        AND create_date < CURRENT_DATE
                                     GROUP BY
                                         TO_CHAR(create_date, 'YYYY-MM-DD'),
                                         status
@@ -186,51 +88,69 @@ def gen_q(q):
                                     status;'''
 
     query = {
-        'hr_log': hr_log,
         'hr_cohort': hr_cohort,
-        'hr_err_user_count': hr_err_user_count,
-        'm_log': m_log,
         'm_cohort': m_cohort,
-        'm_err_user_count': m_err_user_count,
         'm_growth_rate': m_growth_rate
     }
 
     return query[q]
 
-def pg_conn(db, query):
-    conn = None
-    cur = None
+# Today's hourly cohorts, which only query their recent hours (see bucket_cache)
+hourly_cached = {'hr_cohort'}
+
+# Month cohorts, which only query their recent days: the fetch_days arguments
+# of each. m_growth_rate compares every day with the one before it and lists
+# the newest day first
+daily_cached = {
+    'm_cohort': {'days': 30},
+    'm_growth_rate': {'days': 30, 'lead_days': 1, 'descending': True}
+}
+
+# Function to stream a query's rows into its sheet; a query without rows
+# writes a row of zeros instead
+def update_sheet_with_query(query_key, db_name, sheet_name, headers):
+    query = gen_q(query_key)
     try:
-        conn = psycopg2.connect(
-            database=db,
-            user=os.environ.get("TP_PG_USR"),
-            password=os.environ.get("TP_PG_PWD"),
-            host=os.environ.get("TP_HOST"),
-            port='5432'
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        queryset = cur.fetchall()
+        if query_key in hourly_cached:
+            results = iter(bucket_cache.fetch_today(f"sqr_{query_key}", query, pg_pool.env_db_params(), db_name,
+                                                    lag=bucket_cache.SETTLEMENT_LAG))
+        elif query_key in daily_cached:
+            results = iter(bucket_cache.fetch_days(f"sqr_{query_key}", query, pg_pool.env_db_params(), db_name,
+                                                   lag=bucket_cache.SETTLEMENT_LAG, **daily_cached[query_key]))
+        else:
+            results = pg_pool.stream_rows(query, pg_pool.env_db_params(), db_name)
+        first = next(results, None)
+        if first is None:
+            sheet_update([headers] + [('0',) * len(headers)], sheet_name)
+        else:
+            sheet_update_stream(itertools.chain([headers, first], results), sheet_name)
     except psycopg2.Error as error:
-        queryset = f"Error connecting to Postgres database: {error}"
+        print(f"Error connecting to Postgres database: {error}")
     except Exception as query_error:
-        queryset = f"Error executing query: {query_error}"
-    finally:
-        if cur is not None:
-            cur.close()
-        if conn is not None:
-            conn.close()
-    return queryset
+        print(f"Error executing query: {query_error}")
 
-def update_sheet_with_query(query_key, db_name, sheet_name, headers):
-    query = gen_q(query_key)
-    results = pg_conn(db_name, query)
+# Function to write a request_log tab from the locally extracted aggregates
+def update_sheet_from_store(query_key, sheet_name, headers):
+    try:
+        request_log_extract.refresh("sqr")
+        results = store_queries[query_key]()
+    except Exception as error:
+        print(f"Error extracting request_log: {error}")
+        return
     if not results:
         data = [headers] + [('0',) * len(headers)]
     else:
         data = [headers] + results
     sheet_update(data, sheet_name)
 
+# request_log tabs served from request_log_extract instead of regex queries
+store_queries = {
+    'hr_log': lambda: request_log_extract.sqr_status_counts("hour"),
+    'hr_err_user_count': lambda: request_log_extract.sqr_error_receivers("hour"),
+    'm_log': lambda: request_log_extract.sqr_status_counts("day"),
+    'm_err_user_count': lambda: request_log_extract.sqr_error_receivers("day")
+}
+
 def sqr_main_threaded():
     tasks = [
         ('hr_log', 'tallypay_issuer', 'sqr_log', ('hour', 'status', 'count')),
@@ -244,7 +164,11 @@ def sqr_main_threaded():
 
     threads = []
     for query_key, db_name, sheet_name, headers in tasks:
-        thread = Thread(target=update_sheet_with_query, args=(query_key, db_name, sheet_name, headers))
+        if query_key in store_queries:
+            target, args = update_sheet_from_store, (query_key, sheet_name, headers)
+        else:
+            target, args = update_sheet_with_query, (query_key, db_name, sheet_name, headers)
+        thread = Thread(target=tracing.bind(target, query_key=query_key), args=args)
         thread.start()
         threads.append(thread)
 
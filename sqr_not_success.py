@@ -1,5 +1,5 @@
 import os
-import psycopg2
+import pg_pool
 import pandas as pd
 from datetime import datetime
 from dotenv import load_dotenv
@@ -11,18 +11,7 @@ load_dotenv()
 
 def fetch_data(query, db_params, dbname):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        return pg_pool.fetch_all(query, db_params, dbname)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
@@ -122,4 +111,5 @@ def run_sqr_user_extraction():
     """Wrapper function to execute the main logic."""
     extract_and_calculate("sqr_current_day_unique_failed_sheet")
 
-run_sqr_user_extraction()
+# Scheduled by main_controller after the SQR tabs it reads are refreshed
+# run_sqr_user_extraction()
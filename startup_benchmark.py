@@ -0,0 +1,62 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Packages main_controller must not load before its jobs run; the jobs
+# import them themselves (see job_scheduler.lazy_job)
+HEAVY_MODULES = ["pandas", "numpy", "matplotlib", "seaborn", "mysql", "pretty_html_table"]
+
+
+# Function to import a module in a fresh interpreter under -X importtime and
+# return (self_us, cumulative_us, module) for every module it loaded
+def import_times(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        timings.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of main_controller.")
+    parser.add_argument("--module", default="main_controller")
+    parser.add_argument("--runs", type=int, default=5, help="imports to take the best of")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="exit with an error when the import takes longer than this")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    totals = [sum(self_us for self_us, _, _ in timings) for timings in runs]
+    best = runs[totals.index(min(totals))]
+    total_ms = min(totals) / 1000
+
+    print(f"import {args.module}: {total_ms:.1f} ms (best of {args.runs}), {len(best)} modules")
+    print("\nSlowest imports (cumulative):")
+    for self_us, cumulative_us, name in sorted(best, key=lambda row: -row[1])[:args.top]:
+        print(f"{cumulative_us / 1000:>9.1f} ms  {self_us / 1000:>8.1f} ms self  {name.strip()}")
+
+    loaded = {name.strip().split(".")[0] for _, _, name in best}
+    heavy = [module for module in HEAVY_MODULES if module in loaded]
+    failed = False
+    if heavy:
+        print(f"\nLoaded at startup, should only load when a job runs: {', '.join(heavy)}")
+        failed = True
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"\nImport took {total_ms:.1f} ms, over the limit of {args.max_ms:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import json
+import os
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+# The date filters of the dashboard queries were rewritten as ranges on the
+# bare timestamp column so a btree index on it can be used. This checks every
+# shape of those ranges with EXPLAIN against a local Postgres, e.g.
+#   TEST_PG_DSN="dbname=postgres user=postgres host=localhost" python -m pytest tests
+# Only temporary tables are created.
+TEST_PG_DSN = os.getenv("TEST_PG_DSN")
+
+pytestmark = pytest.mark.skipif(not TEST_PG_DSN, reason="TEST_PG_DSN is not set")
+
+# (where the shape is used, filter on txn.create_date or btr.issue_time)
+RANGE_FILTERS = [
+    ("NPSB, avg_4week, Visa_Card_Transfer: today",
+     "create_date >= CURRENT_DATE AND create_date < CURRENT_DATE + interval '1 day' "
+     "AND create_date <= NOW() - interval '5 minutes'"),
+    ("cash_in_rocket, moneyout_controller, Visa_Card_Transfer: last 30 days",
+     "create_date >= CURRENT_DATE - interval '29 days' AND create_date <= NOW() - interval '5 minutes'"),
+    ("service_health_all_service: today and the last hour",
+     "create_date >= LEAST(CURRENT_DATE, NOW() - interval '30 minutes') "
+     "AND create_date <= NOW() - interval '3 minutes'"),
+    ("bucket_cache queries (recharge, sqr, nagadin, tk_log)",
+     "create_date >= %(start)s AND create_date < %(end)s"),
+    ("avg_4week, bankout_controller: local day 3 days ago",
+     "issue_time >= CURRENT_DATE - interval '3 days' - interval '6 hours' "
+     "AND issue_time < CURRENT_DATE - interval '2 days' - interval '6 hours'"),
+    ("daily_service_analysis: previous local day",
+     "issue_time >= CURRENT_DATE - interval '1 day' - interval '6 hours' "
+     "AND issue_time < CURRENT_DATE - interval '6 hours'"),
+    ("avg_4week: last 4 weeks in local time",
+     "issue_time >= NOW() - interval '4 weeks' - interval '6 hours' "
+     "AND issue_time <= NOW() - interval '5 minutes' - interval '6 hours'"),
+]
+
+# The forms the filters were rewritten from; they must not use the index,
+# or the check would prove nothing
+OLD_FILTERS = [
+    "create_date::date = CURRENT_DATE",
+    "DATE(create_date) = CURRENT_DATE",
+    "(issue_time + interval '6 hours')::date = CURRENT_DATE - interval '3 days'",
+]
+
+# service_health_all_service joins each generated day to its transactions
+JOIN_QUERY = """
+    WITH date_generator AS (SELECT CURRENT_DATE AS date)
+    SELECT dg.date, COUNT(txn.create_date)
+    FROM date_generator dg
+    LEFT JOIN txn
+        ON txn.create_date >= dg.date
+       AND txn.create_date < dg.date + interval '1 day'
+       AND txn.create_date <= NOW() - interval '3 minutes'
+    GROUP BY dg.date
+"""
+
+
+@pytest.fixture(scope="module")
+def cursor():
+    conn = psycopg2.connect(TEST_PG_DSN)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE txn (id bigserial, create_date timestamp NOT NULL, status text);
+                CREATE TEMP TABLE btr (id bigserial, issue_time timestamp NOT NULL, channel text);
+                INSERT INTO txn (create_date, status)
+                    SELECT LOCALTIMESTAMP - i * interval '5 minutes', 'SUCCESS'
+                    FROM generate_series(1, 100000) i;
+                INSERT INTO btr (issue_time, channel)
+                    SELECT LOCALTIMESTAMP - i * interval '5 minutes', 'CBL'
+                    FROM generate_series(1, 100000) i;
+                CREATE INDEX ON txn (create_date);
+                CREATE INDEX ON btr (issue_time);
+                ANALYZE txn;
+                ANALYZE btr;
+            """)
+            # Some ranges are wide enough that a sequential scan would be
+            # cheaper on this data; switching it off shows whether the index
+            # can be used at all
+            cur.execute("SET enable_seqscan = off")
+            yield cur
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+# Function to return the plan nodes of a query's EXPLAIN (FORMAT JSON)
+def plan_nodes(cur, query, params=None):
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = []
+    pending = [plan[0]["Plan"]]
+    while pending:
+        node = pending.pop()
+        nodes.append(node)
+        pending.extend(node.get("Plans", []))
+    return nodes
+
+
+# Function to tell whether a plan searches the index on column
+def uses_index(nodes, column):
+    return any(
+        node["Node Type"] in ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+        and column in node.get("Index Cond", "")
+        for node in nodes
+    )
+
+
+def filter_query(where):
+    table, column = ("btr", "issue_time") if "issue_time" in where else ("txn", "create_date")
+    return f"SELECT COUNT(*) FROM {table} WHERE {where}", column
+
+
+@pytest.mark.parametrize("used_in, where", RANGE_FILTERS, ids=[used_in for used_in, _ in RANGE_FILTERS])
+def test_range_filter_uses_index(cursor, used_in, where):
+    query, column = filter_query(where)
+    cursor.execute("SELECT CURRENT_DATE - interval '29 days', LOCALTIMESTAMP")
+    start, end = cursor.fetchone()
+    params = {"start": start, "end": end} if "%(start)s" in where else None
+    nodes = plan_nodes(cursor, query, params)
+    assert uses_index(nodes, column), json.dumps(nodes, indent=2, default=str)
+
+
+@pytest.mark.parametrize("where", OLD_FILTERS)
+def test_old_filter_does_not_use_index(cursor, where):
+    query, column = filter_query(where)
+    assert not uses_index(plan_nodes(cursor, query), column)
+
+
+def test_day_join_uses_index(cursor):
+    assert uses_index(plan_nodes(cursor, JOIN_QUERY), "create_date")
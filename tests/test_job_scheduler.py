@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+import job_scheduler
+
+
+def test_abandoned_run_does_not_report_for_the_next_run():
+    release_first = threading.Event()
+    second_done = threading.Event()
+    stop_event = threading.Event()
+    calls = []
+    reports = []
+
+    def slow():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            # Outlives its timeout, then reports after it was abandoned
+            release_first.wait(5)
+        else:
+            time.sleep(0.05)
+            second_done.set()
+
+    def on_finish(name, status):
+        reports.append((status, second_done.is_set()))
+        if status == job_scheduler.TIMED_OUT:
+            # Let the abandoned run put its result on the queue and exit
+            # before the scheduler looks for due jobs again
+            release_first.set()
+            time.sleep(0.1)
+        else:
+            stop_event.set()
+
+    jobs = {"slow": {"func": slow, "timeout": 0.1, "interval": 0}}
+    runner = threading.Thread(target=job_scheduler.run_forever, args=(jobs,),
+                              kwargs={"stop_event": stop_event, "shutdown_grace": 1, "on_finish": on_finish})
+    runner.start()
+    runner.join(5)
+    stop_event.set()
+    runner.join(5)
+
+    assert reports[0] == (job_scheduler.TIMED_OUT, False)
+    # The first "done" is the second run's own result, not the stale one
+    assert reports[1] == (job_scheduler.DONE, True)
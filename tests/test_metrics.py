@@ -0,0 +1,87 @@
+import re
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+import metrics
+
+
+# Function to return the sample lines of one metric in the rendered exposition
+def samples(text, name):
+    return [line for line in text.splitlines() if re.match(rf"{name}(\{{| )", line)]
+
+
+def test_render_has_help_and_type_for_every_metric():
+    text = metrics.render()
+    for metric in metrics._registry:
+        assert f"# HELP {metric.name} {metric.documentation}" in text
+        assert f"# TYPE {metric.name} {metric.kind}" in text
+    assert text.endswith("\n")
+
+
+def test_tab_series_are_kept_apart_per_spreadsheet():
+    metrics.TAB_ROWS.set(10, spreadsheet="sheet1", tab="summary")
+    metrics.TAB_ROWS.set(20, spreadsheet="sheet2", tab="summary")
+    metrics.ROWS_WRITTEN.inc(3, spreadsheet="sheet1", tab="summary")
+    metrics.ROWS_WRITTEN.inc(4, spreadsheet="sheet2", tab="summary")
+    text = metrics.render()
+
+    assert 'dashboard_tab_rows{spreadsheet="sheet1",tab="summary"} 10.0' in samples(text, "dashboard_tab_rows")
+    assert 'dashboard_tab_rows{spreadsheet="sheet2",tab="summary"} 20.0' in samples(text, "dashboard_tab_rows")
+    written = samples(text, "dashboard_rows_written_total")
+    assert 'dashboard_rows_written_total{spreadsheet="sheet1",tab="summary"} 3.0' in written
+    assert 'dashboard_rows_written_total{spreadsheet="sheet2",tab="summary"} 4.0' in written
+
+
+def test_callback_gauge_renders_its_label_tuples():
+    gauge = metrics.Gauge("test_callback_gauge", "A gauge computed at scrape time.", ("spreadsheet", "tab"))
+    try:
+        gauge.set_callback(lambda: {("sheet1", "a"): 1.5, ("sheet2", "a"): 2})
+        lines = gauge.render()
+    finally:
+        metrics._registry.remove(gauge)
+    assert lines == [
+        "# HELP test_callback_gauge A gauge computed at scrape time.",
+        "# TYPE test_callback_gauge gauge",
+        'test_callback_gauge{spreadsheet="sheet1",tab="a"} 1.5',
+        'test_callback_gauge{spreadsheet="sheet2",tab="a"} 2.0',
+    ]
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_histogram_seconds", "A test histogram.", ("job",), buckets=(1, 5))
+    try:
+        histogram.observe(0.5, job="a")
+        histogram.observe(3, job="a")
+        histogram.observe(10, job="a")
+        text = "\n".join(histogram.render())
+    finally:
+        metrics._registry.remove(histogram)
+    assert 'test_histogram_seconds_bucket{job="a",le="1.0"} 1.0' in text
+    assert 'test_histogram_seconds_bucket{job="a",le="5.0"} 2.0' in text
+    assert 'test_histogram_seconds_bucket{job="a",le="+Inf"} 3.0' in text
+    assert 'test_histogram_seconds_sum{job="a"} 13.5' in text
+    assert 'test_histogram_seconds_count{job="a"} 3.0' in text
+
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter("test_escaped_total", "A test counter.", ("tab",))
+    try:
+        counter.inc(tab='a "quoted"\\tab\n')
+        lines = counter.render()
+    finally:
+        metrics._registry.remove(counter)
+    assert lines[-1] == 'test_escaped_total{tab="a \\"quoted\\"\\\\tab\\n"} 1.0'
+
+
+def test_staleness_is_labelled_by_spreadsheet_and_tab():
+    isheet_controller = pytest.importorskip("isheet_controller")
+    isheet_controller.mark_fresh(isheet_controller.SPREADSHEET_ID, "staleness_tab")
+    isheet_controller.mark_fresh("another-spreadsheet", "staleness_tab")
+    staleness = samples(metrics.render(), "dashboard_tab_staleness_seconds")
+    assert any(line.startswith('dashboard_tab_staleness_seconds{spreadsheet="sheet1",tab="staleness_tab"} ')
+               for line in staleness)
+    assert any(line.startswith('dashboard_tab_staleness_seconds{spreadsheet="another-spreadsheet",'
+                               'tab="staleness_tab"} ')
+               for line in staleness)
@@ -1,8 +1,9 @@
-import psycopg2
-from isheet_controller import sheet_update
-from decimal import Decimal
+import pg_pool
+import bucket_cache
+import tracing
+from isheet_controller import sheet_update_stream
 from dotenv import load_dotenv
-import datetime
+import itertools
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -23,7 +24,7 @@ FROM
     eventapp_event
 WHERE 
     message = 'data-backup-done'
-    AND DATE(created_at) = CURRENT_DATE
+    AND created_at >= %(start)s AND created_at < %(end)s
 GROUP BY 
     hr, event_name, message, DATE(created_at)
 ORDER BY 
@@ -44,7 +45,7 @@ FROM
 WHERE 
    "level" = 'ERROR'
    and (ee.event_name = 'v6_device_to_server_sync' or ee.event_name = 'v5_device_to_server_sync' or ee.event_name = 'device_to_server_sync_v4')
-    AND DATE(created_at) = CURRENT_DATE
+    AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + interval '1 day'
 GROUP BY 
     hr, event_name, message, details, DATE(created_at)
 ORDER BY 
@@ -63,7 +64,7 @@ FROM eventapp_event
 WHERE 
     event_name = 'sync_app_event'
     AND "level" = 'INFO'
-    AND DATE(created_at) = CURRENT_DATE
+    AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + interval '1 day'
 GROUP BY 
     TO_CHAR(created_at, 'HH24'), 
     CASE 
@@ -87,7 +88,7 @@ FROM
 WHERE 
     event_name = 'sync_app_event'
     and level= 'ERROR'
-    AND DATE(created_at) = CURRENT_DATE
+    AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + interval '1 day'
 GROUP BY 
     hr, "level", event_name, message, DATE(created_at)
 ORDER BY 
@@ -164,43 +165,35 @@ limit 50;
    """
 
 }
-# Function to fetch data from the database
-def fetch_data(query, db_params, dbname):
+# Today's hourly cohorts, which only query their recent hours (see bucket_cache)
+hourly_cached = {"today_data_backup_count"}
+
+# Function to stream rows from the database, or None if the query failed;
+# with a cache_key the query is one of today's hourly cohorts
+def fetch_data(query, db_params, dbname, cache_key=None):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        if cache_key:
+            rows = iter(bucket_cache.fetch_today(cache_key, query, db_params, dbname))
+        else:
+            rows = pg_pool.stream_rows(query, db_params, dbname, convert=True)
+        first = next(rows, None)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
+    return None if first is None else itertools.chain([first], rows)
 
-# Function to handle each query and update the corresponding Google Sheet
+# Function to handle each query and stream its rows into the corresponding Google Sheet
 def process_query(service_name, query, db_params, dbname, headers, sheet_name):
-    result = fetch_data(query, db_params, dbname)
-    data = [headers]
+    cache_key = f"tk_log_{service_name}" if service_name in hourly_cached else None
+    result = fetch_data(query, db_params, dbname, cache_key)
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
-
-        sheet_update(data, sheet_name)
-        print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
+        data = itertools.chain([headers], (row for row in result if len(row) == len(headers)))
+        if sheet_update_stream(data, sheet_name) is not None:
+            print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
     else:
         print(f"No data returned for {service_name}")
+
 def tallykhata_log():
     db_params = {
         "user": os.getenv("TP_PG_USR_2"),
@@ -246,7 +239,7 @@ def tallykhata_log():
     with ThreadPoolExecutor(max_workers=5) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params,
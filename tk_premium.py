@@ -1,8 +1,9 @@
-import psycopg2
+import bucket_cache
+import pg_pool
+import row_convert
+import tracing
 from isheet_controller import sheet_update
-from decimal import Decimal
 from dotenv import load_dotenv
-import datetime
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -22,7 +23,7 @@ queries = {
     FROM
         payment_purchasesubscription
     WHERE
-        created_at::date = CURRENT_DATE
+        created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + interval '1 day'
     GROUP BY
         1, 2, 3, 4, 5
     ORDER BY
@@ -42,7 +43,7 @@ queries = {
     FROM
     payment_purchasesubscription
     WHERE
-    created_at >= NOW() - interval'1 month'
+    created_at >= %(start)s AND created_at < %(end)s
     GROUP
     BY
     1, 2, 3, 4
@@ -88,38 +89,33 @@ queries = {
 
 }
 
-# Function to fetch data from the database
-def fetch_data(query, db_params, dbname):
+# Month cohorts, which only query their recent days (see bucket_cache)
+daily_cached = {"monthly_premium_purchase"}
+
+# Function to fetch data from the database; a daily cached query is fetched
+# through bucket_cache under its cache_key
+def fetch_data(query, db_params, dbname, cache_key=None):
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=db_params['user'],
-            password=db_params['password'],
-            host=db_params['host']
-        )
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        conn.close()
-        return result
+        if cache_key:
+            return bucket_cache.fetch_days(cache_key, query, db_params, dbname, days=31, descending=True)
+        return pg_pool.fetch_all(query, db_params, dbname)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return None
 
 # Function to handle each query and update the corresponding Google Sheet
 def process_query(service_name, query, db_params, dbname, headers, sheet_name):
-    result = fetch_data(query, db_params, dbname)
+    cache_key = f"tk_premium_{service_name}" if service_name in daily_cached else None
+    result = fetch_data(query, db_params, dbname, cache_key)
     data = [headers]
 
     if result:
-        for row in result:
-            converted_row = [
-                x.strftime('%Y-%m-%d') if isinstance(x, datetime.date) else float(x) if isinstance(x, Decimal) else x
-                for x in row
-            ]
-            if len(converted_row) == len(headers):
-                data.append(converted_row)
+        with tracing.span("transform", rows=len(result)):
+            # Cached rows come back converted already
+            rows = result if cache_key else row_convert.convert_rows(result, result.description)
+            for converted_row in rows:
+                if len(converted_row) == len(headers):
+                    data.append(converted_row)
 
         sheet_update(data, sheet_name)
         print(f"Data for {service_name} updated successfully in sheet '{sheet_name}'.")
@@ -158,7 +154,7 @@ def tk_premium():
     with ThreadPoolExecutor(max_workers=5) as executor:
         future_to_service = {
             executor.submit(
-                process_query,
+                tracing.bind(process_query, query_key=service_name),
                 service_name,
                 query,
                 db_params,
@@ -0,0 +1,216 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+import local_store
+
+load_dotenv()
+
+# Spans are appended to this JSONL file, which is rotated to TRACE_FILE.1
+# once it grows past TRACE_MAX_BYTES
+TRACE_FILE = os.getenv("DASHBOARD_TRACE_FILE",
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl"))
+TRACE_MAX_BYTES = int(os.getenv("DASHBOARD_TRACE_MAX_BYTES", 50 * 1024 * 1024))
+TRACING_ENABLED = os.getenv("DASHBOARD_TRACING", "1") == "1"
+# Summaries cover each job's last SUMMARY_RUNS runs. The stage timings of
+# those runs are kept in a small local store, written once per finished run,
+# so a summary does not read the trace file back. main_controller prints the
+# summary after each cycle only when DASHBOARD_TRACE_SUMMARY=1
+SUMMARY_RUNS = int(os.getenv("DASHBOARD_TRACE_SUMMARY_RUNS", 20))
+PRINT_SUMMARY = os.getenv("DASHBOARD_TRACE_SUMMARY", "0") == "1"
+SUMMARY_STORE = "trace_summary.sqlite3"
+SUMMARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS run_stages (
+    job TEXT NOT NULL,
+    run TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    stage TEXT NOT NULL,
+    durations TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS run_stages_job ON run_stages (job, finished_at);
+"""
+
+# Tags (job, run, query_key, ...) added to every span opened in this context
+_tags = contextvars.ContextVar("tracing_tags", default={})
+_file = None
+_file_lock = threading.Lock()
+# Callables receiving every finished span, e.g. to feed metrics
+_listeners = []
+# run id -> {stage: [durations]} of the job runs in progress
+_run_stages = {}
+_run_stages_lock = threading.Lock()
+
+
+def _emit(record):
+    global _file
+    line = json.dumps(record, default=str) + "\n"
+    with _file_lock:
+        try:
+            if _file is None:
+                _file = open(TRACE_FILE, "a", encoding="utf-8")
+            elif _file.tell() > TRACE_MAX_BYTES:
+                _file.close()
+                os.replace(TRACE_FILE, TRACE_FILE + ".1")
+                _file = open(TRACE_FILE, "a", encoding="utf-8")
+            _file.write(line)
+            _file.flush()
+        except OSError as e:
+            print(f"Error writing trace: {e}")
+
+
+def add_listener(func):
+    """Registers func(record) to be called with every finished span."""
+    _listeners.append(func)
+
+
+@contextmanager
+def tag(**tags):
+    """Adds tags to every span opened inside the block."""
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+@contextmanager
+def span(stage, **tags):
+    """
+    Times the block as one stage and writes it to the trace file, tagged with
+    the context's tags and the given ones. The block receives the record and
+    can add tags to it, e.g. span["rows"] = len(rows).
+    """
+    record = {"stage": stage, **_tags.get(), **tags}
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield record
+        record["status"] = "ok"
+    except BaseException as e:
+        record["status"] = "error"
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["duration"] = round(time.perf_counter() - start, 6)
+        record["ts"] = round(started_at, 3)
+        for listener in _listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                print(f"Error in span listener: {e}")
+        if TRACING_ENABLED:
+            _emit(record)
+            _add_to_run(record)
+
+
+def _add_to_run(record):
+    with _run_stages_lock:
+        stages = _run_stages.get(record.get("run"))
+        if stages is not None:
+            stages.setdefault(record["stage"], []).append(record["duration"])
+
+
+@contextmanager
+def job_run(job_name):
+    """Tags everything inside with the job and a run id and times the whole run."""
+    run = uuid.uuid4().hex[:12]
+    with _run_stages_lock:
+        _run_stages[run] = {}
+    try:
+        with tag(job=job_name, run=run):
+            with span("job"):
+                yield
+    finally:
+        with _run_stages_lock:
+            stages = _run_stages.pop(run)
+        if TRACING_ENABLED:
+            _store_run(job_name, run, stages)
+
+
+# Function to store the stage timings of a finished run and drop the runs of
+# the job beyond the last SUMMARY_RUNS
+def _store_run(job_name, run, stages):
+    try:
+        with local_store.connect(SUMMARY_STORE, SUMMARY_SCHEMA) as conn:
+            finished_at = time.time()
+            conn.executemany(
+                "INSERT INTO run_stages (job, run, finished_at, stage, durations) VALUES (?, ?, ?, ?, ?)",
+                [(job_name, run, finished_at, stage, json.dumps(durations))
+                 for stage, durations in stages.items()]
+            )
+            conn.execute(
+                """
+                DELETE FROM run_stages
+                WHERE job = :job AND finished_at <= (
+                    SELECT finished_at FROM run_stages WHERE job = :job
+                    GROUP BY run, finished_at ORDER BY finished_at DESC LIMIT 1 OFFSET :keep
+                )
+                """,
+                {"job": job_name, "keep": SUMMARY_RUNS}
+            )
+    except sqlite3.Error as e:
+        print(f"Error storing stage timings of {job_name}: {e}")
+
+
+def bind(func, **tags):
+    """
+    Wraps func so it runs with the caller's tags plus the given ones. Threads
+    do not inherit context variables, so work handed to an executor is
+    submitted through bind to stay attributed to its job.
+    """
+    bound_tags = {**_tags.get(), **tags}
+
+    def wrapper(*args, **kwargs):
+        token = _tags.set(bound_tags)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _tags.reset(token)
+
+    return wrapper
+
+
+def _percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(runs=SUMMARY_RUNS, jobs=None):
+    """
+    Returns a text table of count, p50, p95 and total seconds per (job, stage)
+    over each job's last `runs` runs (at most SUMMARY_RUNS are kept).
+    """
+    with local_store.connect(SUMMARY_STORE, SUMMARY_SCHEMA) as conn:
+        rows = conn.execute(
+            """
+            SELECT job, stage, durations FROM (
+                SELECT job, stage, durations,
+                       DENSE_RANK() OVER (PARTITION BY job ORDER BY finished_at DESC, run) AS position
+                FROM run_stages
+            ) WHERE position <= ?
+            """,
+            (runs,)
+        ).fetchall()
+
+    durations = {}
+    for job, stage, values in rows:
+        if jobs is None or job in jobs:
+            durations.setdefault((job, stage), []).extend(json.loads(values))
+
+    lines = [f"{'job':<32} {'stage':<14} {'count':>6} {'p50':>9} {'p95':>9} {'total':>10}"]
+    for (job, stage), values in sorted(durations.items()):
+        values.sort()
+        lines.append(f"{job:<32} {stage:<14} {len(values):>6} {_percentile(values, 50):>9.3f} "
+                     f"{_percentile(values, 95):>9.3f} {sum(values):>10.2f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(summarize())
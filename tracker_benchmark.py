@@ -0,0 +1,116 @@
+import argparse
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+import operation_tracker
+import tikcet_tracker
+
+ADDRESSES = ["irfan.ahmed@surecash.net", "jannat.akter@surecash.net", "javeed@surecash.net",
+             "shilton.saha@surecash.net", "afzal@surecash.net"]
+
+
+# Function to build rows shaped like the trackers' journal query results:
+# journal id, issue id, type, user id, notes, created on, private notes,
+# subject, address, hours
+def synthetic_rows(count, seed=0):
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=30)
+    issues = max(1, count // 10)
+    rows = []
+    for journal_id in range(count):
+        created_on = start + timedelta(minutes=rng.randrange(30 * 24 * 60))
+        rows.append([journal_id, rng.randrange(issues), "Issue", 44, "", created_on, 0,
+                     f"ticket {journal_id}", rng.choice(ADDRESSES), rng.random() * 4])
+    return rows
+
+
+# The implementations the trackers had before distinct_db_result and
+# date_wise_count were rewritten, kept as they were to compare against
+def baseline_ticket_distinct(db_result):
+    list1 = db_result.copy()
+    for i in db_result:
+        for j in db_result:
+            if i[1] == j[1] and i[0] != j[0] and i[5] < j[5]:
+                if i in list1:
+                    list1.remove(i)
+    return list1
+
+
+def baseline_operation_distinct(db_result):
+    list1 = []
+    for i in db_result:
+        flag = False
+        for j in list1:
+            if i[1] == j[1]:
+                flag = True
+                break
+        if flag == False:
+            list1.append(i)
+    return list1
+
+
+# Tickets per person and date; the ticket tracker counts them, the
+# operation tracker totals their hours and rounds up
+def baseline_date_wise_count(date_list, db_list, hours):
+    people = ["irfan", "jannat", "afzal", "javeed", "shilton"]
+    counts = {person: [] for person in people}
+    for date in date_list:
+        totals = dict.fromkeys(people, 0)
+        for ticket in db_list:
+            date_string = ticket[5].strftime('%Y-%m-%d')
+            for person in people:
+                if date == date_string and person in ticket[8]:
+                    totals[person] += float(ticket[9]) if hours else 1
+                    break
+        for person in people:
+            counts[person].append(math.ceil(totals[person]) if hours else totals[person])
+    return [counts["irfan"], counts["jannat"], counts["javeed"], counts["shilton"], counts["afzal"]]
+
+
+# Function to time func over rows, best of repeat runs; returns the time
+# and the last result
+def best_time(func, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(rows)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the tracker mail aggregation on synthetic journals, "
+                                                 "before and after the rewrite.")
+    parser.add_argument("--rows", type=int, default=2000, help="about 30 days of journals")
+    parser.add_argument("--scale", type=int, default=10, help="also time this many times the rows")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline-repeat", type=int, default=1,
+                        help="runs of the old implementations, which take minutes on large inputs")
+    args = parser.parse_args()
+
+    date_list = tikcet_tracker.thirty_days_list()
+    cases = [
+        ("tikcet_tracker.distinct_db_result", baseline_ticket_distinct, tikcet_tracker.distinct_db_result),
+        ("operation_tracker.distinct_db_result", baseline_operation_distinct,
+         operation_tracker.distinct_db_result),
+        ("tikcet_tracker.date_wise_count", lambda rows: baseline_date_wise_count(date_list, rows, False),
+         lambda rows: tikcet_tracker.date_wise_count(date_list, rows)),
+        ("operation_tracker.date_wise_count", lambda rows: baseline_date_wise_count(date_list, rows, True),
+         lambda rows: operation_tracker.date_wise_count(date_list, rows)),
+    ]
+    print(f"{'':<40} {'rows':>8} {'before ms':>11} {'after ms':>10} {'speedup':>9}")
+    for count in (args.rows, args.rows * args.scale):
+        rows = synthetic_rows(count)
+        for name, baseline, func in cases:
+            before, expected = best_time(baseline, rows, args.baseline_repeat)
+            after, result = best_time(func, rows, args.repeat)
+            note = "" if result == expected else "  (results differ)"
+            print(f"{name:<40} {count:>8} {before * 1000:>11.1f} {after * 1000:>10.1f} "
+                  f"{before / max(after, 1e-9):>8.0f}x{note}")
+
+
+if __name__ == "__main__":
+    main()